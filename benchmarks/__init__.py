@@ -0,0 +1,44 @@
+"""Benchmarks for the tracker, run from the project root, e.g.
+
+    python -m benchmarks.packed_ingest
+
+Benchmarks that need a database create and destroy their own test
+database, the same way the test runner does."""
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup():
+    """Configure Django so models and forms can be imported."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tracker.settings")
+    import django
+    django.setup()
+
+
+def best_of(function, repeat=5):
+    """Return the fastest of several runs of function, in seconds."""
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@contextmanager
+def test_database():
+    """Run the body against a throwaway test database."""
+    from django.db import connection
+    from django.test.utils import (
+        setup_test_environment,
+        teardown_test_environment,
+    )
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
@@ -0,0 +1,104 @@
+"""Measure geofence evaluation against many fences.
+
+Creates --fences random hexagons over a one degree square, all belonging
+to one user, then prints points per second for finding and testing the
+fences near each --batch of points of a random walk across the square,
+and for save_points with and without the fences.
+
+    python -m benchmarks.geofence_evaluation --fences 10000"""
+import argparse
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks import setup, test_database
+
+SOUTH, WEST = 47.0, -123.0
+
+
+def hexagon(lat, lng, radius):
+    """Vertices of a hexagon around a point."""
+    return [
+        [lat + radius * math.sin(angle), lng + radius * math.cos(angle)]
+        for angle in (i * math.pi / 3 for i in range(6))
+    ]
+
+
+def walk(count, seed=1):
+    """Latitudes and longitudes of a random walk over the square."""
+    rng = np.random.RandomState(seed)
+    steps = rng.normal(scale=0.002, size=(count, 2))
+    position = np.cumsum(steps, axis=0) + (SOUTH + 0.5, WEST + 0.5)
+    position[:, 0] = np.clip(position[:, 0], SOUTH, SOUTH + 1)
+    position[:, 1] = np.clip(position[:, 1], WEST, WEST + 1)
+    return position[:, 0], position[:, 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fences', type=int, default=10000)
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+    setup()
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from tracker_device import geofences
+    from tracker_device.ingest import save_points
+    from tracker_device.models import Geofence, GeofenceEvent, TrackerDevice
+
+    random.seed(1)
+    lats, lngs = walk(args.points)
+    with test_database():
+        user = User.objects.create(username='bench')
+        device = TrackerDevice.objects.create(user=user)
+        plain = TrackerDevice.objects.create(
+            user=User.objects.create(username='plain'))
+        Geofence.objects.bulk_create([
+            Geofence(user=user, vertices=json.dumps(hexagon(
+                random.uniform(SOUTH, SOUTH + 1),
+                random.uniform(WEST, WEST + 1),
+                random.uniform(0.005, 0.05))))
+            for i in range(args.fences)
+        ], batch_size=500)
+        start = time.perf_counter()
+        geofences.fence_index.refresh()
+        print('{} fences indexed in {:.2f} s'.format(
+            args.fences, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        tested = 0
+        for first in range(0, args.points, args.batch):
+            batch = slice(first, first + args.batch)
+            near, owned = geofences.fence_index.near(
+                device.pk, lats[batch], lngs[batch])
+            geofences.contains(near, lats[batch], lngs[batch])
+            tested += len(near)
+        elapsed = time.perf_counter() - start
+        print('index and test: {:.0f} points/s, {:.0f} fences per '
+              'batch'.format(
+                  args.points / elapsed,
+                  tested / math.ceil(args.points / args.batch)))
+
+        epoch = datetime(2016, 1, 1, tzinfo=timezone.utc)
+        for name, target in [('without fences', plain),
+                             ('with fences', device)]:
+            start = time.perf_counter()
+            for first in range(0, args.points, args.batch):
+                save_points(target.pk, [
+                    (epoch + timedelta(seconds=5 * i), lats[i], lngs[i], 0)
+                    for i in range(first, min(first + args.batch,
+                                              args.points))
+                ])
+            elapsed = time.perf_counter() - start
+            print('save_points {}: {:.0f} points/s'.format(
+                name, args.points / elapsed))
+        print('{} events'.format(GeofenceEvent.objects.count()))
+
+
+if __name__ == '__main__':
+    main()
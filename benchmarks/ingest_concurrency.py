@@ -0,0 +1,180 @@
+"""Load test many slow uploads against WSGI and the asyncio ingest server.
+
+Opens --connections client connections spread over --ramp seconds,
+each posting one data point but dribbling its body over --transfer
+seconds like a device on a poor GSM link, and counts how many are
+answered before --deadline.
+
+The WSGI side runs the Django application with a fixed pool of
+--workers threads, standing in for the same number of synchronous WSGI
+workers; every slow upload holds one for its whole transfer. The asyncio
+side is tracker_device.ingest_server on one event loop.
+
+    python -m benchmarks.ingest_concurrency --connections 1000
+
+Use a PostgreSQL database; SQLite serializes the concurrent writes."""
+import argparse
+import asyncio
+import io
+import random
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+from benchmarks import setup, test_database
+
+
+class PooledWSGIServer(WSGIServer):
+    """WSGI server handling each connection on a fixed size thread pool."""
+
+    request_queue_size = 4096
+
+    def __init__(self, address, workers):
+        WSGIServer.__init__(self, address, QuietHandler)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Request handler that doesn't log requests or clients hanging up."""
+
+    def log_message(self, *args):
+        pass
+
+    def get_stderr(self):
+        return io.StringIO()
+
+
+def serve_wsgi(port, workers):
+    """Serve the Django application from a background thread."""
+    from django.core.wsgi import get_wsgi_application
+    server = PooledWSGIServer(('127.0.0.1', port), workers)
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_async(port):
+    """Serve the asyncio ingest server from a background thread."""
+    from tracker_device.ingest_server import IngestServer, PointBatcher
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        batcher = PointBatcher()
+        batcher.start()
+        ingest = IngestServer(batcher)
+        loop.run_until_complete(asyncio.start_server(
+            ingest.handle, '127.0.0.1', port, backlog=4096))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return loop
+
+
+async def slow_upload(port, body, delay, transfer, chunks):
+    """Post body in chunks spread over transfer seconds, after delay."""
+    await asyncio.sleep(delay)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write((
+            'POST /device/data/create HTTP/1.1\r\n'
+            'Host: localhost\r\n'
+            'Content-Type: application/x-www-form-urlencoded\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: close\r\n\r\n'
+        ).format(len(body)).encode('ascii'))
+        size = -(-len(body) // chunks)
+        for start in range(0, len(body), size):
+            await asyncio.sleep(transfer / chunks)
+            writer.write(body[start:start + size])
+            await writer.drain()
+        status = await reader.readline()
+        return status.split(b' ')[1] in (b'201', b'302')
+    finally:
+        writer.close()
+
+
+async def load(port, bodies, ramp, transfer, chunks, deadline):
+    """Run the uploads, returning (answered, failed, seconds)."""
+    start = time.perf_counter()
+    tasks = [
+        asyncio.ensure_future(slow_upload(
+            port, body, random.uniform(0, ramp), transfer, chunks))
+        for body in bodies
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    answered = sum(
+        1 for task in done if not task.exception() and task.result())
+    return answered, len(bodies) - answered, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ramp', type=float, default=5.0)
+    parser.add_argument('--transfer', type=float, default=2.0)
+    parser.add_argument('--chunks', type=int, default=4)
+    parser.add_argument('--deadline', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=18000)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    setup()
+    from django.contrib.auth.models import User
+    from django.test.utils import override_settings
+    from django.utils.http import urlencode
+    from tracker_device.models import TrackerDevice
+
+    with test_database(), override_settings(ALLOWED_HOSTS=['*']):
+        user = User.objects.create(username='load')
+        device = TrackerDevice.objects.create(user=user)
+        start = datetime(2016, 1, 1)
+        serve_wsgi(args.port, args.workers)
+        serve_async(args.port + 1)
+        print(
+            '{} connections over {}s, {}s transfer each, {}s deadline'.format(
+                args.connections, args.ramp, args.transfer, args.deadline))
+        print('{:<24}{:>10}{:>10}{:>10}'.format(
+            'server', 'answered', 'failed', 'seconds'))
+        for name, port, offset in (
+                ('wsgi ({} workers)'.format(args.workers), args.port, 0),
+                ('asyncio', args.port + 1, args.connections)):
+            bodies = [
+                urlencode(dict(
+                    time=(start + timedelta(seconds=offset + i)).strftime(
+                        '%m/%d/%Y %H:%M:%S'),
+                    lat=i, lng=i, elevation=i, uuid=device.id_uuid,
+                )).encode('ascii')
+                for i in range(args.connections)
+            ]
+            loop = asyncio.new_event_loop()
+            answered, failed, seconds = loop.run_until_complete(load(
+                port, bodies, args.ramp, args.transfer, args.chunks,
+                args.deadline))
+            loop.close()
+            print('{:<24}{:>10}{:>10}{:>10.1f}'.format(
+                name, answered, failed, seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare reading a route in progress from the database and the mirror.
+
+Saves --points fixes for one device every five seconds and mirrors them,
+then starts a route --route-hours before the last fix. It times the
+route's points as tracks.columns reads them, and its simplified line as
+the route page draws it, first from the database, rebuilding the track
+each time as every new point would make it, then from the memory mapped
+mirror, and prints the best of several runs.
+
+    python -m benchmarks.mirror_reads --points 1000000"""
+import argparse
+import shutil
+import tempfile
+from datetime import timedelta
+
+from benchmarks import setup, best_of, test_database
+from benchmarks.route_queries import load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=500000)
+    parser.add_argument('--route-hours', type=float, default=8)
+    args = parser.parse_args()
+    setup()
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.test.utils import override_settings
+    from tracker_device import mirror, simplify, tracks
+    from tracker_device.models import Route, TrackerDevice
+
+    def from_database(read):
+        def run():
+            route.track = None
+            with override_settings(DATA_POINT_MIRROR_DIR=''):
+                read()
+        return run
+
+    def columns():
+        return tracks.columns(route)
+
+    def line():
+        cache.clear()
+        return simplify.route_line(route, 13)
+
+    directory = tempfile.mkdtemp()
+    try:
+        with test_database(), override_settings(
+                DATA_POINT_MIRROR_DIR=directory):
+            user = User.objects.create(username='bench')
+            device = TrackerDevice.objects.create(user=user)
+            start = load([device], args.points)
+            mirror.rebuild(device.pk)
+            route = Route.objects.create(
+                device=device, start=start + timedelta(
+                    seconds=args.points * 5 - args.route_hours * 3600))
+            print('{} point route out of {}'.format(
+                len(columns().time), args.points))
+            for name, run in [
+                ('columns from the database', from_database(columns)),
+                ('columns from the mirror', columns),
+                ('line from the database', from_database(line)),
+                ('line from the mirror', line),
+            ]:
+                print('{}: {:.2f} ms'.format(name, best_of(run) * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Compare the form encoded and packed ingest formats.
+
+Reports bytes on the wire per fix and the cost of turning a payload into
+(time, lat, lng, elevation) tuples ready for insert. No database is
+needed; the UUID lookup and INSERT are the same for both formats."""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from benchmarks import setup, best_of
+
+
+def make_track(count):
+    """Make a plausible track of one fix every five seconds."""
+    from django.utils import timezone
+    start = datetime(2016, 10, 10, tzinfo=timezone.utc)
+    lat, lng, elevation = 47.6062, -122.3321, 56.0
+    points = []
+    for i in range(count):
+        lat += random.uniform(-0.0003, 0.0003)
+        lng += random.uniform(-0.0003, 0.0003)
+        elevation += random.uniform(-1, 1)
+        time = start + timedelta(seconds=5 * i)
+        points.append(
+            (time, round(lat, 6), round(lng, 6), round(elevation, 2)))
+    return points
+
+
+def form_bodies(uuid, points):
+    """Encode each point as the body of a POST to /device/data/create."""
+    from django.utils.http import urlencode
+    return [
+        urlencode(dict(
+            time=time.strftime('%m/%d/%Y %H:%M:%S'),
+            lat=lat,
+            lng=lng,
+            elevation=elevation,
+            uuid=uuid,
+        )).encode('ascii')
+        for time, lat, lng, elevation in points
+    ]
+
+
+def decode_forms(bodies):
+    """Parse and clean form bodies like CreateDataPointForm does."""
+    from django.http import QueryDict
+    from tracker_device.ingest import clean_points
+    rows = [QueryDict(body) for body in bodies]
+    points, errors = clean_points([
+        dict((name, row.get(name)) for name in row) for row in rows
+    ])
+    assert not errors
+    return points
+
+
+def decode_packed(body):
+    """Decode a packed body into tuples."""
+    from tracker_device import packed
+    return packed.to_points(*packed.decode(body)[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=5000)
+    args = parser.parse_args()
+    setup()
+    from django.test.utils import override_settings
+    from tracker_device import packed
+    import uuid
+
+    device = uuid.uuid4()
+    points = make_track(args.points)
+    forms = form_bodies(device, points)
+    absolute = packed.encode(device, points, delta=False)
+    delta = packed.encode(device, points)
+
+    print('{} fixes'.format(args.points))
+    print('{:<16}{:>14}{:>14}{:>16}'.format(
+        'format', 'bytes/fix', 'total bytes', 'decode us/fix'))
+    with override_settings(DATA_POINT_BATCH_LIMIT=args.points):
+        rows = [
+            ('form', sum(map(len, forms)),
+             best_of(lambda: decode_forms(forms))),
+            ('packed', len(absolute),
+             best_of(lambda: decode_packed(absolute))),
+            ('packed delta', len(delta),
+             best_of(lambda: decode_packed(delta))),
+        ]
+    for name, size, seconds in rows:
+        print('{:<16}{:>14.1f}{:>14}{:>16.2f}'.format(
+            name, size / args.points, size, seconds / args.points * 1e6))
+
+
+if __name__ == '__main__':
+    main()
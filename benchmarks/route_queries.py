@@ -0,0 +1,139 @@
+"""Compare route and device page queries before and after the (device,
+time) index.
+
+Loads --points fixes spread over --devices devices reporting every five
+seconds, then runs the queries DetailRouteView and DetailDeviceView used
+to make with only the foreign key index on device_id, and the queries
+they make now with only the (device, time) index. Prints each plan and
+the best of several runs.
+
+    python -m benchmarks.route_queries --points 3000000
+
+Use a PostgreSQL database; SQLite loads millions of rows slowly and its
+plans say little about production."""
+import argparse
+import importlib
+from datetime import datetime, timedelta
+
+from benchmarks import setup, best_of, test_database
+
+UNIQUE = importlib.import_module(
+    'tracker_device.migrations.0005_datapoint_unique_device_time')
+DEVICE = importlib.import_module(
+    'tracker_device.migrations.0006_datapoint_drop_device_index')
+
+
+def load(devices, count, chunk=10000):
+    """Insert count points, the devices' fixes interleaved in time."""
+    from django.db import connection, transaction
+    from django.utils import timezone
+    start = datetime(2016, 1, 1, tzinfo=timezone.utc)
+    sql = (
+        'INSERT INTO tracker_device_datapoint '
+        '(device_id, time, lat, lng, elevation, time_received) '
+        'VALUES (%s, %s, %s, %s, %s, %s)'
+    )
+    rows = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(count):
+            device = devices[i % len(devices)]
+            time = start + timedelta(seconds=5 * (i // len(devices)))
+            rows.append((device.pk, time, 47.6, -122.3, 56.0, time))
+            if len(rows) == chunk:
+                cursor.executemany(sql, rows)
+                rows = []
+        if rows:
+            cursor.executemany(sql, rows)
+    return start
+
+
+def use_indexes(foreign_key):
+    """Leave only the device_id index, or only the (device, time) one."""
+    from django.db import connection
+    with connection.schema_editor(atomic=False) as editor:
+        if foreign_key:
+            UNIQUE.remove_unique_index(None, editor)
+            DEVICE.add_device_index(None, editor)
+        else:
+            DEVICE.drop_device_index(None, editor)
+            UNIQUE.add_unique_index(None, editor)
+        editor.execute('ANALYZE tracker_device_datapoint')
+
+
+def plan(queryset):
+    """Return the database's plan for a queryset."""
+    from django.db import connection
+    sql, params = queryset.query.sql_with_params()
+    if connection.vendor == 'postgresql':
+        explain = 'EXPLAIN ANALYZE '
+    else:
+        explain = 'EXPLAIN QUERY PLAN '
+    with connection.cursor() as cursor:
+        cursor.execute(explain + sql, params)
+        return [' '.join(str(column) for column in row)
+                for row in cursor.fetchall()]
+
+
+def report(title, queries):
+    """Print the plan and best time of each (name, queryset, run)."""
+    print('== {}'.format(title))
+    for name, queryset, run in queries:
+        seconds = best_of(run)
+        print('-- {}: {:.2f} ms'.format(name, seconds * 1000))
+        if queryset is not None:
+            for line in plan(queryset):
+                print('   {}'.format(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=2000000)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--route-hours', type=float, default=2)
+    args = parser.parse_args()
+    setup()
+    from django.contrib.auth.models import User
+    from tracker_device.models import TrackerDevice, DataPoint
+
+    with test_database():
+        user = User.objects.create(username='bench')
+        devices = [
+            TrackerDevice.objects.create(user=user)
+            for i in range(args.devices)
+        ]
+        start = load(devices, args.points)
+        device = devices[0]
+        # A route in the middle of the device's history.
+        middle = args.points // args.devices * 5 // 2
+        route_start = start + timedelta(seconds=middle)
+        route_end = route_start + timedelta(hours=args.route_hours)
+        print('{} points over {} devices, {:.0f} point route'.format(
+            args.points, args.devices, args.route_hours * 720))
+
+        use_indexes(foreign_key=True)
+        window = DataPoint.objects.filter(
+            time__range=(route_start, route_end)).filter(device=device)
+        latest = device.data.order_by('-time')[:10]
+        report('before: device_id index, old queries', [
+            ('route window', window, lambda: list(window.all())),
+            ('route latest 10', window.order_by('-time')[:10],
+             lambda: list(window.order_by('-time')[:10])),
+            ('device latest 10', latest, lambda: list(latest.all())),
+            ('device page count', None, lambda: device.data.count()),
+        ])
+
+        use_indexes(foreign_key=False)
+        window = device.data.window(route_start, route_end)
+        latest = device.data.most_recent(10)
+
+        def route_page():
+            data = list(window.all())
+            return data[:-11:-1]
+        report('after: (device, time) index, new queries', [
+            ('route window and latest 10', window, route_page),
+            ('device latest 10', latest, lambda: list(latest.all())),
+        ])
+
+
+if __name__ == '__main__':
+    main()
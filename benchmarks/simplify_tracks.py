@@ -0,0 +1,52 @@
+"""Measure track simplification on large synthetic tracks.
+
+Builds a random walk of --points fixes, five seconds apart at walking to
+driving speeds, then for several zooms prints how many vertices
+Douglas-Peucker keeps at half a pixel of error, how long simplifying
+took and how long encoding the result as a polyline took.
+
+    python -m benchmarks.simplify_tracks --points 1000000"""
+import argparse
+
+import numpy as np
+
+from benchmarks import setup, best_of
+
+
+def walk(count, seed=1):
+    """Latitudes and longitudes of a wandering track from Seattle."""
+    rng = np.random.RandomState(seed)
+    heading = np.cumsum(rng.normal(scale=0.05, size=count))
+    speed = np.abs(rng.normal(loc=10, scale=5, size=count))
+    meters = 5 * speed
+    lats = 47.6 + np.cumsum(meters * np.cos(heading)) / 111320
+    lngs = -122.3 + np.cumsum(meters * np.sin(heading)) / 75000
+    return lats, lngs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument(
+        '--zooms', type=int, nargs='+', default=[8, 11, 13, 15, 17])
+    args = parser.parse_args()
+    setup()
+    from tracker_device import simplify
+
+    lats, lngs = walk(args.points)
+    x, y = simplify.project(lats, lngs)
+    print('{} points'.format(args.points))
+    for zoom in args.zooms:
+        epsilon = simplify.tolerance(zoom)
+        kept = simplify.simplify(x, y, epsilon)
+        seconds = best_of(lambda: simplify.simplify(x, y, epsilon), 3)
+        encoding = best_of(
+            lambda: simplify.encode_polyline(lats[kept], lngs[kept]), 3)
+        print('zoom {:2}: {:8} vertices ({:5.1f}x fewer), simplify '
+              '{:7.1f} ms, encode {:6.1f} ms'.format(
+                  zoom, len(kept), args.points / len(kept),
+                  seconds * 1000, encoding * 1000))
+
+
+if __name__ == '__main__':
+    main()
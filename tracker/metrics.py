@@ -0,0 +1,253 @@
+"""Process-local metrics exposed at /metrics in Prometheus text format.
+
+Counters and histograms are plain in-memory totals behind a lock, cheap
+enough to update on every ingest request. Each process keeps its own,
+so with several workers a scrape sees whichever worker answered it.
+
+Database queries are timed by wrapping the cursors Django makes for each
+connection; MetricsMiddleware attributes them to the view being
+served."""
+import bisect
+import threading
+import time
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Registry(object):
+    """The metrics to render, in registration order."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return every metric in Prometheus text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(object):
+    """A total per set of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield '{}{} {}'.format(
+                self.name, _labels(self.labels, labels), _number(value))
+
+
+class Histogram(object):
+    """Observations counted into buckets per set of label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum.
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted(
+                (labels, list(counts))
+                for labels, counts in self.values.items()
+            )
+        for labels, counts in values:
+            total = 0
+            bounds = [_number(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                total += count
+                yield '{}_bucket{} {}'.format(
+                    self.name,
+                    _labels(self.labels + ('le',), labels + (bound,)),
+                    total,
+                )
+            suffix = _labels(self.labels, labels)
+            yield '{}_sum{} {}'.format(self.name, suffix, _number(counts[-1]))
+            yield '{}_count{} {}'.format(self.name, suffix, total)
+
+
+def _labels(names, values):
+    """Format label pairs, empty if there are none."""
+    if not names:
+        return ''
+    pairs = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    """Format a number the way Prometheus expects."""
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    'tracker_http_request_duration_seconds',
+    'Time to serve a request, by view.',
+    ('view',),
+))
+requests = registry.register(Counter(
+    'tracker_http_requests_total',
+    'Requests served, by view and status code.',
+    ('view', 'status'),
+))
+request_queries = registry.register(Histogram(
+    'tracker_http_request_db_queries',
+    'Database queries run while serving a request, by view.',
+    ('view',),
+    QUERY_COUNT_BUCKETS,
+))
+request_query_duration = registry.register(Histogram(
+    'tracker_http_request_db_duration_seconds',
+    'Time spent in database queries while serving a request, by view.',
+    ('view',),
+))
+template_duration = registry.register(Histogram(
+    'tracker_template_render_seconds',
+    'Time to render a view\'s template response, by view.',
+    ('view',),
+))
+query_duration = registry.register(Histogram(
+    'tracker_db_query_duration_seconds',
+    'Time taken by each database query.',
+))
+ingest_points = registry.register(Counter(
+    'tracker_ingest_points_total',
+    'Data points received, by whether they were created, already stored '
+    'or spooled.',
+    ('result',),
+))
+ingest_rejected = registry.register(Counter(
+    'tracker_ingest_rejected_total',
+    'Ingest requests turned away, by reason.',
+    ('reason',),
+))
+
+
+class QueryTally(threading.local):
+    """Queries run on this thread since `start`, while tallying."""
+
+    active = False
+    queries = 0
+    seconds = 0.0
+
+    def start(self):
+        self.active = True
+        self.queries = 0
+        self.seconds = 0.0
+
+    def stop(self):
+        self.active = False
+        return self.queries, self.seconds
+
+
+query_tally = QueryTally()
+
+
+class TimedCursor(object):
+    """Cursor wrapper that times execute and executemany."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            _record_query(time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            _record_query(time.perf_counter() - start)
+
+
+def _record_query(seconds):
+    query_duration.observe(seconds)
+    if query_tally.active:
+        query_tally.queries += 1
+        query_tally.seconds += seconds
+
+
+def time_queries(connection):
+    """Wrap the cursors a connection makes in TimedCursor, once."""
+    if getattr(connection, 'queries_timed', False):
+        return
+    for name in ('make_cursor', 'make_debug_cursor'):
+        setattr(connection, name, _timed(getattr(connection, name)))
+    connection.queries_timed = True
+
+
+def _timed(make_cursor):
+    def make_timed_cursor(cursor):
+        return TimedCursor(make_cursor(cursor))
+    return make_timed_cursor
+
+
+@receiver(connection_created)
+def time_new_connection(sender, connection, **kwargs):
+    """Time queries on connections as they are opened."""
+    time_queries(connection)
@@ -0,0 +1,50 @@
+import time
+
+from django.db import connections
+
+from tracker import metrics
+
+
+class MetricsMiddleware(object):
+    """Record latency, status, database queries and template render time
+    for each request, labelled by the view that served it.
+
+    Goes first in MIDDLEWARE so its timing covers the other middleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        for connection in connections.all():
+            metrics.time_queries(connection)
+        start = time.perf_counter()
+        metrics.query_tally.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            queries, query_seconds = metrics.query_tally.stop()
+        elapsed = time.perf_counter() - start
+        view = view_label(request)
+        metrics.request_duration.observe(elapsed, view)
+        metrics.requests.inc(view, response.status_code)
+        metrics.request_queries.observe(queries, view)
+        metrics.request_query_duration.observe(query_seconds, view)
+        return response
+
+    def process_template_response(self, request, response):
+        """Time rendering, which happens right after this returns."""
+        start = time.perf_counter()
+
+        def rendered(response):
+            metrics.template_duration.observe(
+                time.perf_counter() - start, view_label(request))
+        response.add_post_render_callback(rendered)
+        return response
+
+
+def view_label(request):
+    """Name the view that served a request, for metric labels."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tracker.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -152,6 +153,86 @@ STATICFILES_DIRS = [
 
 ACCOUNT_ACTIVATION_DAYS = 7
 
+# Data point ingest
+
+DATA_POINT_BATCH_LIMIT = int(os.environ.get('DATA_POINT_BATCH_LIMIT', 5000))
+
+# 'direct' saves points during the request, 'spool' appends them to a local
+# spool that `manage.py drain_spool` writes to the database
+DATA_POINT_INGEST_MODE = os.environ.get('DATA_POINT_INGEST_MODE', 'direct')
+INGEST_SPOOL_DIR = os.environ.get(
+    'INGEST_SPOOL_DIR',
+    os.path.join(BASE_DIR, 'spool')
+)
+INGEST_SPOOL_SEGMENT_BYTES = int(
+    os.environ.get('INGEST_SPOOL_SEGMENT_BYTES', 4 * 1024 * 1024)
+)
+INGEST_SPOOL_FSYNC = os.environ.get('INGEST_SPOOL_FSYNC', 'True') != 'False'
+
+# In-process cache of device UUID lookups, sizes in entries, TTLs in seconds
+DEVICE_CACHE_SIZE = int(os.environ.get('DEVICE_CACHE_SIZE', 10000))
+DEVICE_CACHE_TTL = int(os.environ.get('DEVICE_CACHE_TTL', 300))
+DEVICE_CACHE_NEGATIVE_TTL = int(
+    os.environ.get('DEVICE_CACHE_NEGATIVE_TTL', 30)
+)
+
+# Ingest requests allowed per device by mode, as (requests per second,
+# burst), None for no limit. DATA_POINT_RATE_LIMIT_CACHE names a CACHES
+# alias to share the limits between workers, empty keeps them per process
+DATA_POINT_RATE_LIMITS = {
+    'quiet': (0.2, 10),
+    'transmit': (1, 30),
+    'debug': (5, 100),
+}
+DATA_POINT_RATE_LIMIT_CACHE = os.environ.get(
+    'DATA_POINT_RATE_LIMIT_CACHE', ''
+)
+
+# Months of data points kept for users who haven't chosen, blank to keep
+# them forever; `manage.py manage_partitions` enforces retention
+DATA_POINT_RETENTION_MONTHS = (
+    int(os.environ['DATA_POINT_RETENTION_MONTHS'])
+    if os.environ.get('DATA_POINT_RETENTION_MONTHS') else None
+)
+
+# Where `manage.py archive_points` moves old data points, one compressed
+# file per device and month
+DATA_POINT_ARCHIVE_DIR = os.environ.get(
+    'DATA_POINT_ARCHIVE_DIR',
+    os.path.join(BASE_DIR, 'archive')
+)
+
+# Directory of memory mapped per device copies of data points, blank to
+# not keep them; see tracker_device/mirror.py
+DATA_POINT_MIRROR_DIR = os.environ.get('DATA_POINT_MIRROR_DIR', '')
+
+# Seconds the sync API waits before returning newly received points, so
+# slower ingest transactions that received points earlier have committed
+DATA_POINT_SYNC_DELAY = int(os.environ.get('DATA_POINT_SYNC_DELAY', 60))
+
+# Seconds before a process checks for geofences changed by other processes
+GEOFENCE_INDEX_TTL = int(os.environ.get('GEOFENCE_INDEX_TTL', 60))
+
+# The default cache, local memory unless CACHE_BACKEND names another
+# backend (such as memcached at CACHE_LOCATION) to share between workers
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+}
+
+# CACHES alias holding device and route page data, rebuilt by one worker
+# at a time; see tracker_device/page_cache.py
+PAGE_CACHE = os.environ.get('PAGE_CACHE', 'default')
+
+# Addresses allowed to scrape /metrics, comma separated
+METRICS_ALLOWED_IPS = os.environ.get(
+    'METRICS_ALLOWED_IPS', '127.0.0.1,::1'
+).split(',')
+
 # Logout
 
 LOGOUT_REDIRECT_URL = '/'
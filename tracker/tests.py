@@ -139,3 +139,101 @@ class AboutTestCase(TestCase):
     def test_about_page_message(self):
         """Assert about titles show on about page."""
         self.assertContains(self.response, "About The Team")
+
+
+class MetricsTestCase(TestCase):
+    """Test the metrics middleware and endpoint."""
+
+    def metrics(self):
+        """Return the metrics page as text."""
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def sample(self, text, prefix):
+        """Return the value of the sample line starting with prefix."""
+        for line in text.splitlines():
+            if line.startswith(prefix + ' '):
+                return float(line.split(' ')[-1])
+        return 0
+
+    def test_content_type(self):
+        """Test metrics are served in Prometheus text format."""
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith(
+            'text/plain; version=0.0.4'))
+
+    def test_forbidden_from_other_addresses(self):
+        """Test addresses not allowed can't read metrics."""
+        response = self.client.get(
+            reverse('metrics'), REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 403)
+
+    def test_request_counted(self):
+        """Test a request is counted and timed under its view."""
+        before = self.sample(
+            self.metrics(),
+            'tracker_http_requests_total{view="aboutpage",status="200"}')
+        self.client.get(reverse('aboutpage'))
+        text = self.metrics()
+        after = self.sample(
+            text,
+            'tracker_http_requests_total{view="aboutpage",status="200"}')
+        self.assertEqual(after, before + 1)
+        self.assertIn(
+            'tracker_http_request_duration_seconds_count{view="aboutpage"}',
+            text)
+        self.assertIn(
+            'tracker_template_render_seconds_count{view="aboutpage"}', text)
+
+    def test_queries_counted(self):
+        """Test queries run by a view are counted against it."""
+        user = User(username='metrics')
+        user.save()
+        self.client.force_login(user)
+        self.client.get(reverse('profile'))
+        text = self.metrics()
+        self.assertGreater(self.sample(
+            text, 'tracker_http_request_db_queries_sum{view="profile"}'), 0)
+
+    def test_histogram_buckets_cumulative(self):
+        """Test histogram buckets count every observation at or below."""
+        from tracker.metrics import Histogram
+        histogram = Histogram('test_seconds', 'Test.', ('view',), (1, 2))
+        for value in (0.5, 1.5, 3):
+            histogram.observe(value, 'home')
+        self.assertEqual(list(histogram.samples()), [
+            'test_seconds_bucket{view="home",le="1"} 1',
+            'test_seconds_bucket{view="home",le="2"} 2',
+            'test_seconds_bucket{view="home",le="+Inf"} 3',
+            'test_seconds_sum{view="home"} 5.0',
+            'test_seconds_count{view="home"} 3',
+        ])
+
+    def test_ingest_counted(self):
+        """Test created, duplicate and rejected points are counted."""
+        from tracker_device.models import TrackerDevice
+        from uuid import uuid4
+        user = User(username='metrics')
+        user.save()
+        device = TrackerDevice(user=user)
+        device.save()
+        names = (
+            'tracker_ingest_points_total{result="created"}',
+            'tracker_ingest_points_total{result="duplicate"}',
+            'tracker_ingest_rejected_total{reason="unknown_uuid"}',
+        )
+        text = self.metrics()
+        before = [self.sample(text, name) for name in names]
+        data = {
+            'time': '10/10/2016 10:00:00', 'lat': 1, 'lng': 2,
+            'elevation': 3, 'uuid': device.id_uuid,
+        }
+        self.client.post(reverse('create_data_point'), data)
+        self.client.post(reverse('create_data_point'), data)
+        data['uuid'] = uuid4()
+        self.client.post(reverse('create_data_point'), data)
+        text = self.metrics()
+        after = [self.sample(text, name) for name in names]
+        self.assertEqual(
+            [a - b for a, b in zip(after, before)], [1, 1, 1])
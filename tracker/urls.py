@@ -15,7 +15,7 @@ Including another URLconf
 """
 from django.conf.urls import url, include
 from django.contrib import admin
-from tracker.views import HomeView, AboutView
+from tracker.views import HomeView, AboutView, MetricsView
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
@@ -24,4 +24,5 @@ urlpatterns = [
     url(r'^profile/', include('tracker_profile.urls')),
     url(r'^device/', include('tracker_device.urls')),
     url(r'^about/$', AboutView.as_view(), name='aboutpage'),
+    url(r'^metrics$', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,4 +1,8 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.generic import View
 from django.views.generic.base import TemplateView
+from tracker import metrics
 
 
 class HomeView(TemplateView):
@@ -9,3 +13,17 @@ class HomeView(TemplateView):
 class AboutView(TemplateView):
     """Create AboutView class."""
     template_name = 'tracker/about.html'
+
+
+class MetricsView(View):
+    """Serve this process's metrics in Prometheus text format.
+
+    Only answers addresses listed in METRICS_ALLOWED_IPS."""
+
+    def get(self, request, *args, **kwargs):
+        if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+            return HttpResponseForbidden()
+        return HttpResponse(
+            metrics.registry.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
@@ -1,3 +1,16 @@
 from django.contrib import admin
 
-# Register your models here.
+from tracker_device.models import Geofence, GeofenceEvent
+
+
+@admin.register(Geofence)
+class GeofenceAdmin(admin.ModelAdmin):
+    """Add and edit geofences; vertices are JSON [lat, lng] pairs."""
+    list_display = ('name', 'user', 'device', 'updated')
+
+
+@admin.register(GeofenceEvent)
+class GeofenceEventAdmin(admin.ModelAdmin):
+    """Browse recorded enter and exit events."""
+    list_display = ('fence', 'device', 'kind', 'time')
+    list_filter = ('kind',)
@@ -0,0 +1,386 @@
+"""Cold storage of old data points in compressed columnar files.
+
+The archive_points command moves whole months of each device's points
+out of the database into one file per device and month under
+DATA_POINT_ARCHIVE_DIR, and records each file in ArchivedMonth. The
+functions here read a device's points from both places, merged in time
+order, so pages and rebuilds don't need to know what was archived.
+
+A file is a 4 byte header, magic b'TA' and a version, followed by
+blocks of up to BLOCK_SIZE points::
+
+    block header  first and last time in microseconds since the epoch
+                  (int64), point count, length of the body (uint32)
+    body          zlib compressed columns: time as deltas between
+                  points, time received less time, then lat, lng and
+                  elevation as float64 bits XORed with the point before
+
+Values are kept exactly. Readers skip blocks outside the times asked
+for and decode one block at a time, so reading an archived range never
+holds more than a block in memory.
+
+Points arriving late for an archived month are stored in the database as
+usual and merged into the file the next time the month is archived. A
+point that is in both places, as between writing a file and deleting
+the rows it holds, is read once."""
+import heapq
+import os
+import struct
+import zlib
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from tracker_device.models import ArchivedMonth, DataPoint, TrackerDevice
+from tracker_device.partitions import add_months, month_start
+from tracker_device.timeutil import from_micros, to_micros
+
+MAGIC = b'TA'
+VERSION = 1
+HEADER = struct.Struct('<2sBx')
+BLOCK = struct.Struct('<qqII')
+BLOCK_SIZE = 4096
+READ_CHUNK_SIZE = 10000
+DELETE_CHUNK_SIZE = 500
+FIELDS = ('time', 'lat', 'lng', 'elevation', 'time_received')
+
+
+class ArchiveError(ValueError):
+    """Raised when a file isn't a valid archive."""
+
+
+def window(device_id, start=None, end=None, chunk_size=READ_CHUNK_SIZE):
+    """Yield a device's (time, lat, lng, elevation) points from start to
+    end inclusive, oldest first, archived or not.
+
+    A missing start or end leaves that side open. Stored points are read
+    chunk_size at a time."""
+    months = ArchivedMonth.objects.filter(device_id=device_id)
+    points = DataPoint.objects.filter(device_id=device_id)
+    if start is not None:
+        months = months.filter(last_time__gte=start)
+        points = points.filter(time__gte=start)
+    if end is not None:
+        months = months.filter(first_time__lte=end)
+        points = points.filter(time__lte=end)
+    archived = _chain(
+        read(month.path, start, end) for month in months.order_by('month'))
+    stored = _stored(points, chunk_size=chunk_size)
+    for point in _merge(archived, stored):
+        yield point[:4]
+
+
+def most_recent(device_id, count):
+    """A device's newest count points, newest first, archived or not."""
+    found = list(DataPoint.objects.filter(device_id=device_id).most_recent(
+        count).values_list(*FIELDS[:4]))
+    months = ArchivedMonth.objects.filter(device_id=device_id)
+    if len(found) == count:
+        months = months.filter(last_time__gt=found[-1][0])
+    for month in months.order_by('-month'):
+        if len(found) >= count and found[count - 1][0] >= month.last_time:
+            break
+        tail = deque(
+            (point[:4] for point in read(month.path)), maxlen=count)
+        found = _newest(found + list(tail), count)
+    return found
+
+
+def last_before(device_id, time):
+    """A device's last (time, lat, lng, elevation) before time, or None."""
+    found = DataPoint.objects.filter(
+        device_id=device_id, time__lt=time,
+    ).order_by('-time').values_list(*FIELDS[:4]).first()
+    months = ArchivedMonth.objects.filter(
+        device_id=device_id, first_time__lt=time)
+    if found is not None:
+        months = months.filter(last_time__gt=found[0])
+    month = months.order_by('-month').first()
+    if month is not None:
+        for point in read(month.path, end=time):
+            if point[0] < time:
+                found = point[:4]
+    return found
+
+
+def archived_count(device_id):
+    """How many of a device's points are archived."""
+    return sum(ArchivedMonth.objects.filter(
+        device_id=device_id).values_list('point_count', flat=True))
+
+
+def archivable_months(device_id, cutoff):
+    """Yield the start of each month before cutoff with stored points."""
+    points = DataPoint.objects.filter(device_id=device_id, time__lt=cutoff)
+    while True:
+        first = points.order_by('time').values_list(
+            'time', flat=True).first()
+        if first is None:
+            return
+        month = month_start(first)
+        yield month
+        points = points.filter(time__gte=add_months(month, 1))
+
+
+def archive_month(device_id, month, chunk_size=DELETE_CHUNK_SIZE):
+    """Move a device's stored points in month into its archive file.
+
+    The file is written in full and recorded before any row is deleted,
+    and rows are then deleted by the times the file holds, so a point
+    arriving meanwhile stays in the database. Returns how many points
+    the file holds."""
+    existing = ArchivedMonth.objects.filter(
+        device_id=device_id, month=month).first()
+    stored = _stored(DataPoint.objects.filter(
+        device_id=device_id,
+        time__gte=month,
+        time__lt=add_months(month, 1),
+    ), fields=FIELDS)
+    if existing is None:
+        archived = iter(())
+    else:
+        archived = read(existing.path)
+    saved = _save(device_id, month, _merge(archived, stored))
+    if saved is None:
+        return 0
+    for block in _blocks(saved.path):
+        for start in range(0, len(block), chunk_size):
+            times = [point[0] for point in block[start:start + chunk_size]]
+            DataPoint.objects.filter(
+                device_id=device_id, time__in=times).delete()
+    # Map tiles only show stored points; see tracker_device.tiles.
+    TrackerDevice.objects.filter(pk=device_id).update(updated=timezone.now())
+    return saved.point_count
+
+
+def expire(device_id, cutoff):
+    """Remove a device's archived points from before cutoff, returning
+    how many were removed."""
+    removed = 0
+    months = ArchivedMonth.objects.filter(
+        device_id=device_id, month__lt=cutoff)
+    for month in months.order_by('month'):
+        if month.last_time < cutoff:
+            removed += month.point_count
+            month.delete()
+        elif month.first_time < cutoff:
+            kept = (point for point in read(month.path) if point[0] >= cutoff)
+            saved = _save(device_id, month.month, kept)
+            removed += month.point_count - saved.point_count
+    return removed
+
+
+def read(path, start=None, end=None):
+    """Yield (time, lat, lng, elevation, time_received) points from an
+    archive file, from start to end inclusive."""
+    with _open(path) as archive:
+        for first, last, size, length in _index(archive):
+            if start is not None and last < to_micros(start):
+                continue
+            if end is not None and first > to_micros(end):
+                return
+            for point in _decode(size, _body(archive, length)):
+                if start is not None and point[0] < start:
+                    continue
+                if end is not None and point[0] > end:
+                    return
+                yield point
+
+
+def _save(device_id, month, points):
+    """Write points to the month's archive file and record it.
+
+    Returns the ArchivedMonth, or None if there were no points, in which
+    case any existing record is removed."""
+    relative = os.path.join(
+        str(device_id), '{:04d}-{:02d}.pts'.format(month.year, month.month))
+    path = _path(relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as out:
+        written, first, last = _write(out, points)
+        out.flush()
+        os.fsync(out.fileno())
+    if not written:
+        os.remove(temporary)
+        ArchivedMonth.objects.filter(
+            device_id=device_id, month=month).delete()
+        return None
+    os.replace(temporary, path)
+    saved, created = ArchivedMonth.objects.update_or_create(
+        device_id=device_id,
+        month=month,
+        defaults=dict(
+            path=relative,
+            point_count=written,
+            first_time=first,
+            last_time=last,
+        ),
+    )
+    return saved
+
+
+def _write(out, points):
+    """Write points to a file in blocks, returning the point count and the
+    first and last times."""
+    out.write(HEADER.pack(MAGIC, VERSION))
+    written, first, last = 0, None, None
+    block = []
+    for point in points:
+        if not written:
+            first = point[0]
+        block.append(point)
+        written += 1
+        last = point[0]
+        if len(block) == BLOCK_SIZE:
+            out.write(_encode(block))
+            block = []
+    if block:
+        out.write(_encode(block))
+    return written, first, last
+
+
+def _encode(points):
+    """One block of points, with its header."""
+    times = np.array([to_micros(point[0]) for point in points], dtype='<i8')
+    received = np.array(
+        [to_micros(point[4]) for point in points], dtype='<i8') - times
+    bits = np.array(
+        [point[1:4] for point in points], dtype='<f8').T.copy().view('<u8')
+    steps = times.copy()
+    steps[1:] = np.diff(times)
+    bits[:, 1:] ^= bits[:, :-1].copy()
+    body = zlib.compress(steps.tobytes() + received.tobytes() + bits.tobytes())
+    return BLOCK.pack(times[0], times[-1], len(points), len(body)) + body
+
+
+def _decode(count, body):
+    """The points of one block."""
+    try:
+        columns = zlib.decompress(body)
+    except zlib.error as error:
+        raise ArchiveError(str(error))
+    if len(columns) != 5 * count * 8:
+        raise ArchiveError('Block holds the wrong number of points.')
+    times = np.cumsum(np.frombuffer(columns, dtype='<i8', count=count))
+    received = np.frombuffer(
+        columns, dtype='<i8', count=count, offset=count * 8) + times
+    bits = np.frombuffer(
+        columns, dtype='<u8', offset=count * 16).reshape(3, count)
+    values = np.bitwise_xor.accumulate(bits, axis=1).view('<f8')
+    return zip(
+        _times(times),
+        values[0].tolist(),
+        values[1].tolist(),
+        values[2].tolist(),
+        _times(received),
+    )
+
+
+def _open(path):
+    """Open an archive file and check its header."""
+    archive = open(_path(path), 'rb')
+    header = archive.read(HEADER.size)
+    if len(header) < HEADER.size or HEADER.unpack(header) != (
+            MAGIC, VERSION):
+        archive.close()
+        raise ArchiveError('Not a version {} archive.'.format(VERSION))
+    return archive
+
+
+def _index(archive):
+    """Yield (first, last, count, length) for each block of an open file.
+
+    The file is left at the start of the block's body, and moved on to
+    the next block whether or not the body was read."""
+    while True:
+        header = archive.read(BLOCK.size)
+        if not header:
+            return
+        if len(header) < BLOCK.size:
+            raise ArchiveError('Archive ends partway through a block.')
+        first, last, count, length = BLOCK.unpack(header)
+        body = archive.tell()
+        yield first, last, count, length
+        archive.seek(body + length)
+
+
+def _body(archive, length):
+    """Read a block's body."""
+    body = archive.read(length)
+    if len(body) < length:
+        raise ArchiveError('Archive ends partway through a block.')
+    return body
+
+
+def _blocks(path):
+    """Yield the points of a file a block at a time."""
+    with _open(path) as archive:
+        for first, last, size, length in _index(archive):
+            yield list(_decode(size, _body(archive, length)))
+
+
+def _stored(points, fields=FIELDS[:4], chunk_size=READ_CHUNK_SIZE):
+    """Yield values of a DataPoint queryset in time order, a chunk per
+    query so only a chunk is held at once."""
+    points = points.order_by('time')
+    after = None
+    while True:
+        chunk = points
+        if after is not None:
+            chunk = chunk.filter(time__gt=after)
+        chunk = list(chunk.values_list(*fields)[:chunk_size])
+        for point in chunk:
+            yield point
+        if len(chunk) < chunk_size:
+            return
+        after = chunk[-1][0]
+
+
+def _merge(*sources):
+    """Merge time ordered sources, keeping the first point at each time."""
+    previous = None
+    for point in heapq.merge(*sources, key=lambda point: point[0]):
+        if point[0] != previous:
+            previous = point[0]
+            yield point
+
+
+def _chain(sources):
+    """Yield from each source in turn."""
+    for source in sources:
+        for item in source:
+            yield item
+
+
+def _newest(points, count):
+    """The newest count points, newest first, each time once."""
+    unique = dict((point[0], point) for point in points)
+    return sorted(unique.values(), key=lambda point: point[0],
+                  reverse=True)[:count]
+
+
+def _path(relative):
+    """The absolute path of an archive file."""
+    return os.path.join(settings.DATA_POINT_ARCHIVE_DIR, relative)
+
+
+def _times(micros):
+    """Aware datetimes from an array of microseconds since the epoch."""
+    return [from_micros(value) for value in micros.tolist()]
+
+
+@receiver(post_delete, sender=ArchivedMonth)
+def remove_file(sender, instance, **kwargs):
+    """Remove an archive file once its record's deletion commits."""
+    def remove():
+        try:
+            os.remove(_path(instance.path))
+        except FileNotFoundError:
+            pass
+    transaction.on_commit(remove)
@@ -0,0 +1,76 @@
+"""Conditional GETs for device and route pages and their data.
+
+A browser reloading a page sends back the ETag and Last-Modified it was
+given, and gets a 304 when they still match. They are worked out here
+from a single indexed row read, before the view runs its own queries:
+for a device, from the time it, its point statistics or its list of
+routes last changed (which every ingest updates); for a route, from the
+time it or its track last changed and its device. Responses are marked
+private and no-cache, so browsers ask again on every load rather than
+showing a page that may be stale.
+
+The validators of a device or route the user can't see are None, which
+leaves the request to the view to refuse."""
+import hashlib
+
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from tracker_device.models import Route
+
+
+def conditional(validators):
+    """A view decorator answering conditional requests with the (etag,
+    last modified) validators(request, pk) returns."""
+    def cached(request, *args, **kwargs):
+        if not hasattr(request, 'validators'):
+            request.validators = validators(request, kwargs.get('pk'))
+        return request.validators
+
+    answer = condition(
+        etag_func=lambda *args, **kwargs: cached(*args, **kwargs)[0],
+        last_modified_func=lambda *args, **kwargs: cached(*args, **kwargs)[1])
+
+    def decorator(view):
+        return cache_control(private=True, no_cache=True)(answer(view))
+    return decorator
+
+
+def device_validators(request, pk):
+    """Validators of one of the user's devices' pages.
+
+    The day is included since the device page summarizes the last days'
+    activity."""
+    if not request.user.is_authenticated:
+        return None, None
+    row = request.user.devices.filter(pk=pk).values_list(
+        'updated', 'point_count', 'last_received',
+    ).first()
+    if row is None:
+        return None, None
+    return (
+        _etag('device', request.user.pk, timezone.now().date(), *row),
+        row[0],
+    )
+
+
+def route_validators(request, pk):
+    """Validators of one of the user's routes' pages."""
+    if not request.user.is_authenticated:
+        return None, None
+    row = Route.objects.filter(pk=pk, device__user=request.user).values_list(
+        'updated', 'track_version', 'device__updated',
+    ).first()
+    if row is None:
+        return None, None
+    updated, _, device_updated = row
+    return (
+        _etag('route', request.user.pk, *row),
+        max(updated, device_updated),
+    )
+
+
+def _etag(*values):
+    """An opaque ETag for a tuple of values."""
+    return hashlib.md5(repr(values).encode('utf-8')).hexdigest()
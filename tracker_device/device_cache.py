@@ -0,0 +1,136 @@
+"""In-process cache of device UUID lookups for the ingest endpoints.
+
+Every data point names its device by UUID, so ingest resolves the same
+few UUIDs over and over. Positive lookups are kept in a bounded LRU and
+unknown UUIDs are remembered for a short while, so a device retrying
+with a bad UUID doesn't cost a query per attempt. Saving or deleting a
+TrackerDevice evicts its entry in this process; entries also expire
+after DEVICE_CACHE_TTL seconds so edits made by other processes are
+picked up."""
+import threading
+import time
+import uuid as uuid_module
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from tracker import metrics
+from tracker_device.models import TrackerDevice
+
+CachedDevice = namedtuple('CachedDevice', ['id', 'mode'])
+
+# Returned by DeviceCache.peek for UUIDs it knows nothing about.
+UNKNOWN = object()
+
+
+class DeviceCache(object):
+    """Bounded LRU of UUID -> CachedDevice with a negative cache."""
+
+    def __init__(self, size, ttl, negative_ttl, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._found = OrderedDict()
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, uuid):
+        """Return the CachedDevice for a UUID, or None if there isn't one.
+
+        Only queries the database when the UUID isn't cached either way."""
+        cached = self.peek(uuid)
+        if cached is None:
+            metrics.ingest_rejected.inc('unknown_uuid')
+        if cached is not UNKNOWN:
+            return cached
+        key = _as_uuid(uuid)
+        now = self.clock()
+        row = TrackerDevice.objects.filter(
+            id_uuid=key).values_list('id', 'mode').first()
+        with self._lock:
+            if row is None:
+                _store(self._missing, key, True,
+                       now + self.negative_ttl, self.size)
+                metrics.ingest_rejected.inc('unknown_uuid')
+                return None
+            device = CachedDevice(*row)
+            _store(self._found, key, device, now + self.ttl, self.size)
+            return device
+
+    def peek(self, uuid):
+        """Return what is cached for a UUID without querying.
+
+        Gives the CachedDevice, None for a UUID known not to exist, or
+        UNKNOWN if the UUID isn't cached either way."""
+        key = _as_uuid(uuid)
+        if key is None:
+            return None
+        now = self.clock()
+        with self._lock:
+            hit = _fresh(self._found, key, now)
+            if hit is not None:
+                return hit
+            if _fresh(self._missing, key, now) is not None:
+                return None
+        return UNKNOWN
+
+    def evict(self, uuid):
+        """Forget anything cached for a UUID."""
+        key = _as_uuid(uuid)
+        with self._lock:
+            self._found.pop(key, None)
+            self._missing.pop(key, None)
+
+    def clear(self):
+        """Forget everything."""
+        with self._lock:
+            self._found.clear()
+            self._missing.clear()
+
+
+def _as_uuid(value):
+    """Normalize a UUID or string to a UUID, None if it isn't one."""
+    if isinstance(value, uuid_module.UUID):
+        return value
+    try:
+        return uuid_module.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def _fresh(entries, key, now):
+    """Return an unexpired value and mark it recently used."""
+    entry = entries.get(key)
+    if entry is None:
+        return None
+    value, expires = entry
+    if expires <= now:
+        del entries[key]
+        return None
+    entries.move_to_end(key)
+    return value
+
+
+def _store(entries, key, value, expires, size):
+    """Add a value, dropping the least recently used past size."""
+    entries[key] = (value, expires)
+    entries.move_to_end(key)
+    while len(entries) > size:
+        entries.popitem(last=False)
+
+
+device_cache = DeviceCache(
+    size=settings.DEVICE_CACHE_SIZE,
+    ttl=settings.DEVICE_CACHE_TTL,
+    negative_ttl=settings.DEVICE_CACHE_NEGATIVE_TTL,
+)
+
+
+@receiver(post_save, sender=TrackerDevice)
+@receiver(post_delete, sender=TrackerDevice)
+def evict_tracker_device(sender, **kwargs):
+    """Drop a device's cached lookup when it changes or goes away."""
+    device_cache.evict(kwargs['instance'].id_uuid)
@@ -0,0 +1,86 @@
+"""Tracks as CSV, GPX and KML files, written a chunk of points at a time.
+
+Each writer turns (time, lat, lng, elevation) points, oldest first, into
+the text of a file in pieces for a StreamingHttpResponse, like
+tracker_device.geojson. Given points read lazily, as from archive.window,
+an export holds a chunk of points however long the track is.
+
+KML has no way to give a line's vertices times that can be written in
+one pass, so a KML export is the track's LineString without times; CSV
+and GPX keep them."""
+import csv
+import io
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 1000
+
+
+def _chunks(points, chunk_size):
+    """Lists of up to chunk_size points."""
+    chunk = []
+    for point in points:
+        chunk.append(point)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def csv_stream(points, name='', chunk_size=CHUNK_SIZE):
+    """Yield a CSV file of points with a header row."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['time', 'lat', 'lng', 'elevation'])
+    yield out.getvalue()
+    for chunk in _chunks(points, chunk_size):
+        out.seek(0)
+        out.truncate()
+        writer.writerows(
+            (time.isoformat(), lat, lng, elevation)
+            for time, lat, lng, elevation in chunk)
+        yield out.getvalue()
+
+
+def gpx_stream(points, name='', chunk_size=CHUNK_SIZE):
+    """Yield a GPX 1.1 file of points as one track segment."""
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx version="1.1" creator="tracker" '
+        'xmlns="http://www.topografix.com/GPX/1/1">\n'
+        '<trk><name>{}</name><trkseg>\n'.format(escape(name)))
+    for chunk in _chunks(points, chunk_size):
+        yield ''.join(
+            '<trkpt lat="{!r}" lon="{!r}"><ele>{!r}</ele>'
+            '<time>{}</time></trkpt>\n'.format(
+                lat, lng, elevation, time.isoformat())
+            for time, lat, lng, elevation in chunk)
+    yield '</trkseg></trk>\n</gpx>\n'
+
+
+def kml_stream(points, name='', chunk_size=CHUNK_SIZE):
+    """Yield a KML 2.2 file of points as a LineString placemark."""
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+        '<Document><name>{0}</name><Placemark><name>{0}</name>\n'
+        '<LineString><altitudeMode>absolute</altitudeMode><coordinates>\n'
+        .format(escape(name)))
+    for chunk in _chunks(points, chunk_size):
+        yield ''.join(
+            '{!r},{!r},{!r}\n'.format(lng, lat, elevation)
+            for time, lat, lng, elevation in chunk)
+    yield '</coordinates></LineString></Placemark></Document>\n</kml>\n'
+
+
+# Content type and writer of each export format.
+FORMATS = {
+    'csv': ('text/csv', csv_stream),
+    'gpx': ('application/gpx+xml', gpx_stream),
+    'kml': ('application/vnd.google-earth.kml+xml', kml_stream),
+}
+
+
+def disposition(filename):
+    """A Content-Disposition header value downloading as filename."""
+    return 'attachment; filename="{}"'.format(filename)
@@ -0,0 +1,14 @@
+"""Geometry helpers for data points, on a spherical earth."""
+import math
+
+EARTH_RADIUS = 6371008.8
+
+
+def distance(lat1, lng1, lat2, lng2):
+    """Great circle distance in meters between two points in degrees."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2 +
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(a)))
@@ -0,0 +1,327 @@
+"""Geofence enter and exit events, evaluated as points are ingested.
+
+Each process keeps the fences in a FenceIndex: every fence's vertices as
+NumPy arrays, found by owner and by the grid cells its bounding box
+covers. save_points calls `evaluate` with the points it inserted, in the
+same transaction. It looks up the device's fences near the batch, tests
+all of the batch's points against each of them at once, and compares the
+result with the fences the device was inside (GeofencePresence) to
+record GeofenceEvents.
+
+Saving or deleting a fence re-indexes just that fence in this process
+once the change commits. Other processes pick changes up within
+GEOFENCE_INDEX_TTL seconds, by comparing the fences' update times with
+their own. Points no newer than the device's last fix are late and
+cause no events. Fences may not cross the antimeridian."""
+import json
+import math
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from tracker_device.models import (
+    Geofence,
+    GeofenceEvent,
+    GeofencePresence,
+    TrackerDevice,
+)
+
+# Grid cells are CELL_SIZE degrees square. Fences covering more than
+# MAX_CELLS cells are checked against every batch instead.
+CELL_SIZE = 0.1
+MAX_CELLS = 400
+MATRIX_SIZE = 1 << 20
+
+IndexedFence = namedtuple('IndexedFence', [
+    'id', 'user_id', 'device_id', 'updated', 'lat', 'lng', 'box',
+])
+
+
+class FenceIndex(object):
+    """Fences held in memory, found by owner and by grid cell."""
+
+    def __init__(self, ttl, cell_size=CELL_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.cell_size = cell_size
+        self.clock = clock
+        self._fences = {}
+        self._cells = defaultdict(set)
+        self._large = set()
+        self._by_user = defaultdict(set)
+        self._by_device = defaultdict(set)
+        self._owners = {}
+        self._expires = None
+        self._lock = threading.Lock()
+
+    def near(self, device_id, lats, lngs):
+        """The fences applying to a device that may hold any of the points.
+
+        Also returns the ids of every fence applying to the device, near
+        or not. Doesn't query the database when no fences apply."""
+        self.refresh_if_stale()
+        with self._lock:
+            if not self._fences:
+                return [], set()
+            user_id = self._owners.get(device_id)
+        if user_id is None:
+            user_id = TrackerDevice.objects.filter(
+                pk=device_id).values_list('user_id', flat=True).first()
+            with self._lock:
+                self._owners[device_id] = user_id
+        cells = set(zip(
+            self._cell(lats).tolist(), self._cell(lngs).tolist()))
+        with self._lock:
+            owned = self._by_user.get(user_id, set()) | self._by_device.get(
+                device_id, set())
+            if not owned:
+                return [], owned
+            candidates = set(self._large)
+            for cell in cells:
+                candidates |= self._cells.get(cell, set())
+            near = [self._fences[pk] for pk in sorted(owned & candidates)]
+        return near, owned
+
+    def update(self, fence):
+        """Add or re-index one fence."""
+        vertices = np.array(json.loads(fence.vertices), dtype=float)
+        lat, lng = vertices[:, 0], vertices[:, 1]
+        box = (lat.min(), lng.min(), lat.max(), lng.max())
+        indexed = IndexedFence(
+            fence.pk, fence.user_id, fence.device_id, fence.updated,
+            lat, lng, box)
+        rows = range(self._cell(box[0]), self._cell(box[2]) + 1)
+        columns = range(self._cell(box[1]), self._cell(box[3]) + 1)
+        with self._lock:
+            self._remove(fence.pk)
+            self._fences[fence.pk] = indexed
+            if indexed.device_id is None:
+                self._by_user[indexed.user_id].add(fence.pk)
+            else:
+                self._by_device[indexed.device_id].add(fence.pk)
+            if len(rows) * len(columns) > MAX_CELLS:
+                self._large.add(fence.pk)
+                return
+            for row in rows:
+                for column in columns:
+                    self._cells[(row, column)].add(fence.pk)
+
+    def remove(self, pk):
+        """Drop one fence."""
+        with self._lock:
+            self._remove(pk)
+
+    def forget_device(self, device_id):
+        """Drop the remembered owner of a deleted device."""
+        with self._lock:
+            self._owners.pop(device_id, None)
+
+    def refresh(self):
+        """Bring the index up to date with the database, re-indexing only
+        the fences added, changed or deleted since it last was."""
+        stored = dict(Geofence.objects.values_list('pk', 'updated'))
+        with self._lock:
+            known = dict(
+                (pk, fence.updated) for pk, fence in self._fences.items())
+        for pk in set(known) - set(stored):
+            self.remove(pk)
+        changed = [
+            pk for pk, updated in stored.items() if known.get(pk) != updated]
+        if changed:
+            fences = Geofence.objects.all()
+            if len(changed) < len(stored):
+                fences = fences.filter(pk__in=changed)
+            for fence in fences:
+                self.update(fence)
+        self._expires = self.clock() + self.ttl
+
+    def refresh_if_stale(self):
+        """Refresh if the index was never loaded or its TTL has passed."""
+        if self._expires is None or self.clock() >= self._expires:
+            self.refresh()
+
+    def clear(self):
+        """Forget everything, so the next lookup reloads."""
+        with self._lock:
+            self._fences.clear()
+            self._cells.clear()
+            self._large.clear()
+            self._by_user.clear()
+            self._by_device.clear()
+            self._owners.clear()
+            self._expires = None
+
+    def _cell(self, degrees):
+        """Grid row or column of a coordinate or array of them."""
+        if isinstance(degrees, np.ndarray):
+            return np.floor(degrees / self.cell_size).astype(int)
+        return int(math.floor(degrees / self.cell_size))
+
+    def _remove(self, pk):
+        """Drop one fence, the caller holding the lock."""
+        fence = self._fences.pop(pk, None)
+        if fence is None:
+            return
+        if fence.device_id is None:
+            self._by_user[fence.user_id].discard(pk)
+        else:
+            self._by_device[fence.device_id].discard(pk)
+        if pk in self._large:
+            self._large.discard(pk)
+            return
+        box = fence.box
+        for row in range(self._cell(box[0]), self._cell(box[2]) + 1):
+            for column in range(self._cell(box[1]), self._cell(box[3]) + 1):
+                cell = self._cells.get((row, column))
+                if cell is not None:
+                    cell.discard(pk)
+                    if not cell:
+                        del self._cells[(row, column)]
+
+
+def contains(fences, lats, lngs):
+    """Which points are inside which fences, as a boolean array with a
+    row per fence and a column per point.
+
+    Even-odd ray casting. Only the (fence, point) pairs whose point is in
+    the fence's bounding box are tested, each against all of its fence's
+    edges at once; fences are grouped by vertex count and padded with
+    empty edges to the largest in their group."""
+    inside = np.zeros((len(fences), len(lats)), dtype=bool)
+    groups = defaultdict(list)
+    for row, fence in enumerate(fences):
+        groups[len(fence.lat).bit_length()].append(row)
+    for rows in groups.values():
+        rows = np.array(rows)
+        group = [fences[row] for row in rows]
+        boxes = np.array([fence.box for fence in group])
+        in_box = (
+            (lats >= boxes[:, 0, np.newaxis]) &
+            (lngs >= boxes[:, 1, np.newaxis]) &
+            (lats <= boxes[:, 2, np.newaxis]) &
+            (lngs <= boxes[:, 3, np.newaxis]))
+        fence_index, point_index = np.nonzero(in_box)
+        if not len(fence_index):
+            continue
+        lat_edges, lng_edges = _edges(group)
+        step = max(1, MATRIX_SIZE // lat_edges.shape[1])
+        for first in range(0, len(fence_index), step):
+            pairs = slice(first, first + step)
+            hits = _crossings(
+                lat_edges[fence_index[pairs]], lng_edges[fence_index[pairs]],
+                lats[point_index[pairs]], lngs[point_index[pairs]])
+            inside[rows[fence_index[pairs]], point_index[pairs]] = hits
+    return inside
+
+
+def _edges(fences):
+    """Closed vertex arrays of fences, padded by repeating the first
+    vertex so every row has the same number of edges."""
+    size = max(len(fence.lat) for fence in fences) + 1
+    lat = np.empty((len(fences), size))
+    lng = np.empty((len(fences), size))
+    for row, fence in enumerate(fences):
+        count = len(fence.lat)
+        lat[row, :count], lat[row, count:] = fence.lat, fence.lat[0]
+        lng[row, :count], lng[row, count:] = fence.lng, fence.lng[0]
+    return lat, lng
+
+
+def _crossings(lat_edges, lng_edges, lats, lngs):
+    """Whether each point is inside the polygon of its row of edges."""
+    lat0, lat1 = lat_edges[:, :-1], lat_edges[:, 1:]
+    lng0, lng1 = lng_edges[:, :-1], lng_edges[:, 1:]
+    lat = lats[:, np.newaxis]
+    straddles = (lat0 > lat) != (lat1 > lat)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing = lng0 + (lat - lat0) * (lng1 - lng0) / (lat1 - lat0)
+    hits = straddles & (lngs[:, np.newaxis] < crossing)
+    return np.count_nonzero(hits, axis=1) % 2 == 1
+
+
+def evaluate(device_id, points):
+    """Record the geofence events of points just inserted for a device.
+
+    Must run in the inserting transaction before the device's last fix
+    is updated; it locks the device row so concurrent batches for one
+    device are evaluated one after the other. Returns the events."""
+    if not points:
+        return []
+    points = sorted(points)
+    lats = np.array([point[1] for point in points], dtype=float)
+    lngs = np.array([point[2] for point in points], dtype=float)
+    near, owned = fence_index.near(device_id, lats, lngs)
+    if not owned:
+        return []
+    last = TrackerDevice.objects.select_for_update().filter(
+        pk=device_id).values_list('last_time', flat=True).first()
+    if last is not None:
+        newer = [index for index, point in enumerate(points)
+                 if point[0] > last]
+        points = [points[index] for index in newer]
+        lats, lngs = lats[newer], lngs[newer]
+        if not points:
+            return []
+    present = set(GeofencePresence.objects.filter(
+        device_id=device_id).values_list('fence_id', flat=True))
+    outside = np.zeros(len(points), dtype=bool)
+    inside = dict(zip(
+        [fence.id for fence in near], contains(near, lats, lngs)))
+    events = []
+    entered = []
+    exited = []
+    for pk in sorted(set(inside) | present):
+        row = inside.get(pk, outside)
+        before = np.concatenate([[pk in present], row[:-1]])
+        for index in np.flatnonzero(row != before):
+            time, lat, lng = points[index][:3]
+            events.append(GeofenceEvent(
+                fence_id=pk, device_id=device_id, time=time, lat=lat, lng=lng,
+                kind='enter' if row[index] else 'exit'))
+        if row[-1] and pk not in present:
+            entered.append(GeofencePresence(
+                fence_id=pk, device_id=device_id, time=points[
+                    _last_entry(row)][0]))
+        elif not row[-1] and pk in present:
+            exited.append(pk)
+    if events:
+        GeofenceEvent.objects.bulk_create(events)
+    if exited:
+        GeofencePresence.objects.filter(
+            device_id=device_id, fence_id__in=exited).delete()
+    if entered:
+        GeofencePresence.objects.bulk_create(entered)
+    return events
+
+
+def _last_entry(row):
+    """Index of the point starting the final run of inside points."""
+    outside = np.flatnonzero(~row)
+    return outside[-1] + 1 if len(outside) else 0
+
+
+fence_index = FenceIndex(ttl=settings.GEOFENCE_INDEX_TTL)
+
+
+@receiver(post_save, sender=Geofence)
+def index_fence(sender, instance, **kwargs):
+    """Re-index a saved fence once the save commits."""
+    transaction.on_commit(lambda: fence_index.update(instance))
+
+
+@receiver(post_delete, sender=Geofence)
+def unindex_fence(sender, instance, **kwargs):
+    """Drop a deleted fence from the index once the deletion commits."""
+    pk = instance.pk
+    transaction.on_commit(lambda: fence_index.remove(pk))
+
+
+@receiver(post_delete, sender=TrackerDevice)
+def forget_device(sender, instance, **kwargs):
+    """Forget a deleted device's owner."""
+    fence_index.forget_device(instance.pk)
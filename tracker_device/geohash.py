@@ -0,0 +1,86 @@
+"""Geohashes as integers, for range scans over an area.
+
+A geohash interleaves the bits of a point's longitude and latitude,
+longitude first, so points close together share a prefix. Storing the
+60 bit hash of a 12 character geohash as an integer, rather than as
+text, lets a prefix be found with a plain range on an integer index,
+whatever the database's collation.
+
+`cover` turns a bounding box into a few such ranges. Every point in the
+box falls in one of them, but the ranges reach a little past the box,
+so callers still filter on lat and lng."""
+BITS = 30
+PRECISION = 12
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_CELLS = 16
+
+
+def encode(lat, lng):
+    """The integer geohash of a point."""
+    return (_spread(_quantize(lng, 180)) << 1) | _spread(_quantize(lat, 90))
+
+
+def to_string(value, precision=PRECISION):
+    """The usual base32 form of an integer geohash, to precision
+    characters."""
+    value >>= 5 * (PRECISION - precision)
+    characters = []
+    for i in range(precision):
+        characters.append(BASE32[value & 31])
+        value >>= 5
+    return ''.join(reversed(characters))
+
+
+def cover(south, west, north, east):
+    """Half open (low, high) ranges of geohashes covering a box.
+
+    A box with west greater than east crosses the antimeridian."""
+    if west > east:
+        return _merge(
+            cover(south, west, north, 180) + cover(south, -180, north, east))
+    low_lat, high_lat = _quantize(south, 90), _quantize(north, 90)
+    low_lng, high_lng = _quantize(west, 180), _quantize(east, 180)
+    level = 0
+    for bits in range(BITS + 1):
+        shift = BITS - bits
+        cells = ((high_lat >> shift) - (low_lat >> shift) + 1) * (
+            (high_lng >> shift) - (low_lng >> shift) + 1)
+        if cells > MAX_CELLS:
+            break
+        level = bits
+    shift = BITS - level
+    size = 1 << (2 * shift)
+    ranges = []
+    for y in range(low_lat >> shift, (high_lat >> shift) + 1):
+        for x in range(low_lng >> shift, (high_lng >> shift) + 1):
+            low = ((_spread(x) << 1) | _spread(y)) << (2 * shift)
+            ranges.append((low, low + size))
+    return _merge(ranges)
+
+
+def _quantize(degrees, limit):
+    """A coordinate in -limit..limit as a BITS bit integer."""
+    cell = int((degrees + limit) / (2.0 * limit) * (1 << BITS))
+    return min(max(cell, 0), (1 << BITS) - 1)
+
+
+def _spread(value):
+    """Put a zero bit before each of value's low BITS bits."""
+    value &= 0x3fffffff
+    value = (value | (value << 16)) & 0x0000ffff0000ffff
+    value = (value | (value << 8)) & 0x00ff00ff00ff00ff
+    value = (value | (value << 4)) & 0x0f0f0f0f0f0f0f0f
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
+def _merge(ranges):
+    """Sort ranges and join those that touch."""
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+    return merged
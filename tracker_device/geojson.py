@@ -0,0 +1,36 @@
+"""GeoJSON for tracks, written a chunk of points at a time.
+
+`stream` turns (time, lat, lng, elevation) points into the text of a
+FeatureCollection of Point features, oldest first, for a
+StreamingHttpResponse. A long track is never held as one string, and
+points read lazily, as from archive.window, are read as they are sent."""
+import json
+
+CONTENT_TYPE = 'application/geo+json'
+CHUNK_SIZE = 1000
+
+
+def stream(points, chunk_size=CHUNK_SIZE):
+    """Yield the FeatureCollection of points in pieces."""
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ''
+    chunk = []
+    for point in points:
+        chunk.append(feature(point))
+        if len(chunk) == chunk_size:
+            yield separator + json.dumps(chunk)[1:-1]
+            separator = ', '
+            chunk = []
+    if chunk:
+        yield separator + json.dumps(chunk)[1:-1]
+    yield ']}'
+
+
+def feature(point):
+    """A Point feature for a (time, lat, lng, elevation) point."""
+    time, lat, lng, elevation = point[:4]
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lng, lat, elevation]},
+        'properties': {'time': time.isoformat()},
+    }
@@ -0,0 +1,197 @@
+"""Helpers for turning device uploads into DataPoint rows.
+
+The single point endpoint validates each fix with a ModelForm. Devices
+replaying a backlog send hundreds of fixes at once, so these helpers
+validate a whole payload with the same form fields and write it with a
+single bulk insert. Points a device already sent are skipped, so
+replaying an upload is harmless."""
+import csv
+import io
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django import forms
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from tracker import metrics
+from tracker_device.models import DataPoint, TrackerDevice
+from tracker_device import (
+    geofences, geohash, mirror, rollups, spool, tracks)
+
+POINT_FIELDS = ('time', 'lat', 'lng', 'elevation')
+INSERT_CHUNK_SIZE = 500
+INSERT_SQL = (
+    'INSERT INTO {table} '
+    '(device_id, time, lat, lng, elevation, time_received, geohash) '
+    'VALUES {rows} '
+    'ON CONFLICT (device_id, time) DO NOTHING '
+    'RETURNING time'
+)
+
+# The same form fields CreateDataPointForm builds from the model, created
+# once instead of once per point.
+FORM_FIELDS = dict(
+    (name, DataPoint._meta.get_field(name).formfield())
+    for name in POINT_FIELDS
+)
+
+
+class PayloadError(ValueError):
+    """Raised when an upload can't be read as a list of points at all."""
+
+
+def parse_payload(body, content_type):
+    """Read a JSON or CSV request body into a list of dicts.
+
+    JSON bodies are an array of objects, CSV bodies have a header row
+    naming the columns."""
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        raise PayloadError('Body is not UTF-8.')
+    if content_type == 'text/csv':
+        return list(csv.DictReader(io.StringIO(text)))
+    try:
+        rows = json.loads(text)
+    except ValueError:
+        raise PayloadError('Body is not valid JSON.')
+    if not isinstance(rows, list):
+        raise PayloadError('Expected an array of points.')
+    return rows
+
+
+def clean_points(rows):
+    """Validate rows with CreateDataPointForm's rules.
+
+    Returns a list of (time, lat, lng, elevation) tuples and a dict of
+    errors keyed by row index. Nothing should be saved if there are
+    errors."""
+    limit = settings.DATA_POINT_BATCH_LIMIT
+    if len(rows) > limit:
+        message = 'At most {} points per request.'.format(limit)
+        return [], {'payload': [message]}
+    points = []
+    errors = {}
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[str(index)] = {'__all__': ['Expected an object.']}
+            continue
+        values = []
+        row_errors = {}
+        for name in POINT_FIELDS:
+            try:
+                values.append(FORM_FIELDS[name].clean(row.get(name)))
+            except forms.ValidationError as error:
+                row_errors[name] = error.messages
+        if row_errors:
+            errors[str(index)] = row_errors
+        else:
+            points.append(tuple(values))
+    return points, errors
+
+
+def save_points(device_id, points):
+    """Insert points for a device, skipping any it already has.
+
+    Devices resend points after a dropped upload, so a point whose
+    (device, time) is already stored is ignored rather than an error.
+    Returns the points that were actually inserted."""
+    count = len(points)
+    unique = OrderedDict()
+    for point in points:
+        unique.setdefault(point[0], point)
+    points = list(unique.values())
+    inserted = []
+    received = timezone.now()
+    with transaction.atomic(savepoint=False):
+        for start in range(0, len(points), INSERT_CHUNK_SIZE):
+            chunk = points[start:start + INSERT_CHUNK_SIZE]
+            inserted.extend(
+                _insert_ignoring_conflicts(device_id, chunk, received))
+        rollups.update(device_id, inserted)
+        if inserted:
+            times = [point[0] for point in inserted]
+            tracks.invalidate(device_id, min(times), max(times))
+            geofences.evaluate(device_id, inserted)
+            _count_points(device_id, inserted, received)
+            if mirror.enabled():
+                transaction.on_commit(
+                    lambda: mirror.append(device_id, inserted))
+    metrics.ingest_points.inc('created', amount=len(inserted))
+    metrics.ingest_points.inc('duplicate', amount=count - len(inserted))
+    return inserted
+
+
+def _count_points(device_id, inserted, received):
+    """Add inserted points to the device's point count and last fix.
+
+    One UPDATE computed from the row's current values, so concurrent
+    ingest for the same device can't lose a count, and an older batch
+    finishing last doesn't move the last fix back."""
+    newest = max(inserted)
+    later = Q(last_time__isnull=True) | Q(last_time__lt=newest[0])
+
+    def latest(name, value):
+        return Case(
+            When(later, then=Value(value)),
+            default=F(name),
+            output_field=TrackerDevice._meta.get_field(name),
+        )
+    TrackerDevice.objects.filter(pk=device_id).update(
+        point_count=F('point_count') + len(inserted),
+        last_time=latest('last_time', newest[0]),
+        last_lat=latest('last_lat', newest[1]),
+        last_lng=latest('last_lng', newest[2]),
+        last_received=received,
+        updated=received,
+    )
+
+
+def _insert_ignoring_conflicts(device_id, points, received):
+    """INSERT ... ON CONFLICT DO NOTHING, returning the new points.
+
+    Works on PostgreSQL and SQLite 3.35 or newer."""
+    time_field = DataPoint._meta.get_field('time')
+    received = time_field.get_db_prep_value(received, connection)
+    params = []
+    for time, lat, lng, elevation in points:
+        time = time_field.get_db_prep_value(time, connection)
+        params.extend([
+            device_id, time, lat, lng, elevation, received,
+            geohash.encode(lat, lng),
+        ])
+    sql = INSERT_SQL.format(
+        table=connection.ops.quote_name(DataPoint._meta.db_table),
+        rows=', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(points)),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        created = set(_aware(row[0]) for row in cursor.fetchall())
+    return [point for point in points if point[0] in created]
+
+
+def _aware(value):
+    """Turn a datetime column read back from the database into an aware
+    datetime."""
+    if not isinstance(value, datetime):
+        value = parse_datetime(value)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def accept_points(device_id, points):
+    """Save points, or spool them when ingest is in write-behind mode.
+
+    Returns how many new points were saved, or None if they were
+    spooled."""
+    if settings.DATA_POINT_INGEST_MODE == 'spool':
+        spool.append(device_id, points)
+        metrics.ingest_points.inc('spooled', amount=len(points))
+        return None
+    return len(save_points(device_id, points))
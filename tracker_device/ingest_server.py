@@ -0,0 +1,404 @@
+"""Asyncio ingest server for devices on slow cellular links.
+
+Under WSGI every upload holds a worker for as long as the device takes
+to send it, which on a GSM link can be seconds, so the number of devices
+that can upload at once is the number of workers. This server reads
+requests on a single event loop, where a slow connection costs only a
+socket, and hands complete requests to a PointBatcher that writes them
+to the database in batches from one worker thread.
+
+It speaks just enough HTTP/1.1 for the device endpoints, with the same
+paths and validation as the Django views:
+
+    POST /device/data/create          form encoded single point
+    POST /device/data/<uuid>/batch    JSON or CSV array of points
+    POST /device/data/packed          packed binary points
+
+Points are always written directly, DATA_POINT_INGEST_MODE doesn't
+apply since the batcher already keeps the database off the request
+path. Devices over their rate limit get a 429, and every device gets a
+503 while more than `max_queued` points wait on the database. Run it with
+``python manage.py runingestserver``."""
+import asyncio
+import json
+import logging
+import math
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    close_old_connections,
+    connection,
+    transaction,
+)
+from django.http import QueryDict
+
+from tracker import metrics
+from tracker_device import packed
+from tracker_device.device_cache import device_cache, UNKNOWN
+from tracker_device.ingest import (
+    PayloadError,
+    parse_payload,
+    clean_points,
+    save_points,
+)
+from tracker_device.models import TrackerDevice
+from tracker_device.ratelimit import retry_after
+
+BATCH_PATH = re.compile(
+    r'^/device/data/(?P<uuid>[0-9a-fA-F-]{32,36})/batch$'
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BadRequest(Exception):
+    """Raised when a request can't be parsed as HTTP."""
+
+    def __init__(self, status, message):
+        super(BadRequest, self).__init__(message)
+        self.status = status
+
+
+class PointBatcher(object):
+    """Collects points from many requests and writes them together.
+
+    Waits up to `interval` seconds or until `max_points` are queued, then
+    writes everything queued in one transaction."""
+
+    def __init__(self, max_points=5000, interval=0.2, executor=None):
+        self.max_points = max_points
+        self.interval = interval
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+        self.queued = 0
+        self.wakeup = None
+        self.task = None
+
+    def start(self):
+        """Start flushing on the current event loop."""
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        """Stop flushing, writing anything still queued."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def submit(self, device_id, points):
+        """Queue points and wait for them to be written.
+
+        Returns how many were new, or None if the device no longer
+        exists."""
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append((device_id, points, future))
+        self.queued += len(points)
+        if self.queued >= self.max_points and self.wakeup is not None:
+            self.wakeup.set()
+        return await future
+
+    async def run(self):
+        """Flush every interval, or sooner if the queue fills up."""
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything queued so far."""
+        batch, self.pending, self.queued = self.pending, [], 0
+        if not batch:
+            return
+        requests = [(device_id, points) for device_id, points, f in batch]
+        try:
+            results = await asyncio.get_event_loop().run_in_executor(
+                self.executor, write_batch, requests)
+        except Exception as error:
+            for device_id, points, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (device_id, points, future), created in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(created, Exception):
+                future.set_exception(created)
+            else:
+                future.set_result(created)
+
+
+def write_batch(requests):
+    """Write (device_id, points) pairs in one transaction.
+
+    Returns, for each pair, how many of its points were new, None if its
+    device no longer exists, or the DatabaseError saving its device's
+    points raised. Each device is saved under its own savepoint, so one
+    failing device doesn't fail the others."""
+    _recycle_connection()
+    by_device = defaultdict(list)
+    for device_id, points in requests:
+        by_device[device_id].extend(points)
+    created = {}
+    with transaction.atomic():
+        # Locked so a device can't be deleted before its points are in.
+        existing = set(TrackerDevice.objects.select_for_update().filter(
+            pk__in=list(by_device)).order_by('pk').values_list(
+                'pk', flat=True))
+        for device_id, points in by_device.items():
+            if device_id not in existing:
+                continue
+            try:
+                with transaction.atomic():
+                    saved = save_points(device_id, points)
+            except DatabaseError as error:
+                created[device_id] = error
+            else:
+                created[device_id] = set(point[0] for point in saved)
+    results = []
+    for device_id, points in requests:
+        if device_id not in created:
+            results.append(None)
+            continue
+        new = created[device_id]
+        if isinstance(new, Exception):
+            results.append(new)
+            continue
+        # Credit each new point to the first request that sent it.
+        count = 0
+        for point in points:
+            if point[0] in new:
+                new.discard(point[0])
+                count += 1
+        results.append(count)
+    return results
+
+
+def _recycle_connection():
+    """Close this thread's connection if it is broken or too old.
+
+    The writer and lookup threads outlive requests, so they recycle their
+    connections the way the end of a request would."""
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+
+def resolve_device(uuid):
+    """device_cache.resolve on a lookup thread.
+
+    Shared with the UDP listener's lookup threads."""
+    _recycle_connection()
+    return device_cache.resolve(uuid)
+
+
+class IngestServer(object):
+    """Serves the device ingest endpoints on an asyncio event loop."""
+
+    def __init__(self, batcher, timeout=300, max_body=1024 * 1024,
+                 lookups=None, max_queued=50000):
+        self.batcher = batcher
+        self.timeout = timeout
+        self.max_body = max_body
+        self.max_queued = max_queued
+        self.lookups = lookups or ThreadPoolExecutor(max_workers=4)
+
+    async def handle(self, reader, writer):
+        """Serve requests on one connection until it closes."""
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        read_request(reader, self.max_body), self.timeout)
+                except BadRequest as error:
+                    response = json_response(
+                        error.status, {'errors': {'request': [str(error)]}})
+                    await send(writer, response, keep_alive=False)
+                    return
+                if request is None:
+                    return
+                method, path, headers, body = request
+                try:
+                    response = await self.respond(
+                        method, path, headers, body)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # Typically the database being unavailable; the
+                    # device keeps its points and sends them again.
+                    logger.exception('Error handling %s %s', method, path)
+                    response = json_response(503, {
+                        'errors': {'server': ['Try again later']}})
+                    response[1].append(('Retry-After', '1'))
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await send(writer, response, keep_alive)
+                if not keep_alive:
+                    return
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, path, headers, body):
+        """Route a request, returning (status, headers, body)."""
+        if method != 'POST':
+            return json_response(405, {'errors': {'method': ['POST only']}})
+        if self.batcher.queued > self.max_queued:
+            metrics.ingest_rejected.inc('busy')
+            return retry_response(503, 'Server busy', 1)
+        content_type = headers.get('content-type', '').split(';')[0]
+        batch = BATCH_PATH.match(path)
+        if path == '/device/data/create':
+            return await self.create(body)
+        elif batch:
+            return await self.create_batch(
+                batch.group('uuid'), body, content_type)
+        elif path == '/device/data/packed':
+            return await self.create_packed(body)
+        return json_response(404, {'errors': {'path': ['Not found']}})
+
+    async def create(self, body):
+        """Handle a form encoded single point."""
+        data = QueryDict(body)
+        wait = retry_after(data.get('uuid'))
+        if wait:
+            return retry_response(429, 'Too many requests', wait)
+        device = await self.resolve(data.get('uuid'))
+        points, errors = clean_points([data.dict()])
+        if device is None:
+            errors.setdefault('0', {})['uuid'] = ['Bad UUID']
+        if errors:
+            return json_response(400, {'errors': errors['0']})
+        created = await self.batcher.submit(device.id, points)
+        if created is None:
+            return json_response(400, {'errors': {'uuid': ['Bad UUID']}})
+        return 302, [('Location', '/')], b''
+
+    async def create_batch(self, uuid, body, content_type):
+        """Handle a JSON or CSV array of points."""
+        wait = retry_after(uuid)
+        if wait:
+            return retry_response(429, 'Too many requests', wait)
+        device = await self.resolve(uuid)
+        if device is None:
+            return json_response(400, {'errors': {'uuid': ['Bad UUID']}})
+        try:
+            rows = parse_payload(body, content_type)
+        except PayloadError as error:
+            return json_response(400, {'errors': {'payload': [str(error)]}})
+        points, errors = clean_points(rows)
+        if errors:
+            return json_response(400, {'errors': errors})
+        return await self.save(device, points)
+
+    async def create_packed(self, body):
+        """Handle a packed binary payload."""
+        try:
+            uuid, time, lat, lng, elevation = packed.decode(body)
+        except packed.PackedError as error:
+            return json_response(400, {'errors': {'payload': [str(error)]}})
+        wait = retry_after(uuid)
+        if wait:
+            return retry_response(429, 'Too many requests', wait)
+        device = await self.resolve(uuid)
+        if device is None:
+            return json_response(400, {'errors': {'uuid': ['Bad UUID']}})
+        limit = settings.DATA_POINT_BATCH_LIMIT
+        if len(time) > limit:
+            message = 'At most {} points per request.'.format(limit)
+            return json_response(400, {'errors': {'payload': [message]}})
+        points = packed.to_points(time, lat, lng, elevation)
+        return await self.save(device, points)
+
+    async def save(self, device, points):
+        """Queue points and describe the result like the batch view."""
+        created = await self.batcher.submit(device.id, points)
+        if created is None:
+            return json_response(400, {'errors': {'uuid': ['Bad UUID']}})
+        return json_response(201, {
+            'created': created,
+            'duplicates': len(points) - created,
+        })
+
+    async def resolve(self, uuid):
+        """Resolve a UUID, only leaving the event loop on a cache miss."""
+        device = device_cache.peek(uuid)
+        if device is UNKNOWN:
+            device = await asyncio.get_event_loop().run_in_executor(
+                self.lookups, resolve_device, uuid)
+        return device
+
+
+async def read_request(reader, max_body):
+    """Read one request, returning (method, path, headers, body).
+
+    Returns None if the connection closed before a request started."""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as error:
+        if error.partial.strip():
+            raise BadRequest(400, 'Connection closed mid-request.')
+        return None
+    except asyncio.LimitOverrunError:
+        raise BadRequest(431, 'Request headers too large.')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise BadRequest(400, 'Malformed request line.')
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, sep, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise BadRequest(411, 'Send a Content-Length.')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise BadRequest(400, 'Malformed Content-Length.')
+    if length > max_body:
+        raise BadRequest(413, 'Request body too large.')
+    try:
+        body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise BadRequest(400, 'Connection closed mid-request.')
+    return method, target.split('?')[0], headers, body
+
+
+def json_response(status, data):
+    """Return a (status, headers, body) JSON response."""
+    body = json.dumps(data).encode('utf-8')
+    return status, [('Content-Type', 'application/json')], body
+
+
+def retry_response(status, message, wait):
+    """Return a JSON error telling the client when to try again."""
+    status, headers, body = json_response(
+        status, {'errors': {'uuid': [message]}})
+    headers.append(('Retry-After', str(int(math.ceil(wait)))))
+    return status, headers, body
+
+
+async def send(writer, response, keep_alive):
+    """Write a (status, headers, body) response."""
+    status, headers, body = response
+    lines = ['HTTP/1.1 {} {}'.format(status, HTTPStatus(status).phrase)]
+    headers = headers + [
+        ('Content-Length', str(len(body))),
+        ('Connection', 'keep-alive' if keep_alive else 'close'),
+    ]
+    lines.extend('{}: {}'.format(name, value) for name, value in headers)
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
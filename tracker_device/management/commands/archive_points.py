@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tracker_device import archive
+from tracker_device.models import TrackerDevice
+from tracker_device.partitions import add_months, month_start
+
+
+class Command(BaseCommand):
+    """Move old data points out of the database into archive files."""
+    help = (
+        'Move every device\'s data points from months before a cutoff into '
+        'compressed files under DATA_POINT_ARCHIVE_DIR. Archived points are '
+        'still shown on route and device pages. Points arriving late for an '
+        'archived month are merged into its file on the next run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'device', nargs='*', type=int,
+            help='Ids of the devices to archive, all if none are given.')
+        parser.add_argument(
+            '--months', type=int, default=12,
+            help='Archive points older than this many months before this '
+                 'one.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=archive.DELETE_CHUNK_SIZE,
+            help='Archived points deleted from the database per query.')
+
+    def handle(self, *args, **options):
+        cutoff = add_months(month_start(timezone.now()), -options['months'])
+        devices = TrackerDevice.objects.order_by('pk')
+        if options['device']:
+            devices = devices.filter(pk__in=options['device'])
+        total = 0
+        for device_id in devices.values_list('pk', flat=True):
+            for month in archive.archivable_months(device_id, cutoff):
+                count = archive.archive_month(
+                    device_id, month, options['chunk_size'])
+                total += count
+                self.stdout.write('Device {} {:%Y-%m}: {} points'.format(
+                    device_id, month, count))
+        self.stdout.write('Archived months before {:%Y-%m}, {} points'.format(
+            cutoff, total))
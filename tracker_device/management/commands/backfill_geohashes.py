@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Value, When
+
+from tracker_device import geohash
+from tracker_device.models import DataPoint, TrackerDevice
+
+CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """Fill in the geohash of data points saved before it existed."""
+    help = (
+        'Compute the geohash of every data point that lacks one, for every '
+        'device or the devices given. Points are updated a chunk at a '
+        'time, each chunk in its own transaction, so the command can be '
+        'stopped and run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'device', nargs='*', type=int,
+            help='Ids of the devices to backfill, all if none are given.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Data points updated per query.')
+
+    def handle(self, *args, **options):
+        devices = TrackerDevice.objects.order_by('pk')
+        if options['device']:
+            devices = devices.filter(pk__in=options['device'])
+        for device_id in devices.values_list('pk', flat=True):
+            updated = self.backfill(device_id, options['chunk_size'])
+            if updated:
+                self.stdout.write('Device {}: {} points'.format(
+                    device_id, updated))
+
+    def backfill(self, device_id, chunk_size):
+        """Fill in one device's geohashes, returning how many were set.
+
+        Chunks are read in time order along the (device, time) index and
+        updated by time, so on a partitioned table each chunk's queries
+        only touch the partitions it falls in."""
+        points = DataPoint.objects.filter(
+            device_id=device_id, geohash__isnull=True).order_by('time')
+        updated = 0
+        after = None
+        while True:
+            chunk = points if after is None else points.filter(
+                time__gt=after)
+            chunk = list(chunk.values_list('time', 'lat', 'lng')[:chunk_size])
+            if not chunk:
+                return updated
+            with transaction.atomic():
+                updated += points.filter(
+                    time__range=(chunk[0][0], chunk[-1][0]),
+                ).update(geohash=Case(
+                    *[When(time=time, then=Value(geohash.encode(lat, lng)))
+                      for time, lat, lng in chunk],
+                    output_field=BigIntegerField()
+                ))
+            after = chunk[-1][0]
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tracker_device import rollups
+from tracker_device.models import TrackerDevice
+
+
+class Command(BaseCommand):
+    """Rebuild hourly and daily rollups from existing data points."""
+    help = (
+        'Recompute the hourly and daily rollups of every device, or of the '
+        'devices given, from their data points. Each device is rebuilt in '
+        'its own transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'device', nargs='*', type=int,
+            help='Ids of the devices to rebuild, all if none are given.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=rollups.REBUILD_CHUNK_SIZE,
+            help='Data points read per query.')
+
+    def handle(self, *args, **options):
+        devices = TrackerDevice.objects.order_by('pk')
+        if options['device']:
+            devices = devices.filter(pk__in=options['device'])
+        for device_id in devices.values_list('pk', flat=True):
+            with transaction.atomic():
+                hours, days = rollups.rebuild_device(
+                    device_id, options['chunk_size'])
+            self.stdout.write('Device {}: {} hours, {} days'.format(
+                device_id, hours, days))
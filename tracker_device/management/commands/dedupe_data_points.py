@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from tracker_device.models import DataPoint
+
+DELETE_SQL = (
+    'DELETE FROM {table} WHERE id IN ('
+    ' SELECT duplicate.id FROM {table} duplicate'
+    ' WHERE duplicate.id >= %s AND duplicate.id < %s AND EXISTS ('
+    '  SELECT 1 FROM {table} kept'
+    '  WHERE kept.device_id = duplicate.device_id'
+    '  AND kept.time = duplicate.time'
+    '  AND kept.id < duplicate.id))'
+)
+# Nothing indexes (device, time) before the unique index is added, so
+# without this each chunk's EXISTS scans the table.
+INDEX_NAME = 'tracker_device_datapoint_dedupe'
+CREATE_INDEX_SQL = (
+    'CREATE INDEX {concurrently}{name} ON {table} (device_id, time, id)')
+DROP_INDEX_SQL = 'DROP INDEX {concurrently}IF EXISTS {name}'
+
+
+class Command(BaseCommand):
+    """Remove data points that repeat a device's (device, time)."""
+    help = (
+        'Delete duplicate data points, keeping the first one received. '
+        'Works through the table in id ranges, each in its own short '
+        'transaction, so devices can keep writing while it runs. A '
+        'temporary index on (device, time, id) is built first and dropped '
+        'when it finishes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Ids checked per transaction.')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to wait between chunks.')
+
+    def handle(self, *args, **options):
+        bounds = DataPoint.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            return
+        table = connection.ops.quote_name(DataPoint._meta.db_table)
+        sql = DELETE_SQL.format(table=table)
+        deleted = 0
+        # A failed earlier run can leave an invalid index behind.
+        self.execute_index(DROP_INDEX_SQL, table)
+        self.execute_index(CREATE_INDEX_SQL, table)
+        try:
+            for start in range(
+                    bounds['low'], bounds['high'] + 1, options['chunk_size']):
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            sql, [start, start + options['chunk_size']])
+                        deleted += cursor.rowcount
+                if options['pause']:
+                    time.sleep(options['pause'])
+        finally:
+            self.execute_index(DROP_INDEX_SQL, table)
+        self.stdout.write('Deleted {} duplicate data points'.format(deleted))
+
+    def execute_index(self, template, table):
+        """Create or drop the temporary index, concurrently on PostgreSQL
+        so writes aren't blocked while it's built."""
+        concurrently = (
+            'CONCURRENTLY ' if connection.vendor == 'postgresql' else '')
+        with connection.cursor() as cursor:
+            cursor.execute(template.format(
+                concurrently=concurrently,
+                name=connection.ops.quote_name(INDEX_NAME), table=table))
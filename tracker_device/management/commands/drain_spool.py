@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracker_device import spool
+
+
+class Command(BaseCommand):
+    """Move spooled data points into the database."""
+    help = (
+        'Drain the write-behind ingest spool into DataPoint, once or '
+        'continuously.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain what is spooled now and exit.')
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to wait between drains.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Points written per transaction.')
+        parser.add_argument(
+            '--status', action='store_true',
+            help='Print the number of spooled points and exit.')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.stdout.write('{} points spooled'.format(spool.queue_depth()))
+            return
+        while True:
+            totals = spool.drain(batch_size=options['batch_size'])
+            if any(totals.values()) or options['verbosity'] > 1:
+                self.stdout.write(
+                    'saved {saved}, dropped {dropped}, corrupt {corrupt}, '
+                    '{depth} still spooled'.format(
+                        depth=spool.queue_depth(), **totals))
+            if options['once']:
+                return
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                return
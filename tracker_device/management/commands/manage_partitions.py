@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tracker_device import partitions, retention, tracks
+
+
+class Command(BaseCommand):
+    """Create upcoming DataPoint partitions and enforce retention."""
+    help = (
+        'Create the monthly DataPoint partitions for the coming months, '
+        'drop or detach months every user\'s retention has passed, and '
+        'delete older points of users who keep less. Run it daily.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ahead', type=int, default=3,
+            help='Months of partitions to create ahead of this one.')
+        parser.add_argument(
+            '--detach', action='store_true',
+            help='Detach expired partitions instead of dropping them.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Points deleted per transaction.')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to wait between chunks.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        cutoffs = retention.user_cutoffs(now)
+        if partitions.supported():
+            self.create_partitions(now, options['ahead'])
+            self.remove_partitions(
+                retention.horizon(cutoffs), options['detach'])
+        deleted = 0
+        for user_id, cutoff in cutoffs.items():
+            if cutoff is not None:
+                deleted += retention.expire_points(
+                    user_id, cutoff, options['chunk_size'], options['pause'])
+        self.stdout.write('Deleted {} expired data points'.format(deleted))
+
+    def create_partitions(self, now, ahead):
+        """Create missing partitions from this month to ahead months on."""
+        existing = partitions.partitions()
+        this_month = partitions.month_start(now)
+        for offset in range(ahead + 1):
+            month = partitions.add_months(this_month, offset)
+            end = partitions.add_months(month, 1)
+            if any(_overlaps(start, stop, month, end)
+                   for name, start, stop in existing):
+                continue
+            name = partitions.create_partition(month)
+            self.stdout.write('Created {}'.format(name))
+
+    def remove_partitions(self, horizon, detach):
+        """Drop or detach partitions ending before horizon."""
+        if horizon is None:
+            return
+        for name, start, end in partitions.partitions():
+            if end is not None and end <= horizon:
+                partitions.remove_partition(name, detach)
+                tracks.invalidate(None, start, end)
+                self.stdout.write('{} {}'.format(
+                    'Detached' if detach else 'Dropped', name))
+
+
+def _overlaps(start, end, month, month_end):
+    """Whether a partition's range overlaps [month, month_end)."""
+    if end is None:
+        # The default partition.
+        return False
+    return (start is None or start < month_end) and end > month
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker_device import mirror
+from tracker_device.models import TrackerDevice
+
+
+class Command(BaseCommand):
+    """Rebuild or check the memory mapped mirror of data points."""
+    help = (
+        'Rewrite the mirror files of every device, or of the devices '
+        'given, from their data points. With --check, compare the files '
+        'with the database instead and list the devices that differ.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'device', nargs='*', type=int,
+            help='Ids of the devices to rebuild or check, all if none are '
+                 'given.')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report devices whose mirror differs.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=mirror.CHUNK_SIZE,
+            help='Data points read per query.')
+
+    def handle(self, *args, **options):
+        if not mirror.enabled():
+            raise CommandError('DATA_POINT_MIRROR_DIR is not set.')
+        devices = TrackerDevice.objects.order_by('pk')
+        if options['device']:
+            devices = devices.filter(pk__in=options['device'])
+        device_ids = list(devices.values_list('pk', flat=True))
+        if options['check']:
+            self.check_devices(device_ids, options['chunk_size'])
+            return
+        for device_id in device_ids:
+            written = mirror.rebuild(device_id, options['chunk_size'])
+            self.stdout.write('Device {}: {} points'.format(
+                device_id, written))
+
+    def check_devices(self, device_ids, chunk_size):
+        """Report devices whose mirror differs, failing if any do."""
+        differ = 0
+        for device_id in device_ids:
+            time = mirror.verify(device_id, chunk_size)
+            if time is not None:
+                differ += 1
+                self.stdout.write('Device {}: differs from {}'.format(
+                    device_id, time.isoformat()))
+        if differ:
+            raise CommandError('{} devices differ.'.format(differ))
+        self.stdout.write('All {} devices match'.format(len(device_ids)))
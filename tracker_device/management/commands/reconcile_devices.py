@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from tracker_device import archive
+from tracker_device.models import TrackerDevice
+
+FIELDS = ('point_count', 'last_time', 'last_lat', 'last_lng', 'last_received')
+
+
+class Command(BaseCommand):
+    """Recompute each device's point count and last fix from its points."""
+    help = (
+        'Recompute the point count, last fix and last received time of '
+        'every device, or of the devices given, from their data points, '
+        'archived ones included, and report the devices that had drifted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'device', nargs='*', type=int,
+            help='Ids of the devices to reconcile, all if none are given.')
+
+    def handle(self, *args, **options):
+        devices = TrackerDevice.objects.order_by('pk')
+        if options['device']:
+            devices = devices.filter(pk__in=options['device'])
+        repaired = 0
+        for device_id in devices.values_list('pk', flat=True):
+            if self.reconcile(device_id):
+                repaired += 1
+        self.stdout.write('Repaired {} devices'.format(repaired))
+
+    def reconcile(self, device_id):
+        """Repair one device, returning whether anything had drifted.
+
+        The device row is locked first, so a concurrent ingest has either
+        committed before the points are counted or adds its own points to
+        the count after."""
+        with transaction.atomic():
+            device = TrackerDevice.objects.select_for_update().filter(
+                pk=device_id).first()
+            if device is None:
+                return False
+            totals = device.data.aggregate(
+                count=Count('id'), received=Max('time_received'))
+            count = totals['count'] + archive.archived_count(device_id)
+            last = archive.most_recent(device_id, 1)
+            last = last[0][:3] if last else (None, None, None)
+            # Archived points are long since received.
+            received = totals['received'] or device.last_received
+            actual = (count,) + tuple(last) + (received,)
+            stored = tuple(getattr(device, name) for name in FIELDS)
+            if actual == stored:
+                return False
+            TrackerDevice.objects.filter(pk=device_id).update(
+                updated=timezone.now(), **dict(zip(FIELDS, actual)))
+        self.stdout.write('Device {}: {} -> {}'.format(
+            device_id, stored[0], actual[0]))
+        return True
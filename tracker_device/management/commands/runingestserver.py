@@ -0,0 +1,58 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from tracker_device.ingest_server import IngestServer, PointBatcher
+
+
+class Command(BaseCommand):
+    """Run the asyncio device ingest server."""
+    help = (
+        'Serve the device ingest endpoints from one asyncio event loop, '
+        'writing points to the database in batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Points queued before a write is forced.')
+        parser.add_argument(
+            '--flush-interval', type=float, default=0.2,
+            help='Longest a point waits to be written, in seconds.')
+        parser.add_argument(
+            '--timeout', type=float, default=300,
+            help='Seconds a client may take to send one request.')
+        parser.add_argument(
+            '--backlog', type=int, default=1024,
+            help='Listen backlog for pending connections.')
+        parser.add_argument(
+            '--max-queued', type=int, default=50000,
+            help='Points waiting to be written before requests get a 503.')
+
+    def handle(self, *args, **options):
+        loop = asyncio.get_event_loop()
+        batcher = PointBatcher(
+            max_points=options['batch_size'],
+            interval=options['flush_interval'],
+        )
+        batcher.start()
+        ingest = IngestServer(
+            batcher,
+            timeout=options['timeout'],
+            max_queued=options['max_queued'],
+        )
+        server = loop.run_until_complete(asyncio.start_server(
+            ingest.handle, options['host'], options['port'],
+            backlog=options['backlog']))
+        self.stdout.write('Ingest server listening on {}:{}'.format(
+            options['host'], options['port']))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.run_until_complete(batcher.stop())
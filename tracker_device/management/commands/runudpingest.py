@@ -0,0 +1,68 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from tracker_device.ingest_server import PointBatcher
+from tracker_device.udp_server import UDPIngestProtocol
+
+
+class Command(BaseCommand):
+    """Run the UDP device ingest listener."""
+    help = (
+        'Listen for single fix UDP datagrams from devices and write them '
+        'to the database in batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8002)
+        parser.add_argument(
+            '--window', type=float, default=2.0,
+            help='Seconds fixes are held so late datagrams can be '
+                 'reordered.')
+        parser.add_argument(
+            '--max-pending', type=int, default=100000,
+            help='Fixes held at most before datagrams are dropped.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Points queued before a write is forced.')
+        parser.add_argument(
+            '--report-interval', type=float, default=60,
+            help='Seconds between printing counters.')
+
+    def handle(self, *args, **options):
+        loop = asyncio.get_event_loop()
+        batcher = PointBatcher(
+            max_points=options['batch_size'],
+            interval=options['window'] / 4,
+        )
+        batcher.start()
+        protocol = UDPIngestProtocol(
+            batcher,
+            window=options['window'],
+            max_pending=options['max_pending'],
+        )
+        protocol.start()
+        transport, _ = loop.run_until_complete(loop.create_datagram_endpoint(
+            lambda: protocol, local_addr=(options['host'], options['port'])))
+        self.stdout.write('UDP ingest listening on {}:{}'.format(
+            options['host'], options['port']))
+        loop.call_later(options['report_interval'], self.report, loop,
+                        protocol, options['report_interval'])
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            transport.close()
+            loop.run_until_complete(protocol.stop())
+            loop.run_until_complete(batcher.stop())
+            self.report(loop, protocol, None)
+
+    def report(self, loop, protocol, interval):
+        """Print the counters, and again after interval if given."""
+        self.stdout.write(', '.join(
+            '{} {}'.format(name, count)
+            for name, count in sorted(protocol.counters.items())))
+        if interval:
+            loop.call_later(interval, self.report, loop, protocol, interval)
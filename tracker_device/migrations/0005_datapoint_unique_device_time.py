@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Make (device, time) unique on DataPoint.
+
+Existing duplicates have to be removed first with
+``python manage.py dedupe_data_points``. On PostgreSQL the index is built
+concurrently so devices can keep writing while it builds, then attached
+as the constraint."""
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+INDEX = 'tracker_device_datapoint_device_id_time_uniq'
+
+
+def add_unique_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        # A failed concurrent build leaves an invalid index behind.
+        schema_editor.execute(
+            'DROP INDEX CONCURRENTLY IF EXISTS {}'.format(INDEX))
+        schema_editor.execute(
+            'CREATE UNIQUE INDEX CONCURRENTLY {} '
+            'ON tracker_device_datapoint (device_id, time)'.format(INDEX))
+        schema_editor.execute(
+            'ALTER TABLE tracker_device_datapoint '
+            'ADD CONSTRAINT {0} UNIQUE USING INDEX {0}'.format(INDEX))
+    else:
+        schema_editor.execute(
+            'CREATE UNIQUE INDEX {} '
+            'ON tracker_device_datapoint (device_id, time)'.format(INDEX))
+
+
+def remove_unique_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE tracker_device_datapoint '
+            'DROP CONSTRAINT {}'.format(INDEX))
+    else:
+        schema_editor.execute('DROP INDEX {}'.format(INDEX))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tracker_device', '0004_set_enddate_blanktrue'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_unique_index, remove_unique_index),
+            ],
+            state_operations=[
+                migrations.AlterUniqueTogether(
+                    name='datapoint',
+                    unique_together=set([('device', 'time')]),
+                ),
+            ],
+        ),
+    ]
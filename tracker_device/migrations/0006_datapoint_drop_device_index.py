@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Drop the single column index on DataPoint.device.
+
+The (device, time) unique index from 0005 starts with device_id, so it
+answers every lookup the foreign key index did, as well as time ranges
+and newest first scans within a device. Keeping both only slows ingest.
+On PostgreSQL the index is dropped concurrently so devices can keep
+writing."""
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+TABLE = 'tracker_device_datapoint'
+INDEX = 'tracker_device_datapoint_device_id_idx'
+
+
+def device_indexes(connection):
+    """Names of the indexes on device_id alone."""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, TABLE)
+    return [
+        name for name, info in constraints.items()
+        if info['columns'] == ['device_id'] and info['index'] and
+        not info['unique'] and not info['primary_key']
+    ]
+
+
+def drop_device_index(apps, schema_editor):
+    for name in device_indexes(schema_editor.connection):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(
+                'DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name))
+        else:
+            schema_editor.execute(schema_editor.sql_delete_index % {
+                'table': schema_editor.quote_name(TABLE),
+                'name': schema_editor.quote_name(name),
+            })
+
+
+def add_device_index(apps, schema_editor):
+    if device_indexes(schema_editor.connection):
+        return
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX CONCURRENTLY {} ON {} (device_id)'.format(
+                INDEX, TABLE))
+    else:
+        schema_editor.execute(
+            'CREATE INDEX {} ON {} (device_id)'.format(INDEX, TABLE))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tracker_device', '0005_datapoint_unique_device_time'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_device_index, add_device_index),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='datapoint',
+                    name='device',
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='data',
+                        to='tracker_device.TrackerDevice',
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Partition DataPoint by month on time, on PostgreSQL 12 or newer.
+
+The existing table is not copied. It is renamed and attached as the
+legacy partition, holding everything before next month, which is
+instant once a CHECK constraint proves its rows fit; the constraint is
+validated first without blocking writes. The swap itself runs in one
+short transaction. A default partition catches times outside every
+partition, and the next few months are created up front.
+
+The parent can't have a primary key on id alone, since PostgreSQL
+requires the partition key in every unique index, so each partition has
+its own. The (device, time) unique constraint moves to the parent.
+
+Other databases are left with one plain table. This migration can't be
+reversed."""
+from __future__ import unicode_literals
+
+from datetime import datetime
+
+from django.db import migrations, transaction
+from django.utils import timezone
+
+TABLE = 'tracker_device_datapoint'
+LEGACY = TABLE + '_legacy'
+DEFAULT = TABLE + '_default'
+UNIQUE = 'tracker_device_datapoint_device_id_time_uniq'
+FOREIGN_KEY = 'tracker_device_datapoint_device_id_fk'
+RANGE_CHECK = 'tracker_device_datapoint_legacy_range'
+MONTHS_AHEAD = 3
+
+
+def month(offset):
+    """The first instant of the month offset months from this one."""
+    now = timezone.now()
+    index = now.year * 12 + now.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def literal(value):
+    return "'{}'".format(value.isoformat())
+
+
+def partition_by_month(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    execute = schema_editor.execute
+    boundary = month(1)
+    execute(
+        'ALTER TABLE {} ADD CONSTRAINT {} CHECK (time < {}) '
+        'NOT VALID'.format(TABLE, RANGE_CHECK, literal(boundary)))
+    execute('ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(
+        TABLE, RANGE_CHECK))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cursor.fetchone()[0]
+    statements = [
+        'LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(TABLE),
+        'ALTER TABLE {} RENAME TO {}'.format(TABLE, LEGACY),
+        'ALTER TABLE {} RENAME CONSTRAINT {} TO {}'.format(
+            LEGACY, UNIQUE, LEGACY + '_device_id_time_uniq'),
+        'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) '
+        'PARTITION BY RANGE (time)'.format(TABLE, LEGACY),
+        'ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, TABLE),
+        'ALTER TABLE {} ADD CONSTRAINT {} UNIQUE (device_id, time)'.format(
+            TABLE, UNIQUE),
+        'ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY (device_id) '
+        'REFERENCES tracker_device_trackerdevice (id) '
+        'DEFERRABLE INITIALLY DEFERRED'.format(TABLE, FOREIGN_KEY),
+        'ALTER TABLE {} ATTACH PARTITION {} '
+        'FOR VALUES FROM (MINVALUE) TO ({})'.format(
+            TABLE, LEGACY, literal(boundary)),
+        'CREATE TABLE {} PARTITION OF {} (PRIMARY KEY (id)) '
+        'DEFAULT'.format(DEFAULT, TABLE),
+    ]
+    for offset in range(1, MONTHS_AHEAD + 1):
+        start, end = month(offset), month(offset + 1)
+        statements.append(
+            'CREATE TABLE {}_p{:04d}_{:02d} PARTITION OF {} '
+            '(PRIMARY KEY (id)) FOR VALUES FROM ({}) TO ({})'.format(
+                TABLE, start.year, start.month, TABLE,
+                literal(start), literal(end)))
+    with transaction.atomic(using=schema_editor.connection.alias):
+        for statement in statements:
+            execute(statement)
+    execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(LEGACY, RANGE_CHECK))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tracker_device', '0006_datapoint_drop_device_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_by_month),
+    ]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 20:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker_device', '0007_partition_datapoint_by_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('min_lat', models.FloatField()),
+                ('max_lat', models.FloatField()),
+                ('min_lng', models.FloatField()),
+                ('max_lng', models.FloatField()),
+                ('first_time', models.DateTimeField()),
+                ('first_lat', models.FloatField()),
+                ('first_lng', models.FloatField()),
+                ('last_time', models.DateTimeField()),
+                ('last_lat', models.FloatField()),
+                ('last_lng', models.FloatField()),
+                ('distance', models.FloatField(default=0)),
+                ('device', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='tracker_device.TrackerDevice')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('min_lat', models.FloatField()),
+                ('max_lat', models.FloatField()),
+                ('min_lng', models.FloatField()),
+                ('max_lng', models.FloatField()),
+                ('first_time', models.DateTimeField()),
+                ('first_lat', models.FloatField()),
+                ('first_lng', models.FloatField()),
+                ('last_time', models.DateTimeField()),
+                ('last_lat', models.FloatField()),
+                ('last_lng', models.FloatField()),
+                ('distance', models.FloatField(default=0)),
+                ('device', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='hourly_rollups', to='tracker_device.TrackerDevice')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlyrollup',
+            unique_together=set([('device', 'start')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyrollup',
+            unique_together=set([('device', 'start')]),
+        ),
+    ]
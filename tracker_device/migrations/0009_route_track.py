@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 20:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker_device', '0008_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='track',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='track_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
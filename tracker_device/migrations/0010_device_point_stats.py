@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 20:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker_device', '0009_route_track'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackerdevice',
+            name='last_lat',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackerdevice',
+            name='last_lng',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackerdevice',
+            name='last_received',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackerdevice',
+            name='last_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackerdevice',
+            name='point_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 20:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker_device', '0010_device_point_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateTimeField()),
+                ('path', models.CharField(max_length=200)),
+                ('point_count', models.PositiveIntegerField()),
+                ('first_time', models.DateTimeField()),
+                ('last_time', models.DateTimeField()),
+                ('device', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_months', to='tracker_device.TrackerDevice')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedmonth',
+            unique_together=set([('device', 'month')]),
+        ),
+    ]
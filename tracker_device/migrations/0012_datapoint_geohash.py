@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Add DataPoint.geohash and index it with device and time.
+
+The column starts empty; backfill_geohashes fills it in for existing
+points. It's added with a plain ALTER TABLE, which doesn't rewrite the
+table on PostgreSQL and, unlike AddField on SQLite, keeps the unique
+index 0005 named. On PostgreSQL the index is built without blocking
+ingest: concurrently on a plain table, or on a partitioned one, on the
+parent alone, then concurrently on each partition and attached."""
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+TABLE = 'tracker_device_datapoint'
+INDEX = 'tracker_device_datapoint_geohash_idx'
+COLUMNS = '(device_id, geohash, time)'
+
+
+def partitions(connection):
+    """Names of DataPoint's partitions, or None if it isn't partitioned."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT relkind FROM pg_class WHERE oid = %s::regclass', [TABLE])
+        if cursor.fetchone()[0] != 'p':
+            return None
+        cursor.execute(
+            'SELECT inhrelid::regclass::text FROM pg_inherits '
+            'WHERE inhparent = %s::regclass', [TABLE])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def add_geohash(apps, schema_editor):
+    execute = schema_editor.execute
+    execute('ALTER TABLE {} ADD COLUMN geohash bigint NULL'.format(TABLE))
+    if schema_editor.connection.vendor != 'postgresql':
+        execute('CREATE INDEX {} ON {} {}'.format(INDEX, TABLE, COLUMNS))
+        return
+    children = partitions(schema_editor.connection)
+    if children is None:
+        execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}'.format(
+            INDEX, TABLE, COLUMNS))
+        return
+    execute('CREATE INDEX IF NOT EXISTS {} ON ONLY {} {}'.format(
+        INDEX, TABLE, COLUMNS))
+    for child in children:
+        name = '{}_geohash_idx'.format(child)
+        execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}'.format(
+            name, child, COLUMNS))
+        execute('ALTER INDEX {} ATTACH PARTITION {}'.format(INDEX, name))
+
+
+def remove_geohash(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(INDEX))
+    schema_editor.execute(
+        'ALTER TABLE {} DROP COLUMN geohash'.format(TABLE))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tracker_device', '0011_archived_month'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_geohash, remove_geohash),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='datapoint',
+                    name='geohash',
+                    field=models.BigIntegerField(
+                        blank=True, editable=False, null=True),
+                ),
+                migrations.AlterIndexTogether(
+                    name='datapoint',
+                    index_together=set([('device', 'geohash', 'time')]),
+                ),
+            ],
+        ),
+    ]
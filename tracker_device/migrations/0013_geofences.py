@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 20:54
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tracker_device', '0012_datapoint_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Geofence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=50)),
+                ('vertices', models.TextField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('device', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='geofences', to='tracker_device.TrackerDevice')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geofences', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GeofenceEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('enter', 'enter'), ('exit', 'exit')], max_length=5)),
+                ('time', models.DateTimeField()),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('device', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='geofence_events', to='tracker_device.TrackerDevice')),
+                ('fence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='tracker_device.Geofence')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GeofencePresence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('device', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='geofence_presences', to='tracker_device.TrackerDevice')),
+                ('fence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presences', to='tracker_device.Geofence')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='geofencepresence',
+            unique_together=set([('device', 'fence')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='geofenceevent',
+            index_together=set([('device', 'time')]),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Index DataPoint by device, time received and id for the sync API.
+
+Built without blocking ingest on PostgreSQL, the same way as 0012."""
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+TABLE = 'tracker_device_datapoint'
+INDEX = 'tracker_device_datapoint_received_idx'
+COLUMNS = '(device_id, time_received, id)'
+
+
+def partitions(connection):
+    """Names of DataPoint's partitions, or None if it isn't partitioned."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT relkind FROM pg_class WHERE oid = %s::regclass', [TABLE])
+        if cursor.fetchone()[0] != 'p':
+            return None
+        cursor.execute(
+            'SELECT inhrelid::regclass::text FROM pg_inherits '
+            'WHERE inhparent = %s::regclass', [TABLE])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def add_received_index(apps, schema_editor):
+    execute = schema_editor.execute
+    if schema_editor.connection.vendor != 'postgresql':
+        execute('CREATE INDEX {} ON {} {}'.format(INDEX, TABLE, COLUMNS))
+        return
+    children = partitions(schema_editor.connection)
+    if children is None:
+        execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}'.format(
+            INDEX, TABLE, COLUMNS))
+        return
+    execute('CREATE INDEX IF NOT EXISTS {} ON ONLY {} {}'.format(
+        INDEX, TABLE, COLUMNS))
+    for child in children:
+        name = '{}_received_idx'.format(child)
+        execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}'.format(
+            name, child, COLUMNS))
+        execute('ALTER INDEX {} ATTACH PARTITION {}'.format(INDEX, name))
+
+
+def remove_received_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(INDEX))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tracker_device', '0013_geofences'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    add_received_index, remove_received_index),
+            ],
+            state_operations=[
+                migrations.AlterIndexTogether(
+                    name='datapoint',
+                    index_together=set([
+                        ('device', 'geohash', 'time'),
+                        ('device', 'time_received', 'id'),
+                    ]),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 21:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker_device', '0014_datapoint_received_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='trackerdevice',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
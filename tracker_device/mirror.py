@@ -0,0 +1,295 @@
+"""Optional memory mapped mirror of each device's data points.
+
+With DATA_POINT_MIRROR_DIR set, every point save_points inserts is also
+appended, once its transaction commits, to a file of fixed width
+records for its device::
+
+    time         microseconds since the epoch (int64)
+    lat, lng     degrees (float64)
+    elevation    meters (float64)
+
+Readers memory map the file and find a time range by binary search, so
+a route's points come back as a NumPy view of the file, with no copy and
+no Python object per point.
+
+Records are kept in time order by appending only points newer than the
+last record to ``<device>.pts``. Older points, such as a late upload,
+go to ``<device>.late``, which is usually empty; reads fold it in, and
+rebuilding a device merges it back. Writers take ``<device>.lock`` so
+appends from several processes don't interleave.
+
+The mirror isn't transactional. A crash between a commit and its append
+loses those points from the mirror, so run ``mirror_points --check``
+now and then, and ``mirror_points`` to rebuild devices that differ."""
+import bisect
+import fcntl
+import logging
+import os
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from tracker_device import archive
+from tracker_device.models import TrackerDevice
+from tracker_device.timeutil import from_micros, to_micros
+
+RECORD = np.dtype([
+    ('time', '<i8'),
+    ('lat', '<f8'),
+    ('lng', '<f8'),
+    ('elevation', '<f8'),
+])
+CHUNK_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    """Whether points are mirrored."""
+    return bool(settings.DATA_POINT_MIRROR_DIR)
+
+
+def window(device_id, start=None, end=None):
+    """A device's records from start to end inclusive, oldest first.
+
+    Without late points this is a read only view of the mapped file."""
+    records = _map(_path(device_id, 'pts'))
+    first = 0 if start is None else bisect.bisect_left(
+        _Times(records), to_micros(start))
+    last = len(records) if end is None else bisect.bisect_right(
+        _Times(records), to_micros(end))
+    records = records[first:last]
+    late = _late(device_id)
+    if len(late):
+        late = late[_within(late['time'], start, end)]
+    if not len(late):
+        return records
+    return _sorted(np.concatenate([late, records]))
+
+
+def append(device_id, points):
+    """Append (time, lat, lng, elevation) points to a device's files.
+
+    Called once the transaction inserting them commits, so a failure is
+    logged rather than raised to the request that already succeeded."""
+    try:
+        with _locked(device_id):
+            _append(device_id, points)
+    except OSError:
+        logger.exception('Could not mirror points of device %s', device_id)
+
+
+def _append(device_id, points):
+    """Append points, the caller holding the device's lock."""
+    records = _records(points)
+    records = records[np.argsort(records['time'], kind='mergesort')]
+    main = _path(device_id, 'pts')
+    newer = records['time'] > _last_time(main)
+    _write(main, records[newer])
+    _write(_path(device_id, 'late'), records[~newer])
+
+
+def rebuild(device_id, chunk_size=CHUNK_SIZE):
+    """Rewrite a device's files from its points, archived ones included.
+
+    Holds the device's lock throughout, so appends wait rather than go
+    to the file being replaced. Returns how many points were written."""
+    main = _path(device_id, 'pts')
+    os.makedirs(os.path.dirname(main), exist_ok=True)
+    written = 0
+    with _locked(device_id):
+        temporary = main + '.tmp'
+        with open(temporary, 'wb') as out:
+            for chunk in _chunks(archive.window(device_id), chunk_size):
+                out.write(_records(chunk).tobytes())
+                written += len(chunk)
+        os.replace(temporary, main)
+        _remove(_path(device_id, 'late'))
+    return written
+
+
+def verify(device_id, chunk_size=CHUNK_SIZE):
+    """Compare a device's mirror with its points, archived ones included.
+
+    Returns the time of the first point where they differ, or None if
+    they match."""
+    records = window(device_id)
+    offset = 0
+    for chunk in _chunks(archive.window(device_id), chunk_size):
+        expected = _records(chunk)
+        found = records[offset:offset + len(expected)]
+        if len(found) < len(expected) or not np.array_equal(
+                found, expected):
+            return _first_difference(expected, found)
+        offset += len(expected)
+    if offset < len(records):
+        return from_micros(records[offset]['time'])
+    return None
+
+
+def expire(device_id, cutoff):
+    """Drop a device's records from before cutoff."""
+    main = _path(device_id, 'pts')
+    if not os.path.exists(main):
+        return
+    with _locked(device_id):
+        for path in (main, _path(device_id, 'late')):
+            records = _map(path)
+            kept = records[records['time'] >= to_micros(cutoff)]
+            if len(kept) == len(records):
+                continue
+            temporary = path + '.tmp'
+            with open(temporary, 'wb') as out:
+                out.write(kept.tobytes())
+            os.replace(temporary, path)
+
+
+@receiver(post_delete, sender=TrackerDevice)
+def remove_files(sender, instance, **kwargs):
+    """Remove a deleted device's files once the deletion commits."""
+    if not enabled():
+        return
+    device_id = instance.pk
+
+    def remove():
+        with _locked(device_id):
+            for extension in ('pts', 'late'):
+                _remove(_path(device_id, extension))
+        _remove(_path(device_id, 'lock'))
+    transaction.on_commit(remove)
+
+
+class _Times(object):
+    """The time column of mapped records as a sequence for bisect, which
+    reads only the records it probes."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]['time']
+
+
+def _map(path):
+    """Memory map a file of records, read only.
+
+    A record still being appended by another process is left off."""
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        size = 0
+    count = size // RECORD.itemsize
+    if not count:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode='r', shape=(count,))
+
+
+def _late(device_id):
+    """A device's late records, in the order they arrived."""
+    return _map(_path(device_id, 'late'))
+
+
+def _within(times, start, end):
+    """Mask of times from start to end inclusive."""
+    mask = np.ones(len(times), dtype=bool)
+    if start is not None:
+        mask &= times >= to_micros(start)
+    if end is not None:
+        mask &= times <= to_micros(end)
+    return mask
+
+
+def _sorted(records):
+    """Records in time order, keeping the first of any repeated time."""
+    records = records[np.argsort(records['time'], kind='mergesort')]
+    keep = np.ones(len(records), dtype=bool)
+    keep[1:] = records['time'][1:] != records['time'][:-1]
+    return records[keep]
+
+
+def _records(points):
+    """Records from (time, lat, lng, elevation) points."""
+    records = np.zeros(len(points), dtype=RECORD)
+    if len(points):
+        records['time'] = [to_micros(point[0]) for point in points]
+        values = np.array([point[1:4] for point in points], dtype='<f8')
+        records['lat'] = values[:, 0]
+        records['lng'] = values[:, 1]
+        records['elevation'] = values[:, 2]
+    return records
+
+
+def _last_time(path):
+    """Time of the last record in a file, or the smallest int64."""
+    records = _map(path)
+    if not len(records):
+        return np.iinfo(np.int64).min
+    return records[-1]['time']
+
+
+def _write(path, records):
+    """Append records to a file with a single write."""
+    if not len(records):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, records.tobytes())
+    finally:
+        os.close(descriptor)
+
+
+@contextmanager
+def _locked(device_id):
+    """Hold the device's lock file exclusively."""
+    path = _path(device_id, 'lock')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _chunks(points, size):
+    """Lists of up to size items from an iterator."""
+    chunk = []
+    for point in points:
+        chunk.append(point)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _first_difference(expected, found):
+    """Time of the first of the expected records found doesn't match."""
+    for index in range(len(expected)):
+        if index >= len(found) or found[index] != expected[index]:
+            if index < len(found):
+                return from_micros(min(
+                    expected[index]['time'], found[index]['time']))
+            return from_micros(expected[index]['time'])
+
+
+def _remove(path):
+    """Remove a file if it exists."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _path(device_id, extension):
+    """Path of one of a device's files."""
+    return os.path.join(
+        settings.DATA_POINT_MIRROR_DIR, '{}.{}'.format(device_id, extension))
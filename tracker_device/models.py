@@ -1,7 +1,11 @@
 from __future__ import unicode_literals
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
+from tracker_device import geohash
+import json
 import uuid
 
 
@@ -27,23 +31,94 @@ class TrackerDevice(models.Model):
         )
     id_uuid = models.UUIDField(default=uuid.uuid4, editable=False)
     date_created = models.DateField(auto_now_add=True)
+    # Kept up to date by save_points; reconcile_devices repairs drift.
+    point_count = models.PositiveIntegerField(default=0, editable=False)
+    last_time = models.DateTimeField(blank=True, null=True, editable=False)
+    last_lat = models.FloatField(blank=True, null=True, editable=False)
+    last_lng = models.FloatField(blank=True, null=True, editable=False)
+    last_received = models.DateTimeField(
+        blank=True, null=True, editable=False)
+    # When the device, its point statistics or its routes last changed,
+    # for conditional requests; see tracker_device.conditional.
+    updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        """Save a device, leaving its point statistics alone."""
+        _skip_fields(self, kwargs, (
+            'point_count', 'last_time', 'last_lat', 'last_lng',
+            'last_received',
+        ))
+        super(TrackerDevice, self).save(*args, **kwargs)
+
+
+def _skip_fields(instance, kwargs, skipped):
+    """Have saving an existing instance leave skipped fields alone.
+
+    They are kept by single column UPDATEs, which a save of the values
+    the instance was loaded with would undo."""
+    if instance._state.adding or kwargs.get('force_insert'):
+        return
+    kwargs.setdefault('update_fields', [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in skipped
+    ])
+
+
+class DataPointQuerySet(models.QuerySet):
+    """Queries that stay on the (device, time) index.
+
+    Use them on one device's points, e.g. ``device.data.window(...)``, so
+    the device and time conditions are both answered from the index."""
+
+    def window(self, start, end=None):
+        """Points from start to end inclusive, oldest first.
+
+        A missing end means up to now, as for a route still in
+        progress."""
+        points = self.filter(time__gte=start)
+        if end is not None:
+            points = points.filter(time__lte=end)
+        return points.order_by('time')
+
+    def most_recent(self, count):
+        """The newest count points, newest first."""
+        return self.order_by('-time')[:count]
+
 
 class DataPoint(models.Model):
     """Model for data points."""
     device = models.ForeignKey(
         TrackerDevice,
         related_name='data',
-        on_delete=models.deletion.CASCADE
+        on_delete=models.deletion.CASCADE,
+        # The (device, time) unique index covers lookups by device.
+        db_index=False,
     )
     time = models.DateTimeField()
     lat = models.FloatField()
     lng = models.FloatField()
     elevation = models.FloatField()
     time_received = models.DateTimeField(auto_now_add=True)
+    # Integer geohash of lat and lng; see tracker_device.geohash.
+    geohash = models.BigIntegerField(blank=True, null=True, editable=False)
+
+    objects = DataPointQuerySet.as_manager()
+
+    class Meta(object):
+        unique_together = ('device', 'time')
+        index_together = (
+            ('device', 'geohash', 'time'),
+            # Keyset paging by time received; see tracker_device.sync.
+            ('device', 'time_received', 'id'),
+        )
+
+    def save(self, *args, **kwargs):
+        """Save a data point along with its geohash."""
+        self.geohash = geohash.encode(self.lat, self.lng)
+        super(DataPoint, self).save(*args, **kwargs)
 
 
 class Route(models.Model):
@@ -57,3 +132,182 @@ class Route(models.Model):
         related_name='routes',
         on_delete=models.deletion.CASCADE
     )
+    # Kept by tracker_device.tracks; see there.
+    track = models.BinaryField(null=True, editable=False)
+    track_version = models.PositiveIntegerField(default=0, editable=False)
+    # When the route or its track last changed.
+    updated = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        """Save a route, leaving its track alone."""
+        _skip_fields(self, kwargs, ('track', 'track_version'))
+        self._touch_devices()
+        super(Route, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Delete a route, changing its device's page."""
+        self._touch_devices()
+        return super(Route, self).delete(*args, **kwargs)
+
+    def _touch_devices(self):
+        """Mark the devices the route belongs and belonged to changed, as
+        their pages list it."""
+        devices = models.Q(pk=self.device_id)
+        if self.pk is not None:
+            devices |= models.Q(routes__pk=self.pk)
+        TrackerDevice.objects.filter(devices).update(updated=timezone.now())
+
+
+class Rollup(models.Model):
+    """Summary of a device's data points over one period.
+
+    distance, in meters, covers every leg ending in the period, including
+    the one from the device's previous fix, so the distances of
+    consecutive periods add up."""
+    start = models.DateTimeField()
+    point_count = models.PositiveIntegerField(default=0)
+    min_lat = models.FloatField()
+    max_lat = models.FloatField()
+    min_lng = models.FloatField()
+    max_lng = models.FloatField()
+    first_time = models.DateTimeField()
+    first_lat = models.FloatField()
+    first_lng = models.FloatField()
+    last_time = models.DateTimeField()
+    last_lat = models.FloatField()
+    last_lng = models.FloatField()
+    distance = models.FloatField(default=0)
+
+    class Meta(object):
+        abstract = True
+        unique_together = ('device', 'start')
+
+
+class HourlyRollup(Rollup):
+    """Summary of a device's data points for one hour."""
+    device = models.ForeignKey(
+        TrackerDevice,
+        related_name='hourly_rollups',
+        on_delete=models.deletion.CASCADE,
+        db_index=False,
+    )
+
+
+class DailyRollup(Rollup):
+    """Summary of a device's data points for one UTC day."""
+    device = models.ForeignKey(
+        TrackerDevice,
+        related_name='daily_rollups',
+        on_delete=models.deletion.CASCADE,
+        db_index=False,
+    )
+
+
+class ArchivedMonth(models.Model):
+    """A month of one device's data points moved out of the database.
+
+    path is the archive file, relative to DATA_POINT_ARCHIVE_DIR; see
+    tracker_device.archive."""
+    device = models.ForeignKey(
+        TrackerDevice,
+        related_name='archived_months',
+        on_delete=models.deletion.CASCADE,
+        db_index=False,
+    )
+    month = models.DateTimeField()
+    path = models.CharField(max_length=200)
+    point_count = models.PositiveIntegerField()
+    first_time = models.DateTimeField()
+    last_time = models.DateTimeField()
+
+    class Meta(object):
+        unique_together = ('device', 'month')
+
+
+@python_2_unicode_compatible
+class Geofence(models.Model):
+    """A polygon whose crossings by devices are recorded as events.
+
+    A fence with a device applies to that device only, otherwise to all
+    of its user's devices. vertices is a JSON list of [lat, lng] pairs,
+    the last joined back to the first; see tracker_device.geofences."""
+    user = models.ForeignKey(
+        User,
+        related_name='geofences',
+        on_delete=models.deletion.CASCADE
+    )
+    device = models.ForeignKey(
+        TrackerDevice,
+        related_name='geofences',
+        on_delete=models.deletion.CASCADE,
+        blank=True,
+        null=True,
+    )
+    name = models.CharField(max_length=50, blank=True)
+    vertices = models.TextField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        """Check the vertices make a polygon and the device is the user's."""
+        try:
+            vertices = json.loads(self.vertices)
+            valid = len(vertices) >= 3 and all(
+                -90 <= lat <= 90 and -180 <= lng <= 180
+                for lat, lng in vertices)
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise ValidationError({'vertices': (
+                'Expected a list of at least three [lat, lng] pairs.')})
+        if self.device_id and self.device.user_id != self.user_id:
+            raise ValidationError({'device': 'Not one of your devices.'})
+
+
+class GeofenceEvent(models.Model):
+    """A device entering or leaving a geofence, at the fix that did."""
+    fence = models.ForeignKey(
+        Geofence,
+        related_name='events',
+        on_delete=models.deletion.CASCADE
+    )
+    device = models.ForeignKey(
+        TrackerDevice,
+        related_name='geofence_events',
+        on_delete=models.deletion.CASCADE,
+        db_index=False,
+    )
+    kind = models.CharField(
+        max_length=5,
+        choices=(
+            ('enter', 'enter'),
+            ('exit', 'exit'),
+        ),
+    )
+    time = models.DateTimeField()
+    lat = models.FloatField()
+    lng = models.FloatField()
+
+    class Meta(object):
+        index_together = ('device', 'time')
+
+
+class GeofencePresence(models.Model):
+    """A device inside a geofence, since the fix at time."""
+    fence = models.ForeignKey(
+        Geofence,
+        related_name='presences',
+        on_delete=models.deletion.CASCADE
+    )
+    device = models.ForeignKey(
+        TrackerDevice,
+        related_name='geofence_presences',
+        on_delete=models.deletion.CASCADE,
+        db_index=False,
+    )
+    time = models.DateTimeField()
+
+    class Meta(object):
+        unique_together = ('device', 'fence')
@@ -0,0 +1,162 @@
+"""Compact binary ingest format for trackers on metered GSM links.
+
+A payload is a 20 byte header followed by fixed width little-endian
+records::
+
+    header    magic b'TP', version (uint8), flags (uint8), device UUID
+              (16 bytes)
+    absolute  epoch seconds (uint32), lat and lng in millionths of a
+              degree (int32), elevation in centimeters (int32)
+    delta     seconds since the previous record (uint16), change in lat,
+              lng (millionths of a degree) and elevation (centimeters),
+              all int16
+
+Without FLAG_DELTA every record is absolute. With it the first record is
+absolute and every following record is a delta against the one before,
+halving the size of a fix again. A form encoded fix is around 150 bytes,
+an absolute record is 16 and a delta record 8."""
+import struct
+import uuid
+from datetime import datetime
+
+import numpy as np
+from django.utils import timezone
+
+from tracker_device.timeutil import EPOCH
+
+MAGIC = b'TP'
+VERSION = 1
+FLAG_DELTA = 1
+HEADER = struct.Struct('<2sBB16s')
+ABSOLUTE = np.dtype([
+    ('time', '<u4'),
+    ('lat', '<i4'),
+    ('lng', '<i4'),
+    ('elevation', '<i4'),
+])
+DELTA = np.dtype([
+    ('time', '<u2'),
+    ('lat', '<i2'),
+    ('lng', '<i2'),
+    ('elevation', '<i2'),
+])
+DEGREE_SCALE = 10 ** 6
+ELEVATION_SCALE = 100
+
+
+class PackedError(ValueError):
+    """Raised when a payload isn't a valid packed upload."""
+
+
+def decode(body):
+    """Decode a payload into a UUID and arrays of times and coordinates.
+
+    Times are integer epoch seconds, lat, lng and elevation are floats in
+    degrees and meters."""
+    if len(body) < HEADER.size:
+        raise PackedError('Payload is shorter than its header.')
+    magic, version, flags, device = HEADER.unpack_from(body)
+    if magic != MAGIC or version != VERSION:
+        raise PackedError('Not a version {} packed payload.'.format(VERSION))
+    records = memoryview(body)[HEADER.size:]
+    if flags & FLAG_DELTA and len(records):
+        columns = _decode_delta(records)
+    else:
+        columns = _decode_absolute(records)
+    time, lat, lng, elevation = columns
+    return (
+        uuid.UUID(bytes=bytes(device)),
+        time,
+        lat / DEGREE_SCALE,
+        lng / DEGREE_SCALE,
+        elevation / ELEVATION_SCALE,
+    )
+
+
+def _decode_absolute(records):
+    """Return int64 columns of a run of absolute records."""
+    if len(records) % ABSOLUTE.itemsize:
+        raise PackedError('Payload ends partway through a record.')
+    rows = np.frombuffer(records, dtype=ABSOLUTE)
+    return [rows[name].astype(np.int64) for name in ABSOLUTE.names]
+
+
+def _decode_delta(records):
+    """Return int64 columns of an absolute record followed by deltas."""
+    if len(records) < ABSOLUTE.itemsize:
+        raise PackedError('Payload ends partway through a record.')
+    if (len(records) - ABSOLUTE.itemsize) % DELTA.itemsize:
+        raise PackedError('Payload ends partway through a record.')
+    first = np.frombuffer(records[:ABSOLUTE.itemsize], dtype=ABSOLUTE)
+    deltas = np.frombuffer(records[ABSOLUTE.itemsize:], dtype=DELTA)
+    columns = []
+    for name in ABSOLUTE.names:
+        column = np.empty(len(deltas) + 1, dtype=np.int64)
+        column[0] = first[name][0]
+        column[1:] = deltas[name]
+        columns.append(np.cumsum(column))
+    return columns
+
+
+def encode(device, points, delta=True):
+    """Encode (time, lat, lng, elevation) tuples for a device UUID.
+
+    Times may be aware datetimes or epoch seconds. Delta encoding is
+    skipped when a step between records doesn't fit in a delta record."""
+    times = np.array([
+        (point[0] - EPOCH).total_seconds()
+        if isinstance(point[0], datetime) else point[0]
+        for point in points
+    ], dtype=np.int64)
+    coordinates = np.array([point[1:] for point in points], dtype=float)
+    coordinates = coordinates.reshape(-1, 3)
+    columns = [
+        times,
+        np.round(coordinates[:, 0] * DEGREE_SCALE).astype(np.int64),
+        np.round(coordinates[:, 1] * DEGREE_SCALE).astype(np.int64),
+        np.round(coordinates[:, 2] * ELEVATION_SCALE).astype(np.int64),
+    ]
+    flags = 0
+    if delta and len(times) > 1 and _fits_delta(columns):
+        flags = FLAG_DELTA
+    header = HEADER.pack(MAGIC, VERSION, flags, _as_uuid(device).bytes)
+    if flags & FLAG_DELTA:
+        first = _pack(ABSOLUTE, [column[:1] for column in columns])
+        rest = _pack(DELTA, [np.diff(column) for column in columns])
+        return header + first + rest
+    return header + _pack(ABSOLUTE, columns)
+
+
+def _fits_delta(columns):
+    """Check every step between records fits the delta record types."""
+    for name, column in zip(DELTA.names, columns):
+        info = np.iinfo(DELTA[name])
+        steps = np.diff(column)
+        if steps.min() < info.min or steps.max() > info.max:
+            return False
+    return True
+
+
+def _pack(dtype, columns):
+    """Pack columns into bytes of records of the given dtype."""
+    rows = np.empty(len(columns[0]), dtype=dtype)
+    for name, column in zip(dtype.names, columns):
+        rows[name] = column
+    return rows.tobytes()
+
+
+def _as_uuid(value):
+    """Accept a UUID or its string form."""
+    if isinstance(value, uuid.UUID):
+        return value
+    return uuid.UUID(str(value))
+
+
+def to_points(time, lat, lng, elevation):
+    """Turn decoded columns into (time, lat, lng, elevation) tuples."""
+    times = [
+        datetime.fromtimestamp(seconds, timezone.utc)
+        for seconds in time.tolist()
+    ]
+    return list(zip(
+        times, lat.tolist(), lng.tolist(), elevation.tolist()))
@@ -0,0 +1,73 @@
+"""Cached query results for the device and route pages.
+
+Everyone watching a device asks for the same routes, latest points and
+activity, so they are kept in the PAGE_CACHE cache under a key holding
+the device's or route's `updated` time, which ingest, retention and edits
+move; a change makes the next request miss rather than expiring entries.
+
+When a key misses, one worker rebuilds it: `get_or_build` takes a lock
+with `cache.add`, which only one caller can win, and the others wait for
+the winner's value instead of running the same queries. A worker that
+dies holding the lock holds up the others for at most LOCK_TIMEOUT
+seconds, after which they build the value themselves."""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+TIMEOUT = 24 * 60 * 60
+LOCK_TIMEOUT = 10
+POLL_INTERVAL = 0.05
+
+
+def page_cache():
+    """The cache PAGE_CACHE names."""
+    return caches[settings.PAGE_CACHE]
+
+
+def get_or_build(key, build, timeout=TIMEOUT, clock=time.time,
+                 sleep=time.sleep):
+    """The cached value of key, calling build to make it if it's missing
+    and no other worker is already making it."""
+    cache = page_cache()
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock = key + ':lock'
+    deadline = clock() + LOCK_TIMEOUT
+    locked = cache.add(lock, True, LOCK_TIMEOUT)
+    while not locked:
+        sleep(POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if clock() >= deadline:
+            break
+        locked = cache.add(lock, True, LOCK_TIMEOUT)
+    try:
+        # The previous holder may have finished between get and add.
+        value = cache.get(key) if locked else None
+        if value is None:
+            value = build()
+            cache.set(key, value, timeout)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock)
+
+
+def device_page(device, build):
+    """The device page's cached data, rebuilt when the device changes.
+
+    The day is part of the key as the page summarizes the last days'
+    activity."""
+    return get_or_build('device-page:{}:{}:{}'.format(
+        device.pk, device.updated.isoformat(), timezone.now().date()),
+        build)
+
+
+def route_page(route, build):
+    """The route page's cached data, rebuilt when the route changes."""
+    return get_or_build('route-page:{}:{}:{}'.format(
+        route.pk, route.updated.isoformat(), route.track_version), build)
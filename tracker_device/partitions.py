@@ -0,0 +1,153 @@
+"""Monthly range partitions of DataPoint on PostgreSQL.
+
+Migration 0007 turns tracker_device_datapoint into a table partitioned
+by month on time. The rows it held before stay in one legacy partition
+ending at the first partition boundary, and a default partition catches
+fixes with times outside every partition, such as from a device whose
+clock is years off. The manage_partitions command keeps partitions
+created ahead of time and removes whole months once every user's
+retention has passed them.
+
+Partition pruning needs a condition on time, which DataPointQuerySet's
+window gives; most_recent is answered by scanning the partitions newest
+first and stopping after a few rows.
+
+Other databases keep one plain table and only get per user retention."""
+import re
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+TABLE = 'tracker_device_datapoint'
+DEFAULT = TABLE + '_default'
+LEGACY = TABLE + '_legacy'
+BOUND = re.compile(r"'([^']*)'")
+COUNT_SQL = 'SELECT device_id, count(*) FROM {partition} GROUP BY device_id'
+DISCOUNT_SQL = (
+    'UPDATE tracker_device_trackerdevice '
+    'SET point_count = GREATEST(point_count - removed.count, 0), '
+    'updated = now() '
+    'FROM (VALUES {values}) AS removed (device_id, count) '
+    'WHERE tracker_device_trackerdevice.id = removed.device_id'
+)
+
+
+def supported():
+    """Whether the database can partition DataPoint."""
+    return connection.vendor == 'postgresql'
+
+
+def month_start(value):
+    """The first instant of value's month, in UTC."""
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    """The first instant of the month count months after month."""
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    """Name of the partition holding month."""
+    return '{}_p{:04d}_{:02d}'.format(TABLE, month.year, month.month)
+
+
+def partitions():
+    """Return (name, start, end) for each partition, oldest first.
+
+    start is None for the legacy partition and both are None for the
+    default partition."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname, '
+            'pg_get_expr(child.relpartbound, child.oid) '
+            'FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass',
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+    found = []
+    for name, bound in rows:
+        values = [parse_datetime(value) for value in BOUND.findall(bound)]
+        if not values:
+            found.append((name, None, None))
+        elif len(values) == 1:
+            found.append((name, None, values[0]))
+        else:
+            found.append((name, values[0], values[1]))
+    return sorted(found, key=_age)
+
+
+def _age(partition):
+    """Sort key putting the default partition last."""
+    name, start, end = partition
+    if end is None:
+        return (2, 0)
+    if start is None:
+        return (0, 0)
+    return (1, start.timestamp())
+
+
+def create_partition(month):
+    """Create and attach the partition for month.
+
+    The table is built empty and then attached, which only takes a brief
+    lock on the parent. Rows the default partition caught for that month
+    are moved in first."""
+    name = partition_name(month)
+    end = add_months(month, 1)
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE'.format(quote(DEFAULT)))
+        cursor.execute(
+            'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS, '
+            'PRIMARY KEY (id))'.format(quote(name), quote(TABLE)))
+        cursor.execute(
+            'WITH moved AS (DELETE FROM {} WHERE time >= %s AND time < %s '
+            'RETURNING *) INSERT INTO {} SELECT * FROM moved'.format(
+                quote(DEFAULT), quote(name)),
+            [month, end])
+        cursor.execute(
+            'ALTER TABLE {} ATTACH PARTITION {} '
+            'FOR VALUES FROM ({}) TO ({})'.format(
+                quote(TABLE), quote(name), literal(month), literal(end)))
+    return name
+
+
+def literal(value):
+    """A timestamp as a SQL literal, for partition bounds, which can't be
+    query parameters."""
+    return "'{}'".format(value.isoformat())
+
+
+def remove_partition(name, detach=False):
+    """Detach a partition, and drop it unless detach is set.
+
+    Its points are taken off their devices' point counts. They are
+    counted while the partition is still attached, under a lock on the
+    partition alone that keeps late fixes out of it; only the DETACH
+    itself locks the parent table, and the transaction ends with it so
+    ingest and page reads wait only that long. The counts are applied
+    and the table dropped afterwards."""
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'LOCK TABLE {} IN SHARE MODE'.format(quote(name)))
+        cursor.execute(COUNT_SQL.format(partition=quote(name)))
+        removed = cursor.fetchall()
+        cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(
+            quote(TABLE), quote(name)))
+    with transaction.atomic(), connection.cursor() as cursor:
+        if removed:
+            cursor.execute(
+                DISCOUNT_SQL.format(
+                    values=', '.join(['(%s, %s)'] * len(removed))),
+                [value for row in removed for value in row])
+        if not detach:
+            cursor.execute('DROP TABLE {}'.format(quote(name)))
@@ -0,0 +1,118 @@
+"""Per-device rate limits for the ingest endpoints.
+
+Each device gets a token bucket keyed by its UUID, refilled at the rate
+DATA_POINT_RATE_LIMITS gives for its mode, so one device stuck in debug
+mode can't crowd out the rest. Limits are only checked for devices
+already in the device cache, so deciding never queries the database; a
+device's first request goes through and caches it.
+
+Buckets live in each process unless DATA_POINT_RATE_LIMIT_CACHE names a
+Django cache, in which case workers share one budget per device. Django
+caches have no compare-and-swap, so the shared limiter counts requests in
+fixed windows of burst / rate seconds using the atomic add and incr."""
+import threading
+import time
+import uuid as uuid_module
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from tracker import metrics
+from tracker_device.device_cache import device_cache, UNKNOWN
+
+
+class RateLimiter(object):
+    """Token buckets held in this process, least recently used dropped
+    past `size`."""
+
+    def __init__(self, size=10000, clock=time.monotonic):
+        self.size = size
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Take `cost` tokens from a bucket.
+
+        Returns 0 if there were enough, otherwise how many seconds until
+        there will be."""
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        """Forget every bucket."""
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedRateLimiter(object):
+    """Request counts per fixed window, kept in a Django cache."""
+
+    def __init__(self, cache, clock=time.time):
+        self.cache = cache
+        self.clock = clock
+
+    def take(self, key, rate, burst, cost=1):
+        """Count a request against the current window.
+
+        Returns 0 if the window has room, otherwise how many seconds
+        until the next window starts."""
+        length = burst / rate
+        now = self.clock()
+        window = int(now // length)
+        cache_key = 'ratelimit:{}:{}'.format(key, window)
+        timeout = int(length) + 1
+        self.cache.add(cache_key, 0, timeout)
+        try:
+            count = self.cache.incr(cache_key, cost)
+        except ValueError:
+            # Expired or evicted between the add and the incr.
+            self.cache.add(cache_key, cost, timeout)
+            count = cost
+        if count <= burst:
+            return 0
+        return (window + 1) * length - now
+
+
+memory_limiter = RateLimiter()
+
+
+def get_limiter():
+    """Return the limiter DATA_POINT_RATE_LIMIT_CACHE asks for."""
+    alias = settings.DATA_POINT_RATE_LIMIT_CACHE
+    if alias:
+        return SharedRateLimiter(caches[alias])
+    return memory_limiter
+
+
+def retry_after(uuid, cost=1):
+    """Return how many seconds a device must wait before sending again.
+
+    Returns 0 if it may send now, including for UUIDs the device cache
+    doesn't know yet or knows to be bad, which the caller resolves and
+    rejects as usual."""
+    device = device_cache.peek(uuid)
+    if device is UNKNOWN or device is None:
+        return 0
+    limit = settings.DATA_POINT_RATE_LIMITS.get(device.mode)
+    if limit is None:
+        return 0
+    rate, burst = limit
+    key = uuid_module.UUID(str(uuid)).hex
+    wait = get_limiter().take(key, rate, burst, cost)
+    if wait:
+        metrics.ingest_rejected.inc('rate_limited')
+    return wait
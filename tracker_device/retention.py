@@ -0,0 +1,98 @@
+"""Per user retention of data points.
+
+Each user keeps the current month of points and the
+`data_retention_months` before it, or DATA_POINT_RETENTION_MONTHS if
+they haven't chosen. Whole monthly partitions are dropped once every
+user's retention has passed them; points of users keeping less than
+that are deleted a chunk at a time."""
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from tracker_device.models import (
+    DataPoint,
+    TrackerDevice,
+    HourlyRollup,
+    DailyRollup,
+)
+from tracker_device import archive, mirror, tracks
+from tracker_device.partitions import add_months, month_start
+from tracker_profile.models import TrackerProfile
+
+DELETE_SQL = (
+    'DELETE FROM {table} WHERE time < %s AND id IN ('
+    ' SELECT id FROM {table}'
+    ' WHERE device_id = %s AND time < %s LIMIT %s)'
+)
+
+
+def user_cutoffs(now):
+    """Map each user's id to the oldest time they keep, None for all."""
+    default = settings.DATA_POINT_RETENTION_MONTHS
+    this_month = month_start(now)
+    cutoffs = {}
+    profiles = TrackerProfile.objects.values_list(
+        'user_id', 'data_retention_months')
+    for user_id, months in profiles:
+        if months is None:
+            months = default
+        if months is None:
+            cutoffs[user_id] = None
+        else:
+            cutoffs[user_id] = add_months(this_month, -months)
+    return cutoffs
+
+
+def horizon(cutoffs):
+    """The time before which no user keeps anything, None if someone
+    keeps everything."""
+    if not cutoffs or None in cutoffs.values():
+        return None
+    return min(cutoffs.values())
+
+
+def expire_points(user_id, cutoff, chunk_size=10000, pause=0):
+    """Delete a user's points, archived ones included, and rollups from
+    before cutoff, stored points a chunk per transaction. Deleted points
+    come off the device's point count and the tracks of routes that had
+    them are marked out of date. Returns how many points were deleted."""
+    sql = DELETE_SQL.format(
+        table=connection.ops.quote_name(DataPoint._meta.db_table))
+    deleted = 0
+    devices = TrackerDevice.objects.filter(
+        user_id=user_id).values_list('id', flat=True)
+    for device_id in devices:
+        for model in (HourlyRollup, DailyRollup):
+            model.objects.filter(
+                device_id=device_id, start__lt=cutoff).delete()
+        with transaction.atomic():
+            count = archive.expire(device_id, cutoff)
+            if count:
+                _discount(device_id, cutoff, count)
+        deleted += count
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [cutoff, device_id, cutoff, chunk_size])
+                count = cursor.rowcount
+                if count:
+                    _discount(device_id, cutoff, count)
+            deleted += count
+            if count < chunk_size:
+                break
+            if pause:
+                time.sleep(pause)
+        if mirror.enabled():
+            mirror.expire(device_id, cutoff)
+    return deleted
+
+
+def _discount(device_id, cutoff, count):
+    """Take deleted points off a device and its routes' tracks."""
+    tracks.invalidate(device_id, None, cutoff)
+    TrackerDevice.objects.filter(pk=device_id).update(
+        point_count=Greatest(F('point_count') - count, 0),
+        updated=timezone.now())
@@ -0,0 +1,199 @@
+"""Hourly and daily rollups of each device's data points.
+
+save_points calls `update` with the points it inserted, in the same
+transaction. Devices almost always send fixes in order, and then the
+newest rollup is extended or a new one started without reading any data
+points. A point older than the device's newest fix is late: the hours it
+lands in are rebuilt from their data points, along with the next hour
+after each, whose first leg may now start from the late point, and the
+days are rebuilt from their hours.
+
+`rebuild_device` recomputes everything for a device; the
+backfill_rollups command runs it over existing history."""
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from tracker_device import archive, geo
+from tracker_device.models import DailyRollup, HourlyRollup, TrackerDevice
+
+REBUILD_CHUNK_SIZE = 10000
+
+
+def hour_start(time):
+    """The start of the UTC hour holding time."""
+    return time.astimezone(timezone.utc).replace(
+        minute=0, second=0, microsecond=0)
+
+
+def day_start(time):
+    """The start of the UTC day holding time."""
+    return time.astimezone(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+
+def update(device_id, points):
+    """Fold newly inserted (time, lat, lng, elevation) points into the
+    device's rollups."""
+    points = sorted(point[:3] for point in points)
+    if not points:
+        return
+    # Concurrent batches for the device wait here, so the second sees the
+    # rollups the first added rather than starting the same hour again.
+    _lock_device(device_id)
+    latest = HourlyRollup.objects.filter(
+        device_id=device_id).order_by('-start').first()
+    if latest is None or points[0][0] > latest.last_time:
+        append(HourlyRollup, hour_start, device_id, points, latest)
+        latest_day = DailyRollup.objects.filter(
+            device_id=device_id).order_by('-start').first()
+        append(DailyRollup, day_start, device_id, points, latest_day)
+        return
+    hours = set(hour_start(point[0]) for point in points)
+    for hour in list(hours):
+        following = HourlyRollup.objects.filter(
+            device_id=device_id, start__gt=hour).order_by('start').first()
+        if following is not None:
+            hours.add(following.start)
+    for hour in sorted(hours):
+        rebuild_hour(device_id, hour)
+    for day in sorted(set(day_start(hour) for hour in hours)):
+        rebuild_day(device_id, day)
+
+
+def append(model, floor, device_id, points, latest):
+    """Add points newer than every fix in latest to the rollups."""
+    previous = None
+    if latest is not None:
+        previous = (latest.last_lat, latest.last_lng)
+    for start, period in _group(
+            points, lambda point: floor(point[0])).items():
+        if latest is not None and latest.start == start:
+            rollup = latest
+        else:
+            rollup = model(device_id=device_id, start=start)
+        extend(rollup, period, previous)
+        rollup.save()
+        previous = (rollup.last_lat, rollup.last_lng)
+
+
+def extend(rollup, points, previous):
+    """Add time ordered (time, lat, lng) points to a rollup.
+
+    previous is the (lat, lng) of the fix before them, if there was
+    one."""
+    for time, lat, lng in points:
+        if not rollup.point_count:
+            rollup.first_time = time
+            rollup.first_lat, rollup.first_lng = lat, lng
+            rollup.min_lat = rollup.max_lat = lat
+            rollup.min_lng = rollup.max_lng = lng
+        else:
+            rollup.min_lat = min(rollup.min_lat, lat)
+            rollup.max_lat = max(rollup.max_lat, lat)
+            rollup.min_lng = min(rollup.min_lng, lng)
+            rollup.max_lng = max(rollup.max_lng, lng)
+        if previous is not None:
+            rollup.distance += geo.distance(
+                previous[0], previous[1], lat, lng)
+        rollup.last_time = time
+        rollup.last_lat, rollup.last_lng = lat, lng
+        rollup.point_count += 1
+        previous = (lat, lng)
+
+
+def rebuild_hour(device_id, start):
+    """Recompute one hour from its data points."""
+    end = start + timedelta(hours=1)
+    points = [
+        point[:3] for point in archive.window(device_id, start, end)
+        if point[0] < end
+    ]
+    HourlyRollup.objects.filter(device_id=device_id, start=start).delete()
+    if not points:
+        return
+    previous = archive.last_before(device_id, start)
+    if previous is not None:
+        previous = previous[1:3]
+    rollup = HourlyRollup(device_id=device_id, start=start)
+    extend(rollup, points, previous)
+    rollup.save()
+
+
+def rebuild_day(device_id, start):
+    """Recompute one day from its hours."""
+    hours = list(HourlyRollup.objects.filter(
+        device_id=device_id,
+        start__gte=start,
+        start__lt=start + timedelta(days=1),
+    ).order_by('start'))
+    DailyRollup.objects.filter(device_id=device_id, start=start).delete()
+    if hours:
+        combine(DailyRollup(device_id=device_id, start=start), hours).save()
+
+
+def combine(rollup, parts):
+    """Fill rollup from consecutive rollups covering its period."""
+    rollup.point_count = sum(part.point_count for part in parts)
+    rollup.distance = sum(part.distance for part in parts)
+    rollup.min_lat = min(part.min_lat for part in parts)
+    rollup.max_lat = max(part.max_lat for part in parts)
+    rollup.min_lng = min(part.min_lng for part in parts)
+    rollup.max_lng = max(part.max_lng for part in parts)
+    first, last = parts[0], parts[-1]
+    rollup.first_time = first.first_time
+    rollup.first_lat, rollup.first_lng = first.first_lat, first.first_lng
+    rollup.last_time = last.last_time
+    rollup.last_lat, rollup.last_lng = last.last_lat, last.last_lng
+    return rollup
+
+
+def rebuild_device(device_id, chunk_size=REBUILD_CHUNK_SIZE):
+    """Recompute every rollup for a device from its data points.
+
+    Streams the points in time order, archived ones included, reading
+    stored points a chunk at a time, so memory stays bounded however long
+    the history. Call it in a transaction: the device row is locked
+    first, so ingest for the device waits for the rebuild rather than
+    adding to rollups it is about to replace."""
+    _lock_device(device_id)
+    HourlyRollup.objects.filter(device_id=device_id).delete()
+    DailyRollup.objects.filter(device_id=device_id).delete()
+    hours = []
+    previous = None
+    for point in archive.window(device_id, chunk_size=chunk_size):
+        start = hour_start(point[0])
+        if not hours or hours[-1].start != start:
+            hours.append(HourlyRollup(device_id=device_id, start=start))
+        extend(hours[-1], [point[:3]], previous)
+        previous = point[1:3]
+    _create_all(HourlyRollup, hours)
+    days = [
+        combine(DailyRollup(device_id=device_id, start=start), parts)
+        for start, parts in _group(
+            hours, lambda hour: day_start(hour.start)).items()
+    ]
+    _create_all(DailyRollup, days)
+    return len(hours), len(days)
+
+
+def _lock_device(device_id):
+    """Lock the device's row until the transaction ends."""
+    TrackerDevice.objects.select_for_update().filter(
+        pk=device_id).values_list('pk').first()
+
+
+def _create_all(model, rollups):
+    """Insert rollups in batches no bigger than the database takes."""
+    size = connection.ops.bulk_batch_size(model._meta.concrete_fields, rollups)
+    model.objects.bulk_create(rollups, batch_size=max(1, min(size, 1000)))
+
+
+def _group(items, key):
+    """Group sorted items by key, keeping order."""
+    groups = OrderedDict()
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return groups
@@ -0,0 +1,137 @@
+"""Tracks simplified for a map zoom, as Google encoded polylines.
+
+A map shows a full resolution route as far more vertices than it has
+pixels for. `simplify` is Douglas-Peucker over the track projected to
+Web Mercator world coordinates, which are 256 pixels across at zoom 0
+and twice that at each zoom after, so an error of `pixels` on screen is
+a tolerance of ``pixels / 2 ** zoom``. It works on every open segment
+of the track at once, one NumPy pass per level of splitting, so a track
+is done in a few dozen passes rather than a Python call per vertex.
+
+`route_line` returns a route's simplified line for a zoom, cached by
+route, track version, window, zoom and pixel error, so a new point or a
+change to the route's window misses the old entries."""
+import math
+
+import numpy as np
+from django.core.cache import cache
+
+from tracker_device import tracks
+
+WORLD_SIZE = 256
+MAX_ZOOM = 22
+PIXELS = 0.5
+MAX_LATITUDE = 85.05112878
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def project(lats, lngs):
+    """Web Mercator world coordinates of arrays of points."""
+    lats = np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE)
+    x = (lngs + 180) / 360 * WORLD_SIZE
+    sin = np.sin(np.radians(lats))
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * WORLD_SIZE
+    return x, y
+
+
+def tolerance(zoom, pixels=PIXELS):
+    """World coordinate tolerance for an error of pixels at zoom."""
+    return pixels / 2.0 ** zoom
+
+
+def simplify(x, y, epsilon):
+    """Indices of the vertices Douglas-Peucker keeps, in order.
+
+    Every vertex dropped is within epsilon of the segment between the
+    kept vertices either side of it."""
+    count = len(x)
+    if count < 3:
+        return np.arange(count)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    starts, ends = np.array([0]), np.array([count - 1])
+    while len(starts):
+        inner = ends - starts - 1
+        split = inner > 0
+        starts, ends, inner = starts[split], ends[split], inner[split]
+        if not len(starts):
+            break
+        segment = np.repeat(np.arange(len(starts)), inner)
+        offsets = np.cumsum(inner) - inner
+        index = starts[segment] + 1 + (
+            np.arange(len(segment)) - offsets[segment])
+        distance = _distance(
+            x[index], y[index], x[starts[segment]], y[starts[segment]],
+            x[ends[segment]], y[ends[segment]])
+        farthest = np.maximum.reduceat(distance, offsets)
+        at_farthest = np.flatnonzero(distance == farthest[segment])
+        segments, first = np.unique(
+            segment[at_farthest], return_index=True)
+        pivots = index[at_farthest[first]]
+        wide = farthest[segments] > epsilon
+        segments, pivots = segments[wide], pivots[wide]
+        keep[pivots] = True
+        starts, ends = (
+            np.concatenate([starts[segments], pivots]),
+            np.concatenate([pivots, ends[segments]]))
+    return np.flatnonzero(keep)
+
+
+def _distance(x, y, x0, y0, x1, y1):
+    """Distance from points to segments, all arrays."""
+    dx, dy = x1 - x0, y1 - y0
+    length = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        along = np.clip(((x - x0) * dx + (y - y0) * dy) / length, 0, 1)
+    along[length == 0] = 0
+    return np.hypot(x - (x0 + along * dx), y - (y0 + along * dy))
+
+
+def encode_polyline(lats, lngs):
+    """Google's encoded polyline of arrays of coordinates."""
+    values = np.round(
+        np.column_stack([lats, lngs]) * 1e5).astype(np.int64)
+    deltas = np.diff(np.vstack([np.zeros((1, 2), np.int64), values]), axis=0)
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+    characters = []
+    for value in zigzag.ravel().tolist():
+        while value >= 0x20:
+            characters.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        characters.append(chr(value + 63))
+    return ''.join(characters)
+
+
+def decode_polyline(text):
+    """Coordinates of an encoded polyline as a list of (lat, lng)."""
+    values = []
+    value = shift = 0
+    for character in text:
+        chunk = ord(character) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    coordinates = np.cumsum(np.array(values).reshape(-1, 2), axis=0) / 1e5
+    return [tuple(pair) for pair in coordinates.tolist()]
+
+
+def route_line(route, zoom, pixels=PIXELS):
+    """A route's track simplified for zoom, as a dict with the encoded
+    polyline, how many points the track has and how many were kept."""
+    key = 'route-line:{}:{}:{}:{}:{}:{}'.format(
+        route.pk, route.track_version, route.start.isoformat(),
+        route.end and route.end.isoformat(), zoom, pixels)
+    line = cache.get(key)
+    if line is None:
+        found = tracks.columns(route)
+        lats, lngs = found.lat, found.lng
+        kept = simplify(*project(lats, lngs), tolerance(zoom, pixels))
+        line = {
+            'points': len(lats),
+            'kept': len(kept),
+            'polyline': encode_polyline(lats[kept], lngs[kept]),
+        }
+        cache.set(key, line, CACHE_TIMEOUT)
+    return line
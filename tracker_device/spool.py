@@ -0,0 +1,256 @@
+"""Write-behind spool for data point ingest.
+
+With DATA_POINT_INGEST_MODE = 'spool' the ingest views append validated
+points to a local append-only spool and answer straight away, instead of
+waiting on an INSERT. The drain_spool management command moves spooled
+points into DataPoint in batched transactions.
+
+Each process appends fixed width records to its own segment file,
+``<pid>-<sequence>.seg``, and renames it to ``.done`` once it reaches
+INGEST_SPOOL_SEGMENT_BYTES. The drainer tails every segment, recording
+how far it got in a ``.offset`` file after each committed batch, and
+deletes segments that are done and fully drained. A segment whose writer
+died is treated as done, so points spooled before a crash are replayed
+on the next drain. A crash between a commit and its offset update
+replays that batch again, which is harmless since inserts skip points
+that are already stored."""
+import glob
+import os
+import struct
+import threading
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from tracker_device.models import TrackerDevice
+from tracker_device.timeutil import from_micros, to_micros
+
+RECORD = struct.Struct('<qqddd')
+CHECKSUM = struct.Struct('<I')
+RECORD_SIZE = RECORD.size + CHECKSUM.size
+
+
+class SpoolWriter(object):
+    """Appends records to this process's current segment."""
+
+    def __init__(self, directory, segment_bytes, fsync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.pid = None
+        self.sequence = 0
+        self.fd = None
+        self.path = None
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def append(self, device_id, points):
+        """Append points for a device in a single write."""
+        data = b''.join(encode_record(device_id, point) for point in points)
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked since the segment was opened, don't share it.
+                self.fd = None
+                self.pid = os.getpid()
+            if self.fd is None:
+                self._open()
+            os.write(self.fd, data)
+            if self.fsync:
+                os.fsync(self.fd)
+            self.size += len(data)
+            if self.size >= self.segment_bytes:
+                self._finish()
+
+    def close(self):
+        """Finish the current segment, if any."""
+        with self.lock:
+            if self.fd is not None and self.pid == os.getpid():
+                self._finish()
+
+    def _open(self):
+        """Start a new segment."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        self.sequence += 1
+        name = '{}-{:06d}.seg'.format(self.pid, self.sequence)
+        self.path = os.path.join(self.directory, name)
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        self.fd = os.open(self.path, flags, 0o644)
+        self.size = os.fstat(self.fd).st_size
+
+    def _finish(self):
+        """Close the current segment and mark it done."""
+        os.close(self.fd)
+        os.rename(self.path, self.path[:-len('.seg')] + '.done')
+        self.fd = None
+        self.path = None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer():
+    """Return this process's writer for the configured spool."""
+    directory = settings.INGEST_SPOOL_DIR
+    with _writers_lock:
+        writer = _writers.get(directory)
+        if writer is None:
+            writer = SpoolWriter(
+                directory,
+                settings.INGEST_SPOOL_SEGMENT_BYTES,
+                settings.INGEST_SPOOL_FSYNC,
+            )
+            _writers[directory] = writer
+        return writer
+
+
+def append(device_id, points):
+    """Spool (time, lat, lng, elevation) points for a device."""
+    get_writer().append(device_id, points)
+    return len(points)
+
+
+def encode_record(device_id, point):
+    """Pack one point into a checksummed record."""
+    time, lat, lng, elevation = point
+    record = RECORD.pack(device_id, to_micros(time), lat, lng, elevation)
+    return record + CHECKSUM.pack(zlib.crc32(record))
+
+
+def decode_records(data):
+    """Unpack whole records, returning (device_id, point) pairs and the
+    number of records that failed their checksum."""
+    records = []
+    corrupt = 0
+    for start in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+        record = data[start:start + RECORD.size]
+        checksum, = CHECKSUM.unpack_from(data, start + RECORD.size)
+        if zlib.crc32(record) != checksum:
+            corrupt += 1
+            continue
+        device_id, microseconds, lat, lng, elevation = RECORD.unpack(record)
+        time = from_micros(microseconds)
+        records.append((device_id, (time, lat, lng, elevation)))
+    return records, corrupt
+
+
+class Segment(object):
+    """A spool segment as seen by the drainer."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path.rsplit('.', 1)[0] + '.offset'
+
+    @property
+    def finished(self):
+        """Whether nothing more will be appended to this segment."""
+        if self.path.endswith('.done'):
+            return True
+        pid = int(os.path.basename(self.path).split('-')[0])
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def open(self):
+        """Open the segment for reading, following a rename to done."""
+        try:
+            return open(self.path, 'rb')
+        except FileNotFoundError:
+            self.path = self.path.rsplit('.', 1)[0] + '.done'
+            return open(self.path, 'rb')
+
+    def read_offset(self):
+        """Return how many bytes have already been drained."""
+        try:
+            with open(self.offset_path) as offset_file:
+                return int(offset_file.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_offset(self, offset):
+        """Record how many bytes have been drained."""
+        temporary = self.offset_path + '.tmp'
+        with open(temporary, 'w') as offset_file:
+            offset_file.write(str(offset))
+            offset_file.flush()
+            os.fsync(offset_file.fileno())
+        os.rename(temporary, self.offset_path)
+
+    def pending_bytes(self):
+        """Return the size of the whole records not yet drained."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+        pending = size - self.read_offset()
+        return pending - pending % RECORD_SIZE
+
+    def remove(self):
+        """Delete the segment and its offset."""
+        for path in (self.path, self.offset_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def segments(directory=None):
+    """Return the segments in the spool."""
+    directory = directory or settings.INGEST_SPOOL_DIR
+    paths = glob.glob(os.path.join(directory, '*.seg'))
+    paths += glob.glob(os.path.join(directory, '*.done'))
+    return [Segment(path) for path in sorted(paths)]
+
+
+def queue_depth(directory=None):
+    """Return how many spooled points are waiting to be drained."""
+    return sum(
+        segment.pending_bytes() // RECORD_SIZE
+        for segment in segments(directory)
+    )
+
+
+def drain(batch_size=5000, directory=None):
+    """Move spooled points into DataPoint.
+
+    Returns counts of new points saved, points dropped because their
+    device no longer exists, and corrupt records skipped."""
+    from tracker_device.ingest import save_points
+    totals = dict(saved=0, dropped=0, corrupt=0)
+    for segment in segments(directory):
+        offset = segment.read_offset()
+        with segment.open() as segment_file:
+            finished = segment.finished
+            segment_file.seek(offset)
+            while True:
+                data = segment_file.read(batch_size * RECORD_SIZE)
+                data = data[:len(data) - len(data) % RECORD_SIZE]
+                if not data:
+                    break
+                records, corrupt = decode_records(data)
+                by_device = defaultdict(list)
+                for device_id, point in records:
+                    by_device[device_id].append(point)
+                existing = set(TrackerDevice.objects.filter(
+                    pk__in=list(by_device)).values_list('pk', flat=True))
+                with transaction.atomic():
+                    for device_id, points in by_device.items():
+                        if device_id in existing:
+                            saved = save_points(device_id, points)
+                            totals['saved'] += len(saved)
+                        else:
+                            totals['dropped'] += len(points)
+                totals['corrupt'] += corrupt
+                offset += len(data)
+                segment_file.seek(offset)
+                segment.write_offset(offset)
+        if finished:
+            segment.remove()
+    return totals
@@ -0,0 +1,84 @@
+"""Keyset paging over a device's data points for the sync API.
+
+A page is the points after a cursor, in one of two orders:
+
+time
+    (time, id), for reading a device's whole history.
+received
+    (time_received, id), for picking up every point stored since the
+    last sync, including late uploads of old fixes. Points received in
+    the last DATA_POINT_SYNC_DELAY seconds are held back, since a slower
+    transaction may still commit points received before them.
+
+Each page is an index range scan starting at the cursor, so it costs
+the same however far into the history it is. Cursors are opaque to
+clients; they encode the order and the last point's sort value and id.
+Archived points aren't included."""
+import base64
+import binascii
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from tracker_device.timeutil import from_micros, to_micros
+from tracker_device.models import DataPoint
+
+PAGE_SIZE = 1000
+FIELDS = ('id', 'time', 'lat', 'lng', 'elevation', 'time_received')
+ORDERS = {
+    'time': 'time',
+    'received': 'time_received',
+}
+
+
+class CursorError(ValueError):
+    """Raised for a cursor that wasn't made by encode_cursor for the
+    order it is used with."""
+
+
+def page(device_id, order='time', cursor=None, limit=PAGE_SIZE):
+    """One page of a device's points after a cursor.
+
+    Returns the points as tuples of FIELDS, the cursor to continue from,
+    which is the one given if there were no points, and whether more
+    points followed."""
+    field = ORDERS[order]
+    points = DataPoint.objects.filter(device_id=device_id)
+    if order == 'received':
+        settled = timezone.now() - timedelta(
+            seconds=settings.DATA_POINT_SYNC_DELAY)
+        points = points.filter(time_received__lte=settled)
+    if cursor:
+        value, pk = decode_cursor(cursor, order)
+        # The first condition alone bounds the index scan.
+        points = points.filter(**{field + '__gte': value}).filter(
+            Q(**{field + '__gt': value}) | Q(pk__gt=pk))
+    rows = list(points.order_by(field, 'id').values_list(
+        *FIELDS)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        last = rows[-1]
+        cursor = encode_cursor(order, last[FIELDS.index(field)], last[0])
+    return rows, cursor, more
+
+
+def encode_cursor(order, value, pk):
+    """The cursor after the point with sort value and id pk."""
+    text = '{}:{}:{}'.format(order, to_micros(value), pk)
+    return base64.urlsafe_b64encode(text.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor, order):
+    """The sort value and id a cursor for order points after."""
+    try:
+        text = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        name, micros, pk = text.decode('ascii').split(':')
+        value, pk = from_micros(int(micros)), int(pk)
+    except (binascii.Error, UnicodeError, ValueError, OverflowError):
+        raise CursorError('Not a cursor.')
+    if name != order:
+        raise CursorError('Cursor is for {} order.'.format(name))
+    return value, pk
@@ -1,9 +1,72 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future
+from unittest import mock
 from uuid import uuid4
+from xml.etree import ElementTree
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command, CommandError
+from django.db import DatabaseError, IntegrityError, connection
 from django.urls import reverse
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.utils import timezone
-from tracker_device.models import TrackerDevice, DataPoint, Route
+from tracker_device.models import (
+    TrackerDevice,
+    DataPoint,
+    Route,
+    HourlyRollup,
+    DailyRollup,
+    ArchivedMonth,
+    Geofence,
+    GeofencePresence,
+)
+from tracker_device.device_cache import (
+    DeviceCache,
+    UNKNOWN,
+    device_cache,
+)
+from tracker_device import (
+    archive,
+    export,
+    geofences,
+    geohash,
+    geojson,
+    mirror,
+    packed,
+    page_cache,
+    partitions,
+    retention,
+    rollups,
+    simplify,
+    spool,
+    tiles,
+    tracks,
+)
+from tracker_device.ingest import save_points
+from tracker_device import ingest_server
+from tracker_device.ingest_server import (
+    IngestServer,
+    PointBatcher,
+    write_batch,
+)
+from tracker_device.udp_server import UDPIngestProtocol, parse_datagram
+from tracker_device.ratelimit import (
+    RateLimiter,
+    SharedRateLimiter,
+    memory_limiter,
+)
+from tracker_device.timeutil import EPOCH, from_micros, to_micros
+from django.core.cache.backends.locmem import LocMemCache
 
 
 class TrackerDeviceTest(TestCase):
@@ -641,3 +704,2710 @@ class TestDetailRouteView(TestCase):
         self.client.force_login(user)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 403)
+
+
+class CreateDataPointBatchViewTestCase(TestCase):
+    """Test view for creating many data points at once."""
+
+    def setUp(self):
+        """Set up a device to create data points onto."""
+        user = User(username='batch')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.url = reverse(
+            'create_data_point_batch', args=[self.device.id_uuid])
+        self.points = [
+            dict(time='10/10/16 10:00:0{}'.format(i), lat=i, lng=i,
+                 elevation=i)
+            for i in range(5)
+        ]
+
+    def post_json(self, data, url=None):
+        """Post data as a JSON body."""
+        return self.client.post(
+            url or self.url, json.dumps(data),
+            content_type='application/json')
+
+    def test_batch_json_creates_points(self):
+        """Test posting a JSON array saves every point."""
+        response = self.post_json(self.points)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content.decode()), {
+            'created': 5, 'duplicates': 0})
+        self.assertEqual(self.device.data.count(), 5)
+
+    def test_batch_csv_creates_points(self):
+        """Test posting a CSV file saves every point."""
+        body = 'time,lat,lng,elevation\n'
+        body += '10/10/16 10:00:00,1.5,2.5,3.5\n'
+        body += '10/10/16 10:00:05,1.6,2.6,3.6\n'
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.device.data.count(), 2)
+        self.assertEqual(self.device.data.order_by('time').first().lat, 1.5)
+
+    def test_batch_uses_one_insert(self):
+        """Test the batch is written without a query per point."""
+        # Device lookup, insert, lock the device, read and write the hour
+        # and day rollups, mark overlapping route tracks out of date and
+        # count the points. The geofence index is loaded first; there are
+        # no fences.
+        geofences.fence_index.refresh()
+        with self.assertNumQueries(9):
+            self.post_json(self.points)
+
+    def test_batch_invalid_point_saves_nothing(self):
+        """Test one bad point rejects the whole batch."""
+        self.points[3]['lat'] = 'north'
+        response = self.post_json(self.points)
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.content.decode())['errors']
+        self.assertEqual(list(errors), ['3'])
+        self.assertIn('lat', errors['3'])
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+    def test_batch_incorrect_uuid(self):
+        """Test posting for a device that doesn't exist."""
+        url = reverse('create_data_point_batch', args=[uuid4()])
+        response = self.post_json(self.points, url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+    def delete_elsewhere(self):
+        """Delete the device as another process would, leaving it in this
+        process's device cache, and have saving points for it fail."""
+        device_cache.resolve(self.device.id_uuid)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM tracker_device_trackerdevice WHERE id = %s',
+                [self.device.pk])
+        self.assertIsNotNone(device_cache.peek(self.device.id_uuid))
+        # SQLite only checks foreign keys when the test's transaction ends.
+        return mock.patch(
+            'tracker_device.views.accept_points', side_effect=IntegrityError)
+
+    def test_batch_device_deleted_elsewhere(self):
+        """Test a device deleted by another process while its UUID is
+        cached is a 400 and is evicted from the cache."""
+        with self.delete_elsewhere():
+            response = self.post_json(self.points)
+        self.assertEqual(response.status_code, 400)
+        self.assertIs(device_cache.peek(self.device.id_uuid), UNKNOWN)
+
+    def test_single_point_device_deleted_elsewhere(self):
+        """Test the same for a single point."""
+        with self.delete_elsewhere():
+            response = self.client.post(reverse('create_data_point'), {
+                'uuid': self.device.id_uuid, 'time': '2016-10-10 10:00',
+                'lat': 1, 'lng': 1, 'elevation': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('uuid', response.context['form'].errors)
+        self.assertIs(device_cache.peek(self.device.id_uuid), UNKNOWN)
+
+    def test_batch_integrity_error_with_device(self):
+        """Test an integrity error for a device that exists isn't taken
+        for a bad UUID."""
+        with mock.patch('tracker_device.views.accept_points',
+                        side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.post_json(self.points)
+
+    def test_batch_bad_json(self):
+        """Test posting a body that isn't JSON."""
+        response = self.client.post(
+            self.url, '[{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_not_an_array(self):
+        """Test posting a JSON object instead of an array."""
+        response = self.post_json(self.points[0])
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_limit(self):
+        """Test batches over the configured limit are rejected."""
+        with self.settings(DATA_POINT_BATCH_LIMIT=2):
+            response = self.post_json(self.points)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+
+class DeviceCacheTestCase(TestCase):
+    """Test the UUID to device lookup cache."""
+
+    def setUp(self):
+        """Set up a device and a cache with a clock we control."""
+        user = User(username='cache')
+        user.save()
+        self.device = TrackerDevice(user=user, mode='quiet')
+        self.device.save()
+        self.now = 0
+        self.cache = DeviceCache(
+            size=2, ttl=60, negative_ttl=5, clock=lambda: self.now)
+
+    def test_resolve_known_uuid(self):
+        """Test resolving a device gives its id and mode."""
+        found = self.cache.resolve(self.device.id_uuid)
+        self.assertEqual(found.id, self.device.pk)
+        self.assertEqual(found.mode, 'quiet')
+
+    def test_resolve_string_uuid(self):
+        """Test resolving accepts the UUID as a string."""
+        found = self.cache.resolve(str(self.device.id_uuid))
+        self.assertEqual(found.id, self.device.pk)
+
+    def test_resolve_garbage(self):
+        """Test resolving something that isn't a UUID doesn't query."""
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.cache.resolve(';-)'))
+            self.assertIsNone(self.cache.resolve(None))
+
+    def test_hit_does_not_query(self):
+        """Test a cached device is resolved without the database."""
+        self.cache.resolve(self.device.id_uuid)
+        with self.assertNumQueries(0):
+            self.cache.resolve(self.device.id_uuid)
+
+    def test_negative_cache(self):
+        """Test unknown UUIDs are remembered until the negative TTL."""
+        missing = uuid4()
+        self.assertIsNone(self.cache.resolve(missing))
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.cache.resolve(missing))
+        self.now = 5
+        with self.assertNumQueries(1):
+            self.cache.resolve(missing)
+
+    def test_positive_ttl(self):
+        """Test found devices are looked up again after the TTL."""
+        self.cache.resolve(self.device.id_uuid)
+        self.now = 60
+        with self.assertNumQueries(1):
+            self.cache.resolve(self.device.id_uuid)
+
+    def test_least_recently_used_evicted(self):
+        """Test the cache never holds more than its size."""
+        user = self.device.user
+        others = [TrackerDevice(user=user) for i in range(2)]
+        for device in others:
+            device.save()
+        self.cache.resolve(self.device.id_uuid)
+        for device in others:
+            self.cache.resolve(device.id_uuid)
+        with self.assertNumQueries(1):
+            self.cache.resolve(self.device.id_uuid)
+
+    def test_save_evicts_device(self):
+        """Test changing a device's mode is seen on the next lookup."""
+        device_cache.resolve(self.device.id_uuid)
+        self.device.mode = 'debug'
+        self.device.save()
+        device_cache.resolve(self.device.id_uuid)
+        self.assertEqual(device_cache.resolve(self.device.id_uuid).mode,
+                         'debug')
+
+    def test_delete_evicts_device(self):
+        """Test a deleted device no longer resolves."""
+        uuid = self.device.id_uuid
+        device_cache.resolve(uuid)
+        self.device.delete()
+        self.assertIsNone(device_cache.resolve(uuid))
+
+    def test_single_point_post_resolves_once(self):
+        """Test the data point view only looks the device up once."""
+        device_cache.clear()
+        data = dict(
+            time='10/10/10',
+            lat=1.0,
+            lng=2.0,
+            elevation=3.0,
+            uuid=self.device.id_uuid
+        )
+        # Device lookup, insert, the device lock, the hour and day rollups,
+        # route tracks and the device's point count. There are no fences
+        # to evaluate.
+        geofences.fence_index.refresh()
+        with self.assertNumQueries(9):
+            self.client.post(reverse('create_data_point'), data)
+        with self.assertNumQueries(1):
+            self.client.post(reverse('create_data_point'), data)
+
+
+class PackedFormatTestCase(TestCase):
+    """Test encoding and decoding the packed binary format."""
+
+    def setUp(self):
+        """Make a short track of points."""
+        self.uuid = uuid4()
+        start = timezone.make_aware(timezone.datetime(2016, 10, 10, 10))
+        self.points = [
+            (start + timezone.timedelta(seconds=i * 5),
+             47.6 + i * 0.0001, -122.3 - i * 0.0001, 30.25 + i)
+            for i in range(10)
+        ]
+
+    def assert_round_trip(self, body):
+        """Check a payload decodes back to self.points."""
+        device, time, lat, lng, elevation = packed.decode(body)
+        self.assertEqual(device, self.uuid)
+        points = packed.to_points(time, lat, lng, elevation)
+        self.assertEqual(len(points), len(self.points))
+        for actual, expected in zip(points, self.points):
+            self.assertEqual(actual[0], expected[0])
+            for a, b in zip(actual[1:], expected[1:]):
+                self.assertAlmostEqual(a, b, places=5)
+
+    def test_absolute_round_trip(self):
+        """Test absolute records decode to the points encoded."""
+        body = packed.encode(self.uuid, self.points, delta=False)
+        self.assertEqual(len(body), 20 + 16 * 10)
+        self.assert_round_trip(body)
+
+    def test_delta_round_trip(self):
+        """Test delta records decode to the points encoded."""
+        body = packed.encode(self.uuid, self.points)
+        self.assertEqual(len(body), 20 + 16 + 8 * 9)
+        self.assert_round_trip(body)
+
+    def test_large_step_falls_back_to_absolute(self):
+        """Test steps too big for a delta record aren't delta encoded."""
+        time, lat, lng, elevation = self.points[-1]
+        self.points[-1] = (time, lat + 10, lng, elevation)
+        body = packed.encode(self.uuid, self.points)
+        self.assertEqual(len(body), 20 + 16 * 10)
+        self.assert_round_trip(body)
+
+    def test_bad_magic(self):
+        """Test payloads without the magic bytes are rejected."""
+        body = b'XX' + packed.encode(self.uuid, self.points)[2:]
+        with self.assertRaises(packed.PackedError):
+            packed.decode(body)
+
+    def test_truncated_record(self):
+        """Test payloads ending partway through a record are rejected."""
+        for delta in (True, False):
+            body = packed.encode(self.uuid, self.points, delta=delta)
+            with self.assertRaises(packed.PackedError):
+                packed.decode(body[:-3])
+
+
+class CreateDataPointPackedViewTestCase(TestCase):
+    """Test view for creating data points from packed payloads."""
+
+    def setUp(self):
+        """Set up a device to create data points onto."""
+        user = User(username='packed')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.url = reverse('create_data_point_packed')
+        self.points = [(1476093600 + i, 1.5, 2.5, 3.5) for i in range(3)]
+
+    def post(self, body):
+        """Post a binary body."""
+        return self.client.post(
+            self.url, body, content_type='application/octet-stream')
+
+    def test_packed_creates_points(self):
+        """Test posting a packed payload saves every point."""
+        response = self.post(packed.encode(self.device.id_uuid, self.points))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.device.data.count(), 3)
+        first = self.device.data.order_by('time').first()
+        self.assertEqual(first.time.timestamp(), 1476093600)
+        self.assertEqual(first.elevation, 3.5)
+
+    def test_packed_incorrect_uuid(self):
+        """Test posting for a device that doesn't exist."""
+        response = self.post(packed.encode(uuid4(), self.points))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+    def test_packed_garbage(self):
+        """Test posting something that isn't a packed payload."""
+        response = self.post(b'time=10/10/10')
+        self.assertEqual(response.status_code, 400)
+
+
+class SpoolTestCase(TestCase):
+    """Test write-behind ingest through the spool."""
+
+    def setUp(self):
+        """Point the spool at a temporary directory."""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = self.settings(
+            DATA_POINT_INGEST_MODE='spool',
+            INGEST_SPOOL_DIR=self.directory,
+            INGEST_SPOOL_FSYNC=False,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(spool.get_writer().close)
+        user = User(username='spool')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 10, 10))
+        self.data = dict(
+            time='10/10/2016 00:00:00',
+            lat=1.5,
+            lng=2.5,
+            elevation=3.5,
+            uuid=self.device.id_uuid
+        )
+
+    def test_post_is_spooled_not_saved(self):
+        """Test the single point view acks without inserting."""
+        response = self.client.post(reverse('create_data_point'), self.data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(DataPoint.objects.count(), 0)
+        self.assertEqual(spool.queue_depth(), 1)
+
+    def test_batch_is_accepted(self):
+        """Test the batch view answers 202 when spooling."""
+        url = reverse('create_data_point_batch', args=[self.device.id_uuid])
+        point = dict(self.data, uuid=None)
+        body = json.dumps([point, point])
+        response = self.client.post(
+            url, body, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(spool.queue_depth(), 2)
+
+    def test_drain_saves_points(self):
+        """Test draining writes spooled points and empties the queue."""
+        self.client.post(reverse('create_data_point'), self.data)
+        totals = spool.drain()
+        self.assertEqual(totals['saved'], 1)
+        self.assertEqual(spool.queue_depth(), 0)
+        point = self.device.data.get()
+        self.assertEqual(point.time, self.time)
+        self.assertEqual(point.elevation, 3.5)
+
+    def test_drain_only_once(self):
+        """Test points aren't saved again by a second drain."""
+        spool.append(self.device.pk, [(self.time, 1, 2, 3)])
+        spool.drain()
+        later = self.time + timezone.timedelta(seconds=5)
+        spool.append(self.device.pk, [(later, 4, 5, 6)])
+        spool.drain()
+        self.assertEqual(self.device.data.count(), 2)
+
+    def test_finished_segments_removed(self):
+        """Test drained segments are deleted once done."""
+        spool.append(self.device.pk, [(self.time, 1, 2, 3)])
+        spool.get_writer().close()
+        spool.drain()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_segments_rotate(self):
+        """Test the writer starts a new segment past the size limit."""
+        with self.settings(INGEST_SPOOL_SEGMENT_BYTES=spool.RECORD_SIZE):
+            writer = spool.SpoolWriter(self.directory, spool.RECORD_SIZE)
+            writer.append(self.device.pk, [(self.time, 1, 2, 3)])
+            writer.append(self.device.pk, [(self.time, 1, 2, 3)])
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith('.done') for name in names))
+
+    def test_replay_after_crash(self):
+        """Test a dead writer's segment is replayed, torn tail ignored."""
+        path = os.path.join(self.directory, '999999999-000001.seg')
+        with open(path, 'wb') as segment:
+            segment.write(spool.encode_record(
+                self.device.pk, (self.time, 1, 2, 3)))
+            segment.write(spool.encode_record(
+                self.device.pk, (self.time, 4, 5, 6))[:10])
+        self.assertEqual(spool.queue_depth(), 1)
+        spool.drain()
+        self.assertEqual(self.device.data.count(), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_corrupt_record_skipped(self):
+        """Test records failing their checksum aren't saved."""
+        record = bytearray(spool.encode_record(
+            self.device.pk, (self.time, 1, 2, 3)))
+        record[12] ^= 0xff
+        path = os.path.join(self.directory, '999999999-000001.seg')
+        with open(path, 'wb') as segment:
+            segment.write(bytes(record))
+        totals = spool.drain()
+        self.assertEqual(totals['corrupt'], 1)
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+    def test_deleted_device_dropped(self):
+        """Test points for a device deleted since spooling are dropped."""
+        spool.append(self.device.pk, [(self.time, 1, 2, 3)])
+        self.device.delete()
+        totals = spool.drain()
+        self.assertEqual(totals['dropped'], 1)
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+    def test_drain_spool_command(self):
+        """Test the management command drains the spool."""
+        spool.append(self.device.pk, [(self.time, 1, 2, 3)])
+        call_command('drain_spool', once=True, stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.device.data.count(), 1)
+
+
+class IdempotentIngestTestCase(TestCase):
+    """Test resent points are stored only once."""
+
+    def setUp(self):
+        """Set up a device and a point it will send twice."""
+        user = User(username='resend')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.data = dict(
+            time='10/10/2016 10:00:00',
+            lat=1.5,
+            lng=2.5,
+            elevation=3.5,
+            uuid=self.device.id_uuid
+        )
+
+    def test_single_point_resent(self):
+        """Test posting the same point twice saves it once."""
+        for i in range(2):
+            response = self.client.post(
+                reverse('create_data_point'), self.data)
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.device.data.count(), 1)
+
+    def test_batch_resent(self):
+        """Test a replayed batch only adds the new points."""
+        url = reverse('create_data_point_batch', args=[self.device.id_uuid])
+        first = dict(self.data, uuid=None)
+        second = dict(first, time='10/10/2016 10:00:05')
+        self.client.post(
+            url, json.dumps([first]), content_type='application/json')
+        response = self.client.post(
+            url, json.dumps([first, second, second]),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content.decode()), {
+            'created': 1, 'duplicates': 2})
+        self.assertEqual(self.device.data.count(), 2)
+
+    def test_same_time_other_device(self):
+        """Test two devices can have points at the same time."""
+        other = TrackerDevice(user=self.device.user)
+        other.save()
+        device_cache.resolve(other.id_uuid)
+        self.client.post(reverse('create_data_point'), self.data)
+        self.data['uuid'] = other.id_uuid
+        self.client.post(reverse('create_data_point'), self.data)
+        self.assertEqual(DataPoint.objects.count(), 2)
+
+
+class DedupeDataPointsTestCase(TestCase):
+    """Test the command removing duplicates stored before uniqueness."""
+
+    def setUp(self):
+        """Store some duplicate points without the unique index."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DROP INDEX tracker_device_datapoint_device_id_time_uniq')
+        user = User(username='dupes')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.other = TrackerDevice(user=user)
+        self.other.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 10, 10))
+        for device in (self.device, self.device, self.device, self.other):
+            DataPoint(device=device, time=self.time, lat=1, lng=2,
+                      elevation=3).save()
+        DataPoint(device=self.device, time=timezone.now(), lat=1, lng=2,
+                  elevation=3).save()
+        self.first = self.device.data.order_by('id').first()
+
+    def test_dedupe_keeps_first_point(self):
+        """Test only the first of each (device, time) is kept."""
+        call_command(
+            'dedupe_data_points', chunk_size=2,
+            stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.device.data.count(), 2)
+        self.assertEqual(self.other.data.count(), 1)
+        self.assertTrue(self.device.data.filter(pk=self.first.pk).exists())
+
+    def test_temporary_index(self):
+        """Test the chunks are looked up by a temporary index, dropped
+        afterwards."""
+        with CaptureQueriesContext(connection) as queries:
+            call_command('dedupe_data_points', stdout=open(os.devnull, 'w'))
+        sql = [query['sql'].split(' ')[0] for query in
+               queries.captured_queries
+               if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(
+            sql, ['SELECT', 'DROP', 'CREATE', 'DELETE', 'DROP'])
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, DataPoint._meta.db_table)
+        self.assertNotIn('tracker_device_datapoint_dedupe', constraints)
+
+
+class InlineExecutor(object):
+    """Executor running work on the calling thread, so it shares the test
+    database connection."""
+
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+class IngestServerTestCase(TestCase):
+    """Test the asyncio ingest server."""
+
+    def setUp(self):
+        """Start a server on a free port."""
+        user = User(username='async')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        executor = InlineExecutor()
+        self.batcher = PointBatcher(interval=0.01, executor=executor)
+        self.batcher.start()
+        ingest = IngestServer(self.batcher, timeout=0.5, lookups=executor)
+        self.server = self.loop.run_until_complete(asyncio.start_server(
+            ingest.handle, '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        """Shut the server down."""
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.run_until_complete(self.batcher.stop())
+
+    def send(self, data):
+        """Send raw bytes and return everything the server answers."""
+        async def talk():
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.port)
+            writer.write(data)
+            response = await reader.read()
+            writer.close()
+            return response
+        return self.loop.run_until_complete(talk())
+
+    def request(self, path, body, content_type, connection='close'):
+        """Send a POST request and return the response."""
+        head = (
+            'POST {} HTTP/1.1\r\nContent-Type: {}\r\n'
+            'Content-Length: {}\r\nConnection: {}\r\n\r\n'
+        ).format(path, content_type, len(body), connection).encode()
+        return self.send(head + body)
+
+    def form_body(self, **kwargs):
+        """Encode a single point the way a device does."""
+        data = dict(time='10/10/2016 10:00:00', lat=1.5, lng=2.5,
+                    elevation=3.5, uuid=self.device.id_uuid)
+        data.update(kwargs)
+        return '&'.join(
+            '{}={}'.format(key, value) for key, value in data.items()
+        ).encode()
+
+    def test_single_point(self):
+        """Test a form encoded point is saved and redirected like the
+        view."""
+        response = self.request(
+            '/device/data/create', self.form_body(),
+            'application/x-www-form-urlencoded')
+        self.assertTrue(response.startswith(b'HTTP/1.1 302 Found'))
+        self.assertEqual(self.device.data.count(), 1)
+
+    def test_single_point_invalid(self):
+        """Test a point failing validation is rejected."""
+        response = self.request(
+            '/device/data/create', self.form_body(lat='north'),
+            'application/x-www-form-urlencoded')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400'))
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+    def test_single_point_bad_uuid(self):
+        """Test a point for an unknown device is rejected."""
+        response = self.request(
+            '/device/data/create', self.form_body(uuid=uuid4()),
+            'application/x-www-form-urlencoded')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400'))
+        self.assertIn(b'Bad UUID', response)
+
+    def test_batch(self):
+        """Test a JSON batch is saved."""
+        points = [
+            dict(time='10/10/16 10:00:0{}'.format(i), lat=i, lng=i,
+                 elevation=i)
+            for i in range(3)
+        ]
+        response = self.request(
+            '/device/data/{}/batch'.format(self.device.id_uuid),
+            json.dumps(points).encode(), 'application/json')
+        self.assertTrue(response.startswith(b'HTTP/1.1 201'))
+        self.assertIn(b'"created": 3', response)
+        self.assertEqual(self.device.data.count(), 3)
+
+    def test_packed(self):
+        """Test a packed payload is saved."""
+        body = packed.encode(
+            self.device.id_uuid, [(1476093600 + i, 1, 2, 3) for i in range(4)])
+        response = self.request(
+            '/device/data/packed', body, 'application/octet-stream')
+        self.assertTrue(response.startswith(b'HTTP/1.1 201'))
+        self.assertEqual(self.device.data.count(), 4)
+
+    def test_keep_alive(self):
+        """Test several requests on one connection are all answered."""
+        first = self.form_body()
+        second = self.form_body(time='10/10/2016 10:00:05')
+        template = (
+            'POST /device/data/create HTTP/1.1\r\n'
+            'Connection: {}\r\nContent-Length: {}\r\n\r\n'
+        )
+        response = self.send(
+            template.format('keep-alive', len(first)).encode() + first +
+            template.format('close', len(second)).encode() + second)
+        self.assertEqual(response.count(b'HTTP/1.1 302'), 2)
+        self.assertEqual(self.device.data.count(), 2)
+
+    def test_unknown_path(self):
+        """Test paths other than the ingest endpoints are not found."""
+        response = self.request('/profile/', b'', 'text/plain')
+        self.assertTrue(response.startswith(b'HTTP/1.1 404'))
+
+    def test_body_too_large(self):
+        """Test oversized bodies are refused before being read."""
+        response = self.send(
+            b'POST /device/data/packed HTTP/1.1\r\n'
+            b'Content-Length: 1000000000\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 413'))
+
+    def test_slow_client_times_out(self):
+        """Test a client stalling mid-request is disconnected."""
+        response = self.send(b'POST /device/data/packed HTTP/1.1\r\n')
+        self.assertEqual(response, b'')
+
+    def test_busy_when_queue_full(self):
+        """Test requests get a 503 while too many points are queued."""
+        self.batcher.queued = 10 ** 6
+        response = self.request(
+            '/device/data/create', self.form_body(),
+            'application/x-www-form-urlencoded')
+        self.batcher.queued = 0
+        self.assertTrue(response.startswith(b'HTTP/1.1 503'))
+        self.assertIn(b'Retry-After: 1', response)
+
+    def test_database_error_answered(self):
+        """Test a database error while saving is answered with a 503
+        instead of dropping the connection."""
+        failing = mock.patch('tracker_device.ingest_server.save_points',
+                             side_effect=DatabaseError('gone away'))
+        with failing, self.assertLogs('tracker_device.ingest_server'):
+            response = self.request(
+                '/device/data/create', self.form_body(),
+                'application/x-www-form-urlencoded')
+        self.assertTrue(response.startswith(b'HTTP/1.1 503'))
+        self.assertIn(b'Retry-After: 1', response)
+
+    def test_failing_device_fails_alone(self):
+        """Test one device's database error doesn't fail the others in
+        its batch."""
+        other = TrackerDevice(user=self.device.user)
+        other.save()
+        error = DatabaseError('bad device')
+
+        def save(device_id, points):
+            if device_id == other.pk:
+                raise error
+            return save_points(device_id, points)
+        point = (timezone.now(), 1, 2, 3)
+        with mock.patch('tracker_device.ingest_server.save_points', save):
+            results = write_batch([
+                (self.device.pk, [point]), (other.pk, [point]),
+                (other.pk + 1, [point])])
+        self.assertEqual(results, [1, error, None])
+        self.assertEqual(self.device.data.count(), 1)
+
+    def test_lookups_recycle_connections(self):
+        """Test lookup threads close broken connections before querying,
+        like the writer thread."""
+        with mock.patch.object(connection, 'in_atomic_block', False), \
+                mock.patch('tracker_device.ingest_server.'
+                           'close_old_connections') as close, \
+                mock.patch.object(device_cache, 'resolve') as resolve:
+            ingest_server.resolve_device(self.device.id_uuid)
+        self.assertTrue(close.called)
+        resolve.assert_called_once_with(self.device.id_uuid)
+
+
+class UDPIngestTestCase(TestCase):
+    """Test the UDP ingest listener."""
+
+    def setUp(self):
+        """Set up a device and a listener with a clock the test drives."""
+        user = User(username='udp')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        executor = InlineExecutor()
+        self.batcher = PointBatcher(interval=0.01, executor=executor)
+        self.batcher.start()
+        self.addCleanup(
+            lambda: self.loop.run_until_complete(self.batcher.stop()))
+        self.now = 100.0
+        self.protocol = UDPIngestProtocol(
+            self.batcher, window=2, max_pending=3, lookups=executor,
+            clock=lambda: self.now)
+        device_cache.clear()
+
+    def datagram(self, second=0, **kwargs):
+        """Encode a single fix the way a device posts it."""
+        data = dict(time='10/10/2016 10:00:{:02d}'.format(second), lat=1.5,
+                    lng=2.5, elevation=3.5, uuid=self.device.id_uuid)
+        data.update(kwargs)
+        return '&'.join(
+            '{}={}'.format(key, value) for key, value in data.items()
+        ).encode()
+
+    def receive(self, *datagrams):
+        """Deliver datagrams and let any device lookups finish."""
+        for data in datagrams:
+            self.protocol.datagram_received(data, ('127.0.0.1', 9))
+        self.loop.run_until_complete(self.protocol.settle())
+
+    def release(self, after):
+        """Move the clock on and write whatever has waited long enough."""
+        self.now += after
+        self.loop.run_until_complete(self.protocol.release())
+        self.loop.run_until_complete(self.protocol.settle())
+
+    def test_form_datagram(self):
+        """Test a form encoded fix is saved once the window passes."""
+        self.receive(self.datagram())
+        self.release(1)
+        self.assertEqual(self.device.data.count(), 0)
+        self.release(1)
+        self.assertEqual(self.device.data.count(), 1)
+        self.assertEqual(self.protocol.counters['saved'], 1)
+
+    def test_packed_datagram(self):
+        """Test a packed fix is saved."""
+        self.receive(
+            packed.encode(self.device.id_uuid, [(1476093600, 1, 2, 3)]))
+        self.release(2)
+        self.assertEqual(self.device.data.get().lat, 1)
+
+    def test_reorders_within_window(self):
+        """Test fixes arriving out of order are written in time order."""
+        self.receive(self.datagram(5), self.datagram(1))
+        self.release(1)
+        self.receive(self.datagram(3))
+        self.release(2)
+        self.assertEqual(self.protocol.counters['late'], 0)
+        self.release(1)
+        seconds = [
+            point.time.second
+            for point in self.device.data.order_by('pk')
+        ]
+        self.assertEqual(seconds, [1, 3, 5])
+
+    def test_late_fix_counted(self):
+        """Test a fix older than one already written is still saved."""
+        self.receive(self.datagram(5))
+        self.release(2)
+        self.receive(self.datagram(1))
+        self.release(2)
+        self.assertEqual(self.protocol.counters['late'], 1)
+        self.assertEqual(self.device.data.count(), 2)
+
+    def test_malformed_counted(self):
+        """Test datagrams failing validation are counted and not saved."""
+        self.receive(
+            self.datagram(lat='north'),
+            self.datagram(uuid=''),
+            b'TP\x01',
+            b'\xff\xfe',
+        )
+        self.release(2)
+        self.assertEqual(self.protocol.counters['malformed'], 4)
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+    def test_unknown_device_counted(self):
+        """Test fixes for unknown devices are counted and not saved."""
+        self.receive(self.datagram(uuid=uuid4()))
+        self.release(2)
+        self.assertEqual(self.protocol.counters['unknown_device'], 1)
+        self.assertEqual(DataPoint.objects.count(), 0)
+
+    def test_dropped_when_full(self):
+        """Test fixes beyond max_pending are dropped and counted."""
+        self.receive(*[self.datagram(i) for i in range(5)])
+        self.loop.run_until_complete(self.protocol.stop())
+        self.assertEqual(self.protocol.counters['dropped'], 2)
+        self.assertEqual(self.device.data.count(), 3)
+
+    def test_lookup_error_dropped(self):
+        """Test fixes whose device lookup fails are dropped and counted,
+        and lookups go through the ingest server's recycling helper."""
+        with mock.patch('tracker_device.udp_server.resolve_device',
+                        side_effect=DatabaseError('gone away')) as resolve, \
+                self.assertLogs('tracker_device.udp_server'):
+            self.receive(self.datagram(), self.datagram(1))
+        resolve.assert_called_with(str(self.device.id_uuid))
+        self.assertEqual(self.protocol.counters['dropped'], 2)
+        self.assertFalse(self.protocol.tasks)
+        self.receive(self.datagram(2))
+        self.loop.run_until_complete(self.protocol.stop())
+        self.assertEqual(self.device.data.count(), 1)
+
+    def test_duplicates_counted(self):
+        """Test a resent fix is counted as a duplicate."""
+        self.receive(self.datagram(), self.datagram())
+        self.release(2)
+        self.assertEqual(self.protocol.counters['saved'], 1)
+        self.assertEqual(self.protocol.counters['duplicates'], 1)
+
+    def test_parse_datagram(self):
+        """Test a form encoded datagram parses to a UUID and one point."""
+        uuid, points = parse_datagram(self.datagram())
+        self.assertEqual(uuid, str(self.device.id_uuid))
+        self.assertEqual(len(points), 1)
+
+
+class RateLimiterTestCase(TestCase):
+    """Test the token bucket and shared window limiters."""
+
+    def setUp(self):
+        """Set up limiters on a clock the test drives."""
+        self.now = 1000.0
+        self.limiter = RateLimiter(size=2, clock=lambda: self.now)
+        cache = LocMemCache('ratelimit-test', {})
+        self.shared = SharedRateLimiter(cache, clock=lambda: self.now)
+
+    def test_burst_then_wait(self):
+        """Test a full bucket allows a burst, then says how long to wait."""
+        for i in range(3):
+            self.assertEqual(self.limiter.take('a', 1, 3), 0)
+        self.assertEqual(self.limiter.take('a', 1, 3), 1)
+
+    def test_refills(self):
+        """Test tokens come back at the rate given."""
+        for i in range(3):
+            self.limiter.take('a', 0.5, 3)
+        self.now += 2
+        self.assertEqual(self.limiter.take('a', 0.5, 3), 0)
+        self.assertEqual(self.limiter.take('a', 0.5, 3), 2)
+
+    def test_keys_separate(self):
+        """Test one key running out doesn't affect another."""
+        self.limiter.take('a', 1, 1)
+        self.assertEqual(self.limiter.take('b', 1, 1), 0)
+
+    def test_bounded(self):
+        """Test the least recently used bucket is dropped past size."""
+        for key in 'abc':
+            self.limiter.take(key, 1, 1)
+        self.assertEqual(self.limiter.take('a', 1, 1), 0)
+
+    def test_shared_window(self):
+        """Test the shared limiter allows burst per window."""
+        for i in range(3):
+            self.assertEqual(self.shared.take('a', 1, 3), 0)
+        self.assertAlmostEqual(self.shared.take('a', 1, 3), 2)
+        self.now += 2
+        self.assertEqual(self.shared.take('a', 1, 3), 0)
+
+
+class RateLimitedIngestTestCase(TestCase):
+    """Test ingest endpoints turn away devices over their limit."""
+
+    def setUp(self):
+        """Allow two requests per device and cache the device, since only
+        cached devices are limited."""
+        settings = self.settings(DATA_POINT_RATE_LIMITS={
+            'transmit': (0.5, 2),
+            'debug': None,
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        memory_limiter.clear()
+        device_cache.clear()
+        user = User(username='limited')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        device_cache.resolve(self.device.id_uuid)
+
+    def post_point(self, second, uuid=None):
+        """Post one point for the device."""
+        data = {
+            'time': '10/10/2016 10:00:{:02d}'.format(second),
+            'lat': 1, 'lng': 2, 'elevation': 3,
+            'uuid': uuid or self.device.id_uuid,
+        }
+        return self.client.post(reverse('create_data_point'), data)
+
+    def test_over_limit_rejected(self):
+        """Test the request after the burst gets a 429 and Retry-After."""
+        for second in range(2):
+            self.assertEqual(self.post_point(second).status_code, 302)
+        response = self.post_point(2)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(self.device.data.count(), 2)
+
+    def test_rejection_skips_database(self):
+        """Test deciding to reject a cached device runs no queries."""
+        for second in range(2):
+            self.post_point(second)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.post_point(2).status_code, 429)
+
+    def test_unlimited_mode(self):
+        """Test a mode set to None is never limited."""
+        self.device.mode = 'debug'
+        self.device.save()
+        device_cache.resolve(self.device.id_uuid)
+        for second in range(4):
+            self.assertEqual(self.post_point(second).status_code, 302)
+
+    def test_other_devices_unaffected(self):
+        """Test one device over its limit doesn't block another."""
+        other = TrackerDevice(user=self.device.user)
+        other.save()
+        device_cache.resolve(other.id_uuid)
+        for second in range(3):
+            self.post_point(second)
+        self.assertEqual(self.post_point(0, other.id_uuid).status_code, 302)
+
+    def test_batch_limited(self):
+        """Test the batch endpoint shares the device's limit."""
+        for second in range(2):
+            self.post_point(second)
+        url = reverse('create_data_point_batch', args=[self.device.id_uuid])
+        response = self.client.post(
+            url, '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+
+    def test_packed_limited(self):
+        """Test the packed endpoint shares the device's limit."""
+        for second in range(2):
+            self.post_point(second)
+        body = packed.encode(self.device.id_uuid, [(1476093600, 1, 2, 3)])
+        response = self.client.post(
+            reverse('create_data_point_packed'), body,
+            content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 429)
+
+
+class DataPointQuerySetTestCase(TestCase):
+    """Test the window and most recent queries on a device's points."""
+
+    def setUp(self):
+        """Add a device with a point each day of January 2016."""
+        user = User(username='window')
+        user.save()
+        self.client.force_login(user)
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        other = TrackerDevice(user=user)
+        other.save()
+        for day in range(1, 32):
+            for device in (self.device, other):
+                DataPoint(
+                    device=device, lat=day, lng=day, elevation=day,
+                    time=timezone.make_aware(timezone.datetime(2016, 1, day)),
+                ).save()
+
+    def day(self, day):
+        """Return midnight on a day of January 2016."""
+        return timezone.make_aware(timezone.datetime(2016, 1, day))
+
+    def test_window(self):
+        """Test a window holds its device's points in time order."""
+        points = self.device.data.window(self.day(10), self.day(12))
+        self.assertEqual([point.lat for point in points], [10, 11, 12])
+
+    def test_window_open_ended(self):
+        """Test a window without an end runs to the latest point."""
+        points = self.device.data.window(self.day(30))
+        self.assertEqual([point.lat for point in points], [30, 31])
+
+    def test_most_recent(self):
+        """Test the newest points come first."""
+        points = self.device.data.most_recent(3)
+        self.assertEqual([point.lat for point in points], [31, 30, 29])
+
+    def test_route_in_progress(self):
+        """Test a route without an end shows every point since its start."""
+        route = Route(device=self.device, start=self.day(25))
+        route.save()
+        response = self.client.get(reverse('detail_route', args=[route.pk]))
+        self.assertEqual(
+            [point.lat for point in response.context['data_ten']],
+            list(range(31, 24, -1)))
+
+    def test_device_detail_queries(self):
+        """Test the device page doesn't count every point it has."""
+        url = reverse('detail_device', args=[self.device.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['data']), 10)
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'])
+
+
+class RetentionTestCase(TestCase):
+    """Test per user retention and partition bookkeeping."""
+
+    def setUp(self):
+        """Add two users with a point on the first of each month of 2016."""
+        self.now = timezone.make_aware(timezone.datetime(2016, 12, 15))
+        self.devices = []
+        for name in ('short', 'long'):
+            user = User(username=name)
+            user.save()
+            device = TrackerDevice(user=user)
+            device.save()
+            self.devices.append(device)
+            for month in range(1, 13):
+                DataPoint(
+                    device=device, lat=month, lng=month, elevation=month,
+                    time=timezone.make_aware(
+                        timezone.datetime(2016, month, 1)),
+                ).save()
+        self.short, self.long = [device.user for device in self.devices]
+        self.short.profile.data_retention_months = 2
+        self.short.profile.save()
+
+    def test_cutoffs(self):
+        """Test users keep their own months or the site default."""
+        with self.settings(DATA_POINT_RETENTION_MONTHS=6):
+            cutoffs = retention.user_cutoffs(self.now)
+        self.assertEqual(cutoffs[self.short.pk], timezone.make_aware(
+            timezone.datetime(2016, 10, 1), timezone.utc))
+        self.assertEqual(cutoffs[self.long.pk], timezone.make_aware(
+            timezone.datetime(2016, 6, 1), timezone.utc))
+        self.assertEqual(retention.horizon(cutoffs), cutoffs[self.long.pk])
+
+    def test_no_horizon_when_kept_forever(self):
+        """Test nothing is partition dropped while a user keeps it all."""
+        with self.settings(DATA_POINT_RETENTION_MONTHS=None):
+            cutoffs = retention.user_cutoffs(self.now)
+        self.assertIsNone(cutoffs[self.long.pk])
+        self.assertIsNone(retention.horizon(cutoffs))
+
+    def test_expire_points(self):
+        """Test only the user's points before the cutoff are deleted."""
+        cutoff = retention.user_cutoffs(self.now)[self.short.pk]
+        deleted = retention.expire_points(self.short.pk, cutoff, 4)
+        self.assertEqual(deleted, 9)
+        short, long = self.devices
+        self.assertEqual(
+            sorted(short.data.values_list('lat', flat=True)), [10, 11, 12])
+        self.assertEqual(long.data.count(), 12)
+
+    def test_command(self):
+        """Test the command applies retention without partitions."""
+        with self.settings(DATA_POINT_RETENTION_MONTHS=None):
+            call_command('manage_partitions', stdout=open(os.devnull, 'w'))
+        short, long = self.devices
+        # Retention counts back from the real current month.
+        self.assertEqual(short.data.count(), 0)
+        self.assertEqual(long.data.count(), 12)
+
+    def test_months(self):
+        """Test month arithmetic across year ends."""
+        month = partitions.month_start(self.now)
+        self.assertEqual(partitions.add_months(month, 1), timezone.make_aware(
+            timezone.datetime(2017, 1, 1), timezone.utc))
+        self.assertEqual(
+            partitions.add_months(month, -12),
+            timezone.make_aware(timezone.datetime(2015, 12, 1), timezone.utc))
+        self.assertEqual(
+            partitions.partition_name(month),
+            'tracker_device_datapoint_p2016_12')
+
+
+class RollupTestCase(TestCase):
+    """Test hourly and daily rollups are kept up to date."""
+
+    def setUp(self):
+        """Add a device and a helper making fixes a minute apart."""
+        self.user = User(username='roller')
+        self.user.save()
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        self.start = timezone.make_aware(
+            timezone.datetime(2016, 12, 1, 22, 30), timezone.utc)
+
+    def fixes(self, minutes):
+        """(time, lat, lng, elevation) a given number of minutes after the
+        start, heading north a thousandth of a degree a minute."""
+        return [
+            (self.start + timezone.timedelta(minutes=minute),
+             47.6 + minute / 1000, -122.3, 56.0)
+            for minute in minutes
+        ]
+
+    def snapshot(self):
+        """Every rollup field for the device, hours then days."""
+        fields = [
+            'start', 'point_count', 'min_lat', 'max_lat', 'min_lng',
+            'max_lng', 'first_time', 'first_lat', 'first_lng',
+            'last_time', 'last_lat', 'last_lng',
+        ]
+        found = []
+        for model in (HourlyRollup, DailyRollup):
+            for rollup in model.objects.filter(
+                    device=self.device).order_by('start'):
+                found.append(tuple(
+                    [getattr(rollup, name) for name in fields] +
+                    [round(rollup.distance, 3)]))
+        return found
+
+    def test_device_locked_first(self):
+        """Test the device row is locked before its rollups are read, so
+        concurrent batches crossing an hour can't both start it."""
+        with CaptureQueriesContext(connection) as queries:
+            rollups.update(self.device.pk, self.fixes([0, 45]))
+        tables = [
+            'trackerdevice' if 'FROM "tracker_device_trackerdevice"' in sql
+            else 'hourlyrollup' if '"tracker_device_hourlyrollup"' in sql
+            else None
+            for sql in (query['sql'] for query in queries)
+        ]
+        self.assertEqual(
+            [table for table in tables if table][:2],
+            ['trackerdevice', 'hourlyrollup'])
+
+    def test_append(self):
+        """Test in order fixes extend the rollups across hours and days."""
+        save_points(self.device.pk, self.fixes(range(0, 40)))
+        save_points(self.device.pk, self.fixes(range(40, 120)))
+        hours = list(self.device.hourly_rollups.order_by('start'))
+        self.assertEqual(
+            [hour.point_count for hour in hours], [30, 60, 30])
+        self.assertEqual(hours[1].first_time, self.start + timezone.timedelta(
+            minutes=30))
+        self.assertAlmostEqual(hours[1].min_lat, 47.63)
+        self.assertAlmostEqual(hours[1].max_lat, 47.689)
+        days = list(self.device.daily_rollups.order_by('start'))
+        self.assertEqual([day.point_count for day in days], [90, 30])
+        self.assertAlmostEqual(
+            sum(day.distance for day in days),
+            sum(hour.distance for hour in hours))
+        # 119 legs of a thousandth of a degree of latitude, about 111 m.
+        self.assertAlmostEqual(
+            sum(day.distance for day in days) / 119, 111.2, places=1)
+
+    def test_late_point(self):
+        """Test a late fix rebuilds its hour and the next to match a full
+        rebuild."""
+        save_points(self.device.pk, self.fixes(range(0, 120, 2)))
+        save_points(self.device.pk, self.fixes([29, 45]))
+        incremental = self.snapshot()
+        self.assertEqual(rollups.rebuild_device(self.device.pk, 7), (3, 2))
+        self.assertEqual(self.snapshot(), incremental)
+        self.assertEqual(
+            sum(hour[1] for hour in incremental[:3]), 62)
+
+    def test_rebuild_locks_device_first(self):
+        """Test a rebuild locks the device row before replacing its
+        rollups, as update does."""
+        save_points(self.device.pk, self.fixes(range(10)))
+        with CaptureQueriesContext(connection) as queries:
+            rollups.rebuild_device(self.device.pk)
+        sql = [query['sql'] for query in queries]
+        self.assertIn('FROM "tracker_device_trackerdevice"', sql[0])
+        self.assertTrue(sql[1].startswith('DELETE'))
+
+    def test_update_waiting_for_rebuild(self):
+        """Test ingest that waited on a rebuild's lock adds to the rebuilt
+        rollups, matching a full rebuild."""
+        save_points(self.device.pk, self.fixes(range(0, 60)))
+        rollups.rebuild_device(self.device.pk)
+        save_points(self.device.pk, self.fixes(range(30, 120, 3)))
+        incremental = self.snapshot()
+        rollups.rebuild_device(self.device.pk)
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_duplicates_ignored(self):
+        """Test resent fixes don't count twice."""
+        save_points(self.device.pk, self.fixes(range(10)))
+        save_points(self.device.pk, self.fixes(range(10)))
+        self.assertEqual(
+            self.device.hourly_rollups.get().point_count, 10)
+
+    def test_backfill_command(self):
+        """Test the command builds rollups for existing points."""
+        for time, lat, lng, elevation in self.fixes(range(0, 90, 3)):
+            DataPoint(
+                device=self.device, time=time, lat=lat, lng=lng,
+                elevation=elevation,
+            ).save()
+        self.assertFalse(self.device.hourly_rollups.exists())
+        call_command(
+            'backfill_rollups', '--chunk-size', '4',
+            stdout=open(os.devnull, 'w'))
+        self.assertEqual(
+            [hour.point_count
+             for hour in self.device.hourly_rollups.order_by('start')],
+            [10, 20])
+        self.assertEqual(self.device.daily_rollups.get().point_count, 30)
+
+    def test_device_page_activity(self):
+        """Test the device page summarizes recent days from rollups."""
+        self.start = timezone.now() - timezone.timedelta(hours=1)
+        save_points(self.device.pk, self.fixes(range(5)))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse(
+            'detail_device', kwargs={'pk': self.device.pk}))
+        self.assertEqual(response.context['activity_points'], 5)
+        self.assertGreater(response.context['activity_km'], 0.4)
+
+
+class RouteTrackTestCase(TestCase):
+    """Test routes keep a compressed track of their points."""
+
+    def setUp(self):
+        """Add a device with a point a minute and a route over some."""
+        self.user = User(username='tracker')
+        self.user.save()
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        self.start = timezone.make_aware(
+            timezone.datetime(2016, 12, 1, 12), timezone.utc)
+        save_points(self.device.pk, [
+            (self.minute(minute), 47.6 + minute / 10000,
+             -122.3 - minute / 10000, 56.25)
+            for minute in range(60)
+        ])
+        self.route = Route(
+            device=self.device, start=self.minute(10), end=self.minute(19))
+        self.route.save()
+
+    def minute(self, minute):
+        """The time a number of minutes after the start."""
+        return self.start + timezone.timedelta(minutes=minute)
+
+    def reload(self):
+        """Fetch the route again."""
+        return Route.objects.get(pk=self.route.pk)
+
+    def test_round_trip(self):
+        """Test encoding keeps times exactly and coordinates to 1e-7."""
+        points = [
+            (self.minute(0) + timezone.timedelta(microseconds=5),
+             47.1234567, -122.7654321, 12.34),
+            (self.minute(1), -33.8688197, 151.2092955, -3.5),
+        ]
+        track = tracks.encode(self.minute(0), None, points)
+        window, found = tracks.decode(track)
+        self.assertEqual(window, (
+            tracks._micros(self.minute(0)), tracks.OPEN))
+        self.assertEqual([tuple(point) for point in found], points)
+
+    def test_built_once(self):
+        """Test the first read stores the track and later reads decode it
+        without touching data points."""
+        found = tracks.points(self.route)
+        self.assertEqual(
+            [point.time for point in found],
+            [self.minute(minute) for minute in range(10, 20)])
+        self.assertAlmostEqual(found[0].lat, 47.601)
+        route = self.reload()
+        self.assertIsNotNone(route.track)
+        with self.assertNumQueries(0):
+            self.assertEqual(tracks.points(route), found)
+
+    def test_new_point_in_window(self):
+        """Test a point arriving inside the window rebuilds the track."""
+        tracks.points(self.route)
+        save_points(self.device.pk, [
+            (self.minute(15) + timezone.timedelta(seconds=30), 1, 2, 3)])
+        route = self.reload()
+        self.assertIsNone(route.track)
+        self.assertEqual(len(tracks.points(route)), 11)
+
+    def test_new_point_outside_window(self):
+        """Test points outside the window leave the track alone."""
+        tracks.points(self.route)
+        save_points(self.device.pk, [(self.minute(90), 1, 2, 3)])
+        self.assertIsNotNone(self.reload().track)
+
+    def test_window_edited(self):
+        """Test a changed start or end rebuilds the track."""
+        tracks.points(self.route)
+        route = self.reload()
+        route.end = self.minute(29)
+        route.save()
+        route = self.reload()
+        self.assertEqual(len(tracks.points(route)), 20)
+
+    def test_stale_rebuild_not_stored(self):
+        """Test a rebuild racing new points doesn't store its track."""
+        route = self.reload()
+        tracks.invalidate(self.device.pk, self.minute(0), self.minute(59))
+        tracks.rebuild(route)
+        self.assertIsNone(self.reload().track)
+
+    def test_long_route_not_stored(self):
+        """Test a route over MAX_TRACK_POINTS keeps no track and is
+        streamed from its points."""
+        with mock.patch.object(tracks, 'MAX_TRACK_POINTS', 5):
+            found = tracks.columns(self.route)
+        self.assertEqual(len(found.time), 10)
+        self.assertIsNone(self.reload().track)
+        streamed = tracks.stream(self.route)
+        self.assertNotIsInstance(streamed, list)
+        self.assertEqual(
+            [point.time for point in streamed],
+            [self.minute(minute) for minute in range(10, 20)])
+
+    def test_stream_decodes_in_chunks(self):
+        """Test a stored track is streamed without reading data points,
+        made into TrackPoints a chunk at a time."""
+        tracks.points(self.route)
+        route = self.reload()
+        with self.assertNumQueries(0):
+            streamed = list(tracks.stream(route))
+        self.assertEqual(streamed, tracks.points(route))
+        found = tracks.columns(route)
+        self.assertEqual(list(tracks.rows(found, chunk_size=3)), streamed)
+
+    def test_save_keeps_track(self):
+        """Test editing a route doesn't write back the track it loaded."""
+        route = self.reload()
+        tracks.points(self.route)
+        route.name = 'Renamed'
+        route.save()
+        route = self.reload()
+        self.assertEqual(route.name, 'Renamed')
+        self.assertIsNotNone(route.track)
+
+    def test_detail_view(self):
+        """Test the route page is served from the track."""
+        tracks.points(self.route)
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(
+                'detail_route', kwargs={'pk': self.route.pk}))
+        self.assertFalse(any(
+            'tracker_device_datapoint' in query['sql']
+            for query in queries.captured_queries))
+        latest = response.context['data_ten']
+        self.assertEqual(
+            [point.time for point in latest],
+            [self.minute(minute) for minute in range(19, 9, -1)])
+        self.assertNotIn('data', response.context)
+        self.assertContains(response, '47.601')
+
+
+class DevicePointStatsTestCase(TestCase):
+    """Test devices keep their point count and last fix."""
+
+    def setUp(self):
+        """Add a device and some fixes a minute apart."""
+        self.user = User(username='counted')
+        self.user.save()
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        self.start = timezone.make_aware(
+            timezone.datetime(2016, 12, 1, 12), timezone.utc)
+        self.fixes = [
+            (self.start + timezone.timedelta(minutes=minute),
+             47.6 + minute, -122.3 - minute, 56.0)
+            for minute in range(10)
+        ]
+
+    def reload(self):
+        """Fetch the device again."""
+        return TrackerDevice.objects.get(pk=self.device.pk)
+
+    def test_ingest_counts(self):
+        """Test saved points update the count and last fix."""
+        save_points(self.device.pk, self.fixes[:5])
+        save_points(self.device.pk, self.fixes)
+        device = self.reload()
+        self.assertEqual(device.point_count, 10)
+        self.assertEqual(device.last_time, self.fixes[-1][0])
+        self.assertEqual(
+            (device.last_lat, device.last_lng), self.fixes[-1][1:3])
+        self.assertIsNotNone(device.last_received)
+
+    def test_older_batch_keeps_last_fix(self):
+        """Test a batch older than the last fix only adds to the count."""
+        save_points(self.device.pk, self.fixes[5:])
+        save_points(self.device.pk, self.fixes[:5])
+        device = self.reload()
+        self.assertEqual(device.point_count, 10)
+        self.assertEqual(device.last_time, self.fixes[-1][0])
+
+    def test_edit_keeps_counts(self):
+        """Test saving a loaded device doesn't write back its old counts."""
+        device = self.reload()
+        save_points(self.device.pk, self.fixes)
+        device.title = 'Renamed'
+        device.save()
+        device = self.reload()
+        self.assertEqual(device.title, 'Renamed')
+        self.assertEqual(device.point_count, 10)
+
+    def test_reconcile(self):
+        """Test the command repairs points saved around save_points."""
+        save_points(self.device.pk, self.fixes[:5])
+        for time, lat, lng, elevation in self.fixes[5:]:
+            DataPoint(
+                device=self.device, time=time, lat=lat, lng=lng,
+                elevation=elevation,
+            ).save()
+        call_command('reconcile_devices', stdout=open(os.devnull, 'w'))
+        device = self.reload()
+        self.assertEqual(device.point_count, 10)
+        self.assertEqual(device.last_time, self.fixes[-1][0])
+        self.assertEqual(device.last_lat, self.fixes[-1][1])
+
+    def test_reconcile_empty_device(self):
+        """Test a device with no points is reset."""
+        TrackerDevice.objects.filter(pk=self.device.pk).update(
+            point_count=3, last_time=self.start)
+        call_command(
+            'reconcile_devices', str(self.device.pk),
+            stdout=open(os.devnull, 'w'))
+        device = self.reload()
+        self.assertEqual(device.point_count, 0)
+        self.assertIsNone(device.last_time)
+
+    def test_retention_discounts(self):
+        """Test expired points come off the count."""
+        save_points(self.device.pk, self.fixes)
+        retention.expire_points(self.user.pk, self.fixes[4][0])
+        self.assertEqual(self.reload().point_count, 6)
+
+
+class ArchiveTestCase(TestCase):
+    """Test moving old points into archive files and reading them back."""
+
+    def setUp(self):
+        """Point the archive at a temporary directory and add three months
+        of points every half hour, in small blocks."""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = self.settings(DATA_POINT_ARCHIVE_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        block_size = archive.BLOCK_SIZE
+        archive.BLOCK_SIZE = 100
+        self.addCleanup(setattr, archive, 'BLOCK_SIZE', block_size)
+        self.user = User(username='archivist')
+        self.user.save()
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        start = timezone.make_aware(
+            timezone.datetime(2016, 1, 1, 0, 0, 0, 250), timezone.utc)
+        self.points = [
+            (start + timezone.timedelta(minutes=30 * i),
+             47.6 + i / 3.0 * 1e-5, -122.3 - i / 7.0 * 1e-5, i * 0.1)
+            for i in range(48 * 91)
+        ]
+        save_points(self.device.pk, self.points)
+        self.january = timezone.make_aware(
+            timezone.datetime(2016, 1, 1), timezone.utc)
+
+    def archive_all(self):
+        """Archive every month of 2016."""
+        call_command(
+            'archive_points', '--months', '0', stdout=open(os.devnull, 'w'))
+
+    def test_round_trip(self):
+        """Test archived points read back exactly, merged with stored
+        ones."""
+        self.assertEqual(
+            archive.archive_month(self.device.pk, self.january), 48 * 31)
+        self.assertFalse(self.device.data.filter(
+            time__lt=timezone.make_aware(
+                timezone.datetime(2016, 2, 1), timezone.utc)).exists())
+        self.assertEqual(
+            list(archive.window(self.device.pk)), self.points)
+
+    def test_window(self):
+        """Test a range across archived and stored months."""
+        archive.archive_month(self.device.pk, self.january)
+        start, end = self.points[1400][0], self.points[1600][0]
+        self.assertEqual(
+            list(archive.window(self.device.pk, start, end)),
+            self.points[1400:1601])
+
+    def test_command(self):
+        """Test the command archives every old month and pages still show
+        the points."""
+        self.archive_all()
+        self.assertFalse(self.device.data.exists())
+        self.assertEqual(ArchivedMonth.objects.count(), 3)
+        self.assertEqual(
+            archive.most_recent(self.device.pk, 10), self.points[:-11:-1])
+        route = Route(
+            device=self.device,
+            start=self.points[100][0],
+            end=self.points[2000][0],
+        )
+        route.save()
+        self.assertEqual(len(tracks.points(route)), 1901)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse(
+            'detail_device', kwargs={'pk': self.device.pk}))
+        self.assertEqual(response.context['data'][0].time,
+                         self.points[-1][0])
+
+    def test_late_point(self):
+        """Test a late point is read alongside the archive and merged into
+        it on the next run."""
+        self.archive_all()
+        late = (self.points[0][0] + timezone.timedelta(minutes=1), 1, 2, 3)
+        save_points(self.device.pk, [late])
+        found = list(archive.window(
+            self.device.pk, self.points[0][0], self.points[2][0]))
+        self.assertEqual(found, [self.points[0], late] + self.points[1:3])
+        self.archive_all()
+        self.assertFalse(self.device.data.exists())
+        self.assertEqual(ArchivedMonth.objects.get(
+            month=self.january).point_count, 48 * 31 + 1)
+
+    def test_rollups_rebuilt_from_archive(self):
+        """Test rebuilding rollups reads archived points."""
+        hours = list(self.device.hourly_rollups.order_by(
+            'start').values_list('start', 'point_count'))
+        self.archive_all()
+        rollups.rebuild_device(self.device.pk)
+        self.assertEqual(list(self.device.hourly_rollups.order_by(
+            'start').values_list('start', 'point_count')), hours)
+
+    def test_retention(self):
+        """Test retention removes archived months and their files."""
+        self.archive_all()
+        cutoff = timezone.make_aware(
+            timezone.datetime(2016, 2, 1), timezone.utc)
+        self.assertEqual(
+            retention.expire_points(self.user.pk, cutoff), 48 * 31)
+        self.assertEqual(ArchivedMonth.objects.count(), 2)
+        self.assertEqual(
+            TrackerDevice.objects.get(pk=self.device.pk).point_count,
+            48 * 60)
+
+    def test_file_removed(self):
+        """Test deleting a month's record removes its file."""
+        archive.archive_month(self.device.pk, self.january)
+        month = ArchivedMonth.objects.get()
+        path = os.path.join(self.directory, month.path)
+        self.assertTrue(os.path.exists(path))
+        # Tests never commit, so run the removal as if they had.
+        with mock.patch.object(
+                archive.transaction, 'on_commit', lambda remove: remove()):
+            month.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_reconcile_counts_archive(self):
+        """Test reconciling counts archived points."""
+        self.archive_all()
+        TrackerDevice.objects.filter(pk=self.device.pk).update(point_count=0)
+        call_command('reconcile_devices', stdout=open(os.devnull, 'w'))
+        device = TrackerDevice.objects.get(pk=self.device.pk)
+        self.assertEqual(device.point_count, len(self.points))
+        self.assertEqual(device.last_time, self.points[-1][0])
+
+
+class MirrorTestCase(TestCase):
+    """Test the memory mapped mirror of data points."""
+
+    def setUp(self):
+        """Mirror into a temporary directory, running commit hooks at
+        once since tests never commit."""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = self.settings(DATA_POINT_MIRROR_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        on_commit = mock.patch(
+            'django.db.transaction.on_commit', lambda hook: hook())
+        on_commit.start()
+        self.addCleanup(on_commit.stop)
+        self.user = User(username='mirrored')
+        self.user.save()
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        start = timezone.make_aware(
+            timezone.datetime(2016, 12, 1, 12, 0, 0, 500), timezone.utc)
+        self.points = [
+            (start + timezone.timedelta(minutes=i),
+             47.6 + i / 3.0 * 1e-5, -122.3, 56.0 + i)
+            for i in range(100)
+        ]
+
+    def times(self, records):
+        """Records' times as datetimes."""
+        return [from_micros(time) for time in records['time']]
+
+    def test_window(self):
+        """Test a range is a view of the mapped file."""
+        save_points(self.device.pk, self.points[:60])
+        save_points(self.device.pk, self.points[60:])
+        records = mirror.window(
+            self.device.pk, self.points[10][0], self.points[20][0])
+        self.assertIsInstance(records, np.memmap)
+        self.assertEqual(
+            self.times(records), [point[0] for point in self.points[10:21]])
+        self.assertEqual(list(records['lat']),
+                         [point[1] for point in self.points[10:21]])
+        self.assertIsNone(mirror.verify(self.device.pk))
+
+    def test_late_points(self):
+        """Test points older than the file's last are read in order and
+        merged back by a rebuild."""
+        save_points(self.device.pk, self.points[50:])
+        save_points(self.device.pk, self.points[:50])
+        records = mirror.window(self.device.pk)
+        self.assertEqual(
+            self.times(records), [point[0] for point in self.points])
+        self.assertIsNone(mirror.verify(self.device.pk))
+        self.assertEqual(mirror.rebuild(self.device.pk), 100)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, '{}.late'.format(self.device.pk))))
+        self.assertIsInstance(mirror.window(self.device.pk), np.memmap)
+
+    def test_check_and_rebuild(self):
+        """Test the command finds and repairs points the mirror missed."""
+        save_points(self.device.pk, self.points[:50])
+        time, lat, lng, elevation = self.points[50]
+        DataPoint(
+            device=self.device, time=time, lat=lat, lng=lng,
+            elevation=elevation,
+        ).save()
+        self.assertEqual(mirror.verify(self.device.pk), time)
+        with self.assertRaises(CommandError):
+            call_command(
+                'mirror_points', '--check', stdout=open(os.devnull, 'w'))
+        call_command('mirror_points', stdout=open(os.devnull, 'w'))
+        call_command(
+            'mirror_points', '--check', stdout=open(os.devnull, 'w'))
+
+    def test_route_track(self):
+        """Test a route in progress is read from the mirror without being
+        stored."""
+        save_points(self.device.pk, self.points)
+        route = Route(device=self.device, start=self.points[90][0])
+        route.save()
+        with CaptureQueriesContext(connection) as queries:
+            found = tracks.points(route)
+        self.assertFalse(any(
+            'tracker_device_datapoint' in query['sql']
+            for query in queries.captured_queries))
+        self.assertEqual(
+            [point.time for point in found],
+            [point[0] for point in self.points[90:]])
+        self.assertIsNone(Route.objects.get(pk=route.pk).track)
+
+    def test_route_columns_are_views(self):
+        """Test a route in progress is read as views of the mapped file,
+        which the route line simplifies without copying into rows."""
+        save_points(self.device.pk, self.points)
+        route = Route(device=self.device, start=self.points[90][0])
+        route.save()
+        found = tracks.columns(route)
+        self.assertIsInstance(found.lat, np.memmap)
+        self.assertEqual(len(found.time), 10)
+        cache.clear()
+        with mock.patch('tracker_device.tracks.rows') as rows:
+            line = simplify.route_line(route, 13)
+        self.assertFalse(rows.called)
+        self.assertEqual(line['points'], 10)
+
+    def test_stored_track_from_database(self):
+        """Test a stored track comes from the database, even when the
+        mirror is missing points."""
+        save_points(self.device.pk, self.points)
+        mirror._remove(mirror._path(self.device.pk, 'pts'))
+        route = Route(
+            device=self.device, start=self.points[10][0],
+            end=self.points[19][0])
+        route.save()
+        found = tracks.points(route)
+        self.assertEqual(
+            [point.time for point in found],
+            [point[0] for point in self.points[10:20]])
+        self.assertIsNotNone(Route.objects.get(pk=route.pk).track)
+
+    def test_retention(self):
+        """Test expired points leave the mirror."""
+        save_points(self.device.pk, self.points)
+        retention.expire_points(self.user.pk, self.points[30][0])
+        self.assertEqual(len(mirror.window(self.device.pk)), 70)
+        self.assertIsNone(mirror.verify(self.device.pk))
+
+    def test_device_deleted(self):
+        """Test deleting a device removes its files."""
+        save_points(self.device.pk, self.points)
+        self.device.delete()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_disabled(self):
+        """Test nothing is written without a mirror directory."""
+        with self.settings(DATA_POINT_MIRROR_DIR=''):
+            save_points(self.device.pk, self.points)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class GeohashTestCase(TestCase):
+    """Test integer geohashes, their ranges and the backfill."""
+
+    def setUp(self):
+        """Add a device."""
+        user = User(username='geohash')
+        user.save()
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+
+    def test_encode(self):
+        """Test a hash's base32 form is the usual geohash."""
+        value = geohash.encode(57.64911, 10.40744)
+        self.assertEqual(geohash.to_string(value, 11), 'u4pruydqqvj')
+
+    def test_cover(self):
+        """Test points inside a box fall in its ranges and far ones don't."""
+        ranges = geohash.cover(47.5, -122.5, 47.7, -122.2)
+        self.assertLessEqual(len(ranges), geohash.MAX_CELLS)
+
+        def covered(lat, lng):
+            value = geohash.encode(lat, lng)
+            return any(low <= value < high for low, high in ranges)
+        for lat, lng in [(47.5, -122.5), (47.6, -122.3), (47.7, -122.2)]:
+            self.assertTrue(covered(lat, lng))
+        self.assertFalse(covered(40.7, -74.0))
+
+    def test_cover_antimeridian(self):
+        """Test a box crossing the antimeridian covers both sides."""
+        ranges = geohash.cover(-20, 170, -10, -170)
+        for lng in (175, -175):
+            value = geohash.encode(-15, lng)
+            self.assertTrue(any(low <= value < high for low, high in ranges))
+
+    def test_ingest_sets_geohash(self):
+        """Test saved and ingested points get their geohash."""
+        DataPoint(
+            device=self.device, time=self.time, lat=47.6, lng=-122.3,
+            elevation=0,
+        ).save()
+        later = self.time + timezone.timedelta(minutes=1)
+        save_points(self.device.pk, [(later, 40.7, -74.0, 0)])
+        self.assertEqual(
+            list(self.device.data.order_by('time').values_list(
+                'geohash', flat=True)),
+            [geohash.encode(47.6, -122.3), geohash.encode(40.7, -74.0)])
+
+    def test_backfill(self):
+        """Test the command fills in missing geohashes a chunk at a time."""
+        for minute in range(5):
+            DataPoint(
+                device=self.device, lat=minute, lng=minute, elevation=0,
+                time=self.time + timezone.timedelta(minutes=minute),
+            ).save()
+        self.device.data.update(geohash=None)
+        call_command(
+            'backfill_geohashes', chunk_size=2, stdout=open(os.devnull, 'w'))
+        for point in self.device.data.all():
+            self.assertEqual(
+                point.geohash, geohash.encode(point.lat, point.lng))
+
+
+class AreaPointsViewTestCase(TestCase):
+    """Test querying points by bounding box."""
+
+    def setUp(self):
+        """Add two devices with points in Seattle and New York."""
+        user = User(username='area')
+        user.save()
+        self.client.force_login(user)
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+        self.devices = []
+        for offset in range(2):
+            device = TrackerDevice(user=user)
+            device.save()
+            self.devices.append(device)
+            save_points(device.pk, [
+                (self.time + timezone.timedelta(minutes=minute),
+                 lat + offset / 100.0, lng, 0)
+                for minute, (lat, lng) in enumerate([
+                    (47.6, -122.3), (47.61, -122.31), (40.7, -74.0)])
+            ])
+        other = TrackerDevice(user=User.objects.create(username='other'))
+        other.save()
+        save_points(other.pk, [(self.time, 47.6, -122.3, 0)])
+        self.url = reverse('area_points')
+        self.seattle = {
+            'south': 47.5, 'west': -122.5, 'north': 47.7, 'east': -122.2}
+
+    def test_points(self):
+        """Test only the user's points inside the box come back."""
+        response = self.client.get(self.url, self.seattle)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertFalse(body['truncated'])
+        self.assertEqual(
+            [(point['device'], point['lat']) for point in body['points']],
+            [(self.devices[0].pk, 47.6), (self.devices[0].pk, 47.61),
+             (self.devices[1].pk, 47.61), (self.devices[1].pk, 47.62)])
+        self.assertEqual(body['points'][0]['geohash'][:5], 'c23nb')
+
+    def test_time_device_and_limit(self):
+        """Test the time range, device and limit narrow the points."""
+        response = self.client.get(self.url, dict(
+            self.seattle, device=self.devices[1].pk, limit=1,
+            start='2016-01-01 00:01'))
+        body = response.json()
+        self.assertEqual(
+            [point['lat'] for point in body['points']], [47.62])
+        self.assertFalse(body['truncated'])
+        response = self.client.get(self.url, dict(self.seattle, limit=1))
+        self.assertTrue(response.json()['truncated'])
+
+    def test_devices(self):
+        """Test devices mode counts each device's points in the box."""
+        response = self.client.get(
+            self.url, dict(self.seattle, mode='devices'))
+        devices = response.json()['devices']
+        self.assertEqual(
+            [(device['device'], device['count']) for device in devices],
+            [(self.devices[0].pk, 2), (self.devices[1].pk, 2)])
+
+    def test_bad_query(self):
+        """Test a bad box or someone else's device is a 400."""
+        response = self.client.get(
+            self.url, dict(self.seattle, south=48))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('north', response.json()['errors'])
+        other = TrackerDevice.objects.get(user__username='other')
+        response = self.client.get(
+            self.url, dict(self.seattle, device=other.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_login_required(self):
+        """Test anonymous users are refused."""
+        self.client.logout()
+        response = self.client.get(self.url, self.seattle)
+        self.assertEqual(response.status_code, 403)
+
+
+@mock.patch('django.db.transaction.on_commit', lambda hook: hook())
+class GeofenceTestCase(TestCase):
+    """Test geofence evaluation on ingest and the fence index."""
+
+    def setUp(self):
+        """Add a device and a square fence around (47.6, -122.3)."""
+        geofences.fence_index.clear()
+        self.user = User(username='fences')
+        self.user.save()
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        self.fence = Geofence(
+            user=self.user, name='square', vertices=json.dumps([
+                [47.5, -122.4], [47.5, -122.2], [47.7, -122.2], [47.7, -122.4],
+            ]))
+        self.fence.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+
+    def tearDown(self):
+        """Leave an empty index for other tests."""
+        geofences.fence_index.clear()
+
+    def save(self, *positions, **kwargs):
+        """Save points a minute apart from a start minute."""
+        start = kwargs.get('start', 0)
+        return save_points(self.device.pk, [
+            (self.time + timezone.timedelta(minutes=start + minute),
+             lat, lng, 0)
+            for minute, (lat, lng) in enumerate(positions)
+        ])
+
+    def events(self):
+        """(fence name, kind, lat) of the device's events in time order."""
+        return [
+            (event.fence.name, event.kind, event.lat)
+            for event in self.device.geofence_events.order_by('time', 'kind')
+        ]
+
+    def test_contains(self):
+        """Test ray casting on a concave polygon."""
+        fence = Geofence(user=self.user, vertices=json.dumps([
+            [0, 0], [0, 4], [4, 4], [4, 3], [1, 3], [1, 0],
+        ]))
+        fence.save()
+        indexed = geofences.fence_index._fences[fence.pk]
+        lats = np.array([0.5, 3.5, 2.0, 5.0])
+        lngs = np.array([0.5, 3.5, 2.0, 0.5])
+        self.assertEqual(
+            geofences.contains([indexed], lats, lngs).tolist(),
+            [[True, True, False, False]])
+
+    def test_enter_and_exit_in_one_batch(self):
+        """Test each crossing within a batch is an event."""
+        self.save((47.0, -122.3), (47.6, -122.3), (47.6, -122.25),
+                  (48.0, -122.3))
+        self.assertEqual(self.events(), [
+            ('square', 'enter', 47.6), ('square', 'exit', 48.0)])
+        self.assertFalse(self.device.geofence_presences.exists())
+
+    def test_presence_across_batches(self):
+        """Test the device stays inside between batches."""
+        self.save((47.6, -122.3))
+        presence = GeofencePresence.objects.get(device=self.device)
+        self.assertEqual(presence.time, self.time)
+        self.save((47.61, -122.3), start=1)
+        self.assertEqual(self.events(), [('square', 'enter', 47.6)])
+        self.save((40.7, -74.0), start=2)
+        self.assertEqual(self.events(), [
+            ('square', 'enter', 47.6), ('square', 'exit', 40.7)])
+
+    def test_late_points_ignored(self):
+        """Test points older than the last fix cause no events."""
+        self.save((40.7, -74.0), start=10)
+        self.save((47.6, -122.3), start=5)
+        self.assertEqual(self.events(), [])
+
+    def test_device_fence(self):
+        """Test a fence for one device doesn't apply to others."""
+        other = TrackerDevice(user=self.user)
+        other.save()
+        self.fence.device = other
+        self.fence.save()
+        self.save((47.6, -122.3))
+        self.assertEqual(self.events(), [])
+
+    def test_fence_changes_reindexed(self):
+        """Test moving and deleting a fence update the index."""
+        self.fence.vertices = json.dumps([[0, 0], [0, 1], [1, 1], [1, 0]])
+        self.fence.save()
+        self.save((47.6, -122.3), (0.5, 0.5))
+        self.assertEqual(self.events(), [('square', 'enter', 0.5)])
+        self.fence.delete()
+        self.assertEqual(geofences.fence_index._fences, {})
+
+    def test_refresh_picks_up_other_processes(self):
+        """Test a refresh re-indexes fences changed without signals."""
+        Geofence.objects.filter(pk=self.fence.pk).update(
+            vertices=json.dumps([[0, 0], [0, 1], [1, 1], [1, 0]]),
+            updated=timezone.now())
+        other = Geofence(user=self.user, vertices='[[5, 5], [5, 6], [6, 6]]')
+        Geofence.objects.bulk_create([other])
+        geofences.fence_index.refresh()
+        indexed = geofences.fence_index._fences
+        self.assertEqual(len(indexed), 2)
+        self.assertEqual(indexed[self.fence.pk].box, (0, 0, 1, 1))
+        Geofence.objects.exclude(pk=self.fence.pk).delete()
+        geofences.fence_index.refresh()
+        self.assertEqual(list(indexed), [self.fence.pk])
+
+    def test_no_fences_no_queries(self):
+        """Test devices without fences cost no geofence queries."""
+        other = User.objects.create(username='nofences')
+        device = TrackerDevice.objects.create(user=other)
+        geofences.fence_index.near(device.pk, np.zeros(1), np.zeros(1))
+        with self.assertNumQueries(0):
+            geofences.evaluate(device.pk, [(self.time, 47.6, -122.3, 0)])
+
+    def test_clean(self):
+        """Test bad vertices and someone else's device are rejected."""
+        self.fence.vertices = '[[0, 0], [1, 1]]'
+        with self.assertRaises(ValidationError):
+            self.fence.full_clean()
+        self.fence.vertices = '[[0, 0], [0, 1], [1, 1]]'
+        self.fence.device = TrackerDevice.objects.create(
+            user=User.objects.create(username='stranger'))
+        with self.assertRaises(ValidationError):
+            self.fence.full_clean()
+
+
+class DevicePointsViewTestCase(TestCase):
+    """Test paging through a device's points with cursors."""
+
+    def setUp(self):
+        """Add a device with a point each minute for ten minutes."""
+        user = User(username='sync')
+        user.save()
+        self.client.force_login(user)
+        self.device = TrackerDevice(user=user)
+        self.device.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+        save_points(self.device.pk, [
+            (self.time + timezone.timedelta(minutes=minute), minute, 0, 0)
+            for minute in range(10)
+        ])
+        self.url = reverse('device_points', args=[self.device.pk])
+
+    def pages(self, **params):
+        """Follow cursors to the end, returning each page's lats."""
+        pages = []
+        while True:
+            body = self.client.get(self.url, params).json()
+            pages.append([point['lat'] for point in body['points']])
+            params['cursor'] = body['cursor']
+            if not body['more']:
+                return pages, body['cursor']
+
+    def test_history_in_pages(self):
+        """Test pages cover the history in time order, each once."""
+        pages, cursor = self.pages(limit=4)
+        self.assertEqual(pages, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        body = self.client.get(self.url, {'cursor': cursor}).json()
+        self.assertEqual(body, {'points': [], 'cursor': cursor,
+                                'more': False})
+
+    def test_page_queries(self):
+        """Test a page deep in the history is one keyset query."""
+        pages, cursor = self.pages(limit=8)
+        # Session, user, device and the page.
+        with self.assertNumQueries(4):
+            self.client.get(self.url, {'cursor': cursor, 'limit': 1})
+
+    def test_changes_since_last_sync(self):
+        """Test late points come after the cursor in received order."""
+        with self.settings(DATA_POINT_SYNC_DELAY=0):
+            pages, cursor = self.pages(order='received', limit=6)
+            self.assertEqual(pages, [list(range(6)), list(range(6, 10))])
+            save_points(self.device.pk, [
+                (self.time - timezone.timedelta(minutes=1), -1, 0, 0)])
+            body = self.client.get(self.url, {
+                'order': 'received', 'cursor': cursor}).json()
+        self.assertEqual([point['lat'] for point in body['points']], [-1])
+
+    def test_recent_points_held_back(self):
+        """Test points received within the sync delay aren't returned."""
+        with self.settings(DATA_POINT_SYNC_DELAY=60):
+            body = self.client.get(self.url, {'order': 'received'}).json()
+        self.assertEqual(body['points'], [])
+        self.assertIsNone(body['cursor'])
+
+    def test_bad_cursor(self):
+        """Test garbage and cursors of the other order are a 400."""
+        body = self.client.get(self.url, {'limit': 1}).json()
+        for params in [{'cursor': 'nonsense'},
+                       {'cursor': body['cursor'], 'order': 'received'}]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('cursor', response.json()['errors'])
+
+    def test_other_users_device(self):
+        """Test another user's device is not found."""
+        self.client.force_login(User.objects.create(username='stranger'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class TrackViewTestCase(TestCase):
+    """Test the streamed GeoJSON tracks behind the route and device maps."""
+
+    def setUp(self):
+        """Add a device with a point each hour for two days and a route
+        over the first six hours."""
+        self.user = User(username='geojson')
+        self.user.save()
+        self.client.force_login(self.user)
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+        save_points(self.device.pk, [
+            (self.time + timezone.timedelta(hours=hour), hour, -hour, 0)
+            for hour in range(48)
+        ])
+        self.route = Route(
+            device=self.device, start=self.time,
+            end=self.time + timezone.timedelta(hours=5))
+        self.route.save()
+
+    def features(self, response):
+        """Lat of each feature of a streamed FeatureCollection."""
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/geo+json')
+        body = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        collection = json.loads(body.decode('utf-8'))
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        return [
+            feature['geometry']['coordinates'][1]
+            for feature in collection['features']
+        ]
+
+    def test_route_track(self):
+        """Test the route track has the route's points, gzipped on
+        request."""
+        response = self.client.get(
+            reverse('route_track', args=[self.route.pk]),
+            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(self.features(response), list(range(6)))
+
+    def test_route_page_loads_track(self):
+        """Test the route page links the track instead of inlining it."""
+        response = self.client.get(
+            reverse('detail_route', args=[self.route.pk]))
+        self.assertContains(
+            response, reverse('route_track', args=[self.route.pk]))
+        self.assertContains(
+            response, reverse('route_line', args=[self.route.pk]))
+        # Only the map's center is written into the page.
+        self.assertContains(response, 'lat: ', count=1)
+        # The map draws the simplified line, not a marker per point.
+        self.assertNotContains(response, 'loadGeoJson')
+
+    def test_device_track_defaults_to_last_day(self):
+        """Test the device track covers the day up to the last fix."""
+        response = self.client.get(
+            reverse('device_track', args=[self.device.pk]))
+        self.assertEqual(self.features(response), list(range(23, 48)))
+
+    def test_device_track_range(self):
+        """Test start and end choose the device track's points."""
+        response = self.client.get(
+            reverse('device_track', args=[self.device.pk]),
+            {'start': '2016-01-01 10:00', 'end': '2016-01-01 12:00'})
+        self.assertEqual(self.features(response), [10, 11, 12])
+        response = self.client.get(
+            reverse('device_track', args=[self.device.pk]),
+            {'start': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_stream_chunks(self):
+        """Test chunked output joins into one valid collection."""
+        points = [
+            (self.time, lat, 0, 0) for lat in range(5)]
+        text = ''.join(geojson.stream(points, chunk_size=2))
+        self.assertEqual(len(json.loads(text)['features']), 5)
+        self.assertEqual(
+            json.loads(''.join(geojson.stream([])))['features'], [])
+
+    def test_other_users(self):
+        """Test tracks are only served to their owner."""
+        self.client.force_login(User.objects.create(username='stranger'))
+        for url in [reverse('route_track', args=[self.route.pk]),
+                    reverse('device_track', args=[self.device.pk])]:
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class SimplifyTestCase(TestCase):
+    """Test track simplification and the route line endpoint."""
+
+    def setUp(self):
+        """Add a route along a noisy east-west line with one detour."""
+        cache.clear()
+        self.user = User(username='simplify')
+        self.user.save()
+        self.client.force_login(self.user)
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+        noise = np.random.RandomState(0).normal(scale=1e-6, size=1000)
+        lats = 47.6 + noise
+        lats[500] += 0.01
+        save_points(self.device.pk, [
+            (self.time + timezone.timedelta(seconds=5 * i),
+             lats[i], -122.3 + i * 1e-4, 0)
+            for i in range(1000)
+        ])
+        self.route = Route(device=self.device, start=self.time)
+        self.route.save()
+        self.url = reverse('route_line', args=[self.route.pk])
+
+    def test_simplify_keeps_shape(self):
+        """Test the ends and the detour are kept and the noise dropped."""
+        points = tracks.points(self.route)
+        x, y = simplify.project(
+            np.array([point.lat for point in points]),
+            np.array([point.lng for point in points]))
+        kept = simplify.simplify(x, y, simplify.tolerance(13))
+        self.assertEqual(kept.tolist(), [0, 499, 500, 501, 999])
+        self.assertEqual(
+            simplify.tolerance(14), simplify.tolerance(13) / 2)
+
+    def test_short_tracks(self):
+        """Test tracks of fewer than three points are kept whole."""
+        for count in range(3):
+            self.assertEqual(
+                len(simplify.simplify(np.zeros(count), np.zeros(count), 1)),
+                count)
+
+    def test_encoded_polyline(self):
+        """Test encoding matches Google's documented example."""
+        encoded = simplify.encode_polyline(
+            np.array([38.5, 40.7, 43.252]),
+            np.array([-120.2, -120.95, -126.453]))
+        self.assertEqual(encoded, '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(
+            simplify.decode_polyline(encoded),
+            [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+
+    def test_route_line(self):
+        """Test the endpoint returns the line for a zoom."""
+        response = self.client.get(self.url, {'zoom': 13})
+        line = response.json()
+        self.assertEqual(
+            (line['points'], line['kept'], line['zoom']), (1000, 5, 13))
+        self.assertEqual(
+            len(simplify.decode_polyline(line['polyline'])), 5)
+        detailed = self.client.get(self.url, {'zoom': 22}).json()
+        self.assertGreater(detailed['kept'], 5)
+
+    def test_route_line_cached(self):
+        """Test a line is cached until a new point changes the track."""
+        self.client.get(self.url, {'zoom': 13})
+        route = Route.objects.get(pk=self.route.pk)
+        with self.assertNumQueries(0):
+            simplify.route_line(route, 13)
+        save_points(self.device.pk, [
+            (self.time + timezone.timedelta(hours=2), 47.7, -122.2, 0)])
+        line = self.client.get(self.url, {'zoom': 13}).json()
+        self.assertEqual(line['points'], 1001)
+
+    def test_bad_requests(self):
+        """Test a missing zoom is a 400 and other users are refused."""
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(
+            self.client.get(self.url, {'zoom': 30}).status_code, 400)
+        self.client.force_login(User.objects.create(username='stranger'))
+        self.assertEqual(
+            self.client.get(self.url, {'zoom': 13}).status_code, 403)
+
+
+@mock.patch('django.db.transaction.on_commit', lambda hook: hook())
+class TileTestCase(TestCase):
+    """Test clustered tiles and their invalidation."""
+
+    def setUp(self):
+        """Add two devices with points around Seattle and one in New
+        York."""
+        cache.clear()
+        user = User(username='tiles')
+        user.save()
+        self.client.force_login(user)
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+        self.devices = []
+        for offset in range(2):
+            device = TrackerDevice(user=user)
+            device.save()
+            self.devices.append(device)
+            save_points(device.pk, [
+                (self.time + timezone.timedelta(minutes=minute),
+                 lat + offset / 1000.0, lng, 0)
+                for minute, (lat, lng) in enumerate([
+                    (47.6, -122.3), (47.6001, -122.3001), (40.7, -74.0)])
+            ])
+        other = TrackerDevice(user=User.objects.create(username='other'))
+        other.save()
+        save_points(other.pk, [(self.time, 47.6, -122.3, 0)])
+        self.tile = self.tile_at(10, 47.6, -122.3)
+        self.url = reverse('tile', args=self.tile)
+
+    def tile_at(self, z, lat, lng):
+        """z, x and y of the tile at zoom z holding a point."""
+        x, y = simplify.project(np.array([lat]), np.array([lng]))
+        scale = 2 ** z / 256.0
+        return z, int(x[0] * scale), int(y[0] * scale)
+
+    def test_bounds(self):
+        """Test tile bounds match the Web Mercator tiling."""
+        self.assertEqual(tiles.bounds(0, 0, 0)[1:4:2], (-180, 180))
+        south, west, north, east = tiles.bounds(1, 1, 0)
+        self.assertAlmostEqual(south, 0)
+        self.assertAlmostEqual(north, simplify.MAX_LATITUDE)
+        self.assertEqual((west, east), (0, 180))
+
+    def test_clusters(self):
+        """Test nearby points of all the user's devices are clustered."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        clusters = response.json()['clusters']
+        self.assertEqual([cluster['count'] for cluster in clusters], [4])
+        self.assertAlmostEqual(clusters[0]['lat'], 47.60055)
+        world = self.client.get(reverse('tile', args=[0, 0, 0])).json()
+        self.assertEqual(
+            sorted(cluster['count'] for cluster in world['clusters']),
+            [2, 4])
+        detailed = self.client.get(
+            reverse('tile', args=self.tile_at(18, 47.6, -122.3))).json()
+        self.assertEqual(
+            [cluster['count'] for cluster in detailed['clusters']], [1, 1])
+
+    def test_device_and_time(self):
+        """Test the device and time range narrow the points."""
+        response = self.client.get(self.url, {
+            'device': self.devices[1].pk, 'start': '2016-01-01 00:01'})
+        clusters = response.json()['clusters']
+        self.assertEqual([cluster['count'] for cluster in clusters], [1])
+
+    def test_cached_until_devices_change(self):
+        """Test a tile is cached, reading only its devices' update times,
+        until one of its devices gets points."""
+        device_ids = [device.pk for device in self.devices]
+        tiles.clusters(device_ids, *self.tile)
+        with self.assertNumQueries(1):
+            tiles.clusters(device_ids, *self.tile)
+        save_points(self.devices[0].pk, [
+            (self.time + timezone.timedelta(hours=2), 47.6, -122.3, 0)])
+        clusters = self.client.get(self.url).json()['clusters']
+        self.assertEqual([cluster['count'] for cluster in clusters], [5])
+
+    def test_changed_elsewhere(self):
+        """Test points saved by another process, which can't reach this
+        process's cache, still make the tile miss."""
+        device_ids = [device.pk for device in self.devices]
+        tiles.clusters(device_ids, *self.tile)
+        with mock.patch('tracker_device.ingest.transaction.on_commit'):
+            save_points(self.devices[1].pk, [
+                (self.time + timezone.timedelta(hours=2), 47.6, -122.3, 0)])
+        clusters = tiles.clusters(device_ids, *self.tile)
+        self.assertEqual([cluster['count'] for cluster in clusters], [5])
+
+    def test_bad_requests(self):
+        """Test tiles off the map, other users' devices and anonymous users
+        are refused."""
+        self.assertEqual(self.client.get(
+            reverse('tile', args=[1, 2, 0])).status_code, 404)
+        self.assertEqual(self.client.get(
+            reverse('tile', args=[tiles.MAX_ZOOM + 1, 0, 0])).status_code,
+            404)
+        other = TrackerDevice.objects.get(user__username='other')
+        self.assertEqual(self.client.get(
+            self.url, {'device': other.pk}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_device_page(self):
+        """Test the device page marks points with clusters, not a marker
+        per point."""
+        response = self.client.get(
+            reverse('detail_device', args=[self.devices[0].pk]))
+        self.assertContains(response, reverse('tile', args=[0, 0, 0]))
+        self.assertNotContains(response, 'map.data')
+
+
+@mock.patch('django.db.transaction.on_commit', lambda hook: hook())
+class ConditionalGetTestCase(TestCase):
+    """Test device and route pages answer conditional requests."""
+
+    def setUp(self):
+        """Add a device with a point and a route."""
+        cache.clear()
+        self.user = User(username='conditional')
+        self.user.save()
+        self.client.force_login(self.user)
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+        save_points(self.device.pk, [(self.time, 47.6, -122.3, 0)])
+        self.route = Route(device=self.device, start=self.time)
+        self.route.save()
+        self.device_url = reverse('detail_device', args=[self.device.pk])
+        self.route_url = reverse('detail_route', args=[self.route.pk])
+
+    def revalidate(self, url, response, **extra):
+        """Ask for url again with the validators of an earlier response."""
+        return self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'],
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'], **extra)
+
+    def test_unchanged_pages(self):
+        """Test an unchanged page is a 304 without the page's queries."""
+        for url in (self.device_url, self.route_url):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('no-cache', response['Cache-Control'])
+            self.assertIn('private', response['Cache-Control'])
+            # The session, the user and the validators.
+            with self.assertNumQueries(3):
+                self.assertEqual(
+                    self.revalidate(url, response).status_code, 304)
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_new_points(self):
+        """Test a new point changes the device and route pages."""
+        device_page = self.client.get(self.device_url)
+        route_page = self.client.get(self.route_url)
+        save_points(self.device.pk, [
+            (self.time + timezone.timedelta(minutes=1), 47.7, -122.2, 0)])
+        self.assertEqual(
+            self.revalidate(self.device_url, device_page).status_code, 200)
+        self.assertEqual(
+            self.revalidate(self.route_url, route_page).status_code, 200)
+
+    def test_edits(self):
+        """Test editing or deleting a route changes its device's page and
+        editing either changes the route's."""
+        device_page = self.client.get(self.device_url)
+        route_page = self.client.get(self.route_url)
+        self.route.description = 'Redescribed'
+        self.route.save()
+        response = self.revalidate(self.route_url, route_page)
+        self.assertContains(response, 'Redescribed')
+        self.assertEqual(
+            self.revalidate(self.device_url, device_page).status_code, 200)
+        self.device.title = 'Retitled'
+        self.device.save()
+        self.assertContains(
+            self.revalidate(self.route_url, response), 'Retitled')
+        device_page = self.client.get(self.device_url)
+        self.route.delete()
+        self.assertEqual(
+            self.revalidate(self.device_url, device_page).status_code, 200)
+
+    def test_data_endpoints(self):
+        """Test the tracks and route line revalidate, gzipped or not."""
+        urls = [
+            reverse('route_track', args=[self.route.pk]),
+            reverse('device_track', args=[self.device.pk]),
+            reverse('route_line', args=[self.route.pk]) + '?zoom=13',
+        ]
+        for url in urls:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.revalidate(
+                url, response, HTTP_ACCEPT_ENCODING='gzip').status_code, 304)
+
+    def test_other_users(self):
+        """Test validators don't let other users past the ownership
+        checks."""
+        response = self.client.get(self.device_url)
+        self.client.force_login(User.objects.create(username='stranger'))
+        self.assertEqual(
+            self.revalidate(self.device_url, response).status_code, 403)
+        self.client.logout()
+        self.assertEqual(
+            self.revalidate(self.device_url, response).status_code, 302)
+
+
+@mock.patch('django.db.transaction.on_commit', lambda hook: hook())
+class PageCacheTestCase(TestCase):
+    """Test the device and route pages' cached data."""
+
+    def setUp(self):
+        """Add a device with points and a route."""
+        cache.clear()
+        self.user = User(username='pages')
+        self.user.save()
+        self.client.force_login(self.user)
+        self.device = TrackerDevice(user=self.user)
+        self.device.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+        save_points(self.device.pk, [
+            (self.time + timezone.timedelta(minutes=i), 47.6 + i / 1000.0,
+             -122.3, 0)
+            for i in range(20)
+        ])
+        self.route = Route(device=self.device, start=self.time)
+        self.route.save()
+        self.device_url = reverse('detail_device', args=[self.device.pk])
+        self.route_url = reverse('detail_route', args=[self.route.pk])
+
+    def test_get_or_build(self):
+        """Test a value is built once and then read from the cache."""
+        build = mock.Mock(return_value=[1])
+        self.assertEqual(page_cache.get_or_build('key', build), [1])
+        self.assertEqual(page_cache.get_or_build('key', build), [1])
+        self.assertEqual(build.call_count, 1)
+
+    def test_waits_for_lock_holder(self):
+        """Test a worker waits for the one rebuilding an entry."""
+        page_cache.page_cache().add('key:lock', True)
+        build = mock.Mock(return_value=[2])
+
+        def sleep(seconds):
+            page_cache.page_cache().set('key', [1])
+        self.assertEqual(
+            page_cache.get_or_build('key', build, sleep=sleep), [1])
+        self.assertFalse(build.called)
+
+    def test_abandoned_lock(self):
+        """Test a lock nobody releases holds others up only until the lock
+        timeout."""
+        page_cache.page_cache().add('key:lock', True)
+        now = [0]
+
+        def sleep(seconds):
+            now[0] += seconds
+        value = page_cache.get_or_build(
+            'key', lambda: [2], clock=lambda: now[0], sleep=sleep)
+        self.assertEqual(value, [2])
+        self.assertGreaterEqual(now[0], page_cache.LOCK_TIMEOUT)
+
+    def test_device_page(self):
+        """Test the device page's queries are cached until a new point."""
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.device_url)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(self.device_url)
+        self.assertLess(len(second), len(first))
+        self.assertEqual(response.context['data'][0].lat, 47.619)
+        save_points(self.device.pk, [
+            (self.time + timezone.timedelta(hours=1), 47.7, -122.3, 0)])
+        response = self.client.get(self.device_url)
+        self.assertEqual(response.context['data'][0].lat, 47.7)
+
+    def test_route_page(self):
+        """Test the route page doesn't decode its track when cached."""
+        self.client.get(self.route_url)
+        with mock.patch('tracker_device.tracks.points') as points:
+            response = self.client.get(self.route_url)
+        self.assertFalse(points.called)
+        self.assertEqual(response.context['data_ten'][0].lat, 47.619)
+        self.assertContains(response, 'lat: 47.6,')
+        self.route.end = self.time + timezone.timedelta(minutes=5)
+        self.route.save()
+        response = self.client.get(self.route_url)
+        self.assertEqual(response.context['data_ten'][0].lat, 47.605)
+
+
+class ExportTestCase(TestCase):
+    """Test CSV, GPX and KML exports of routes and devices."""
+
+    def setUp(self):
+        """Add a device with points, a route over some of them and a point
+        archived in an earlier month."""
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        self.user = User(username='export')
+        self.user.save()
+        self.client.force_login(self.user)
+        self.device = TrackerDevice(user=self.user, title='Bike')
+        self.device.save()
+        self.time = timezone.make_aware(timezone.datetime(2016, 1, 1))
+        save_points(self.device.pk, [
+            (self.time + timezone.timedelta(minutes=i), 47.6 + i / 1000.0,
+             -122.3, 10.5)
+            for i in range(5)
+        ])
+        self.route = Route(
+            device=self.device, name='Commute & back', start=self.time,
+            end=self.time + timezone.timedelta(minutes=2))
+        self.route.save()
+
+    def get(self, name, pk, format, **params):
+        """The text of an export."""
+        response = self.client.get(reverse(name, args=[pk, format]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('.{}"'.format(format), response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        """Test a route's CSV has a header and its window's points."""
+        text = self.get('route_export', self.route.pk, 'csv')
+        rows = list(csv.reader(io.StringIO(text)))
+        self.assertEqual(rows[0], ['time', 'lat', 'lng', 'elevation'])
+        self.assertEqual(
+            rows[1], [self.time.isoformat(), '47.6', '-122.3', '10.5'])
+        self.assertEqual(len(rows), 4)
+
+    def test_gpx(self):
+        """Test a GPX export parses with a point per fix."""
+        text = self.get('route_export', self.route.pk, 'gpx')
+        root = ElementTree.fromstring(text.encode('utf-8'))
+        namespace = '{http://www.topografix.com/GPX/1/1}'
+        self.assertEqual(
+            root.find('{0}trk/{0}name'.format(namespace)).text,
+            'Commute & back')
+        points = root.findall('.//{}trkpt'.format(namespace))
+        self.assertEqual(len(points), 3)
+        self.assertAlmostEqual(float(points[2].get('lat')), 47.602)
+        self.assertEqual(
+            points[2].find(namespace + 'time').text,
+            (self.time + timezone.timedelta(minutes=2)).isoformat())
+
+    def test_kml(self):
+        """Test a device's KML export covers its range."""
+        text = self.get(
+            'device_export', self.device.pk, 'kml',
+            start='2016-01-01 00:03')
+        root = ElementTree.fromstring(text.encode('utf-8'))
+        coordinates = root.find(
+            './/{http://www.opengis.net/kml/2.2}coordinates').text.split()
+        self.assertEqual(coordinates, ['-122.3,47.603,10.5',
+                                       '-122.3,47.604,10.5'])
+
+    def test_chunks_and_gzip(self):
+        """Test exports stream in chunks and are gzipped on request."""
+        chunks = list(export.csv_stream(
+            [(self.time, 1.0, 2.0, 3.0)] * 5, chunk_size=2))
+        self.assertEqual(len(chunks), 4)
+        response = self.client.get(
+            reverse('device_export', args=[self.device.pk, 'gpx']),
+            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        text = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(text.count(b'<trkpt'), 5)
+
+    def test_route_from_track(self):
+        """Test a finished route is exported from its stored track, and a
+        route in progress from its points."""
+        tracks.points(self.route)
+        with CaptureQueriesContext(connection) as queries:
+            text = self.get('route_export', self.route.pk, 'csv')
+        self.assertFalse(any(
+            'tracker_device_datapoint' in query['sql']
+            for query in queries.captured_queries))
+        self.assertEqual(len(text.splitlines()), 4)
+        Route.objects.filter(pk=self.route.pk).update(end=None)
+        text = self.get('route_export', self.route.pk, 'csv')
+        self.assertEqual(len(text.splitlines()), 6)
+
+    def test_route_gzip_and_not_modified(self):
+        """Test a route export is gzipped on request and answers 304 while
+        the route is unchanged."""
+        url = reverse('route_export', args=[self.route.pk, 'gpx'])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        text = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(text.count(b'<trkpt'), 3)
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_archived_points(self):
+        """Test a device export includes archived points."""
+        with self.settings(DATA_POINT_ARCHIVE_DIR=self.archive_dir):
+            archive.archive_month(self.device.pk, self.time)
+            text = self.get('device_export', self.device.pk, 'csv')
+        self.assertEqual(DataPoint.objects.count(), 0)
+        self.assertEqual(len(text.splitlines()), 6)
+
+    def test_other_users(self):
+        """Test other users can't export a route or device."""
+        self.client.force_login(User.objects.create(username='stranger'))
+        for name, pk in (('route_export', self.route.pk),
+                         ('device_export', self.device.pk)):
+            response = self.client.get(reverse(name, args=[pk, 'csv']))
+            self.assertEqual(response.status_code, 403)
+
+
+class TimeutilTestCase(TestCase):
+    """Test times as microseconds since the epoch."""
+
+    def test_round_trip(self):
+        """Test a time survives conversion to microseconds and back."""
+        time = timezone.make_aware(
+            timezone.datetime(2016, 12, 1, 12, 0, 0, 500), timezone.utc)
+        self.assertEqual(to_micros(EPOCH), 0)
+        self.assertEqual(to_micros(time), 1480593600000500)
+        self.assertEqual(from_micros(to_micros(time)), time)
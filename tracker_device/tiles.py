@@ -0,0 +1,88 @@
+"""Clustered map tiles of data points.
+
+A tile is addressed the way map tiles are, z/x/y in Web Mercator. Its
+points are grouped by geohash cell, about GRID cells across the tile, by
+the database: the query scans the geohash ranges covering the tile and
+returns a count and mean position per cell, not the points.
+
+Finished tiles are kept in the Django cache under a key holding the
+`updated` time of each device they show, which ingest, retention and
+archiving move in the database. Points saved by any process therefore
+make the next request for the device's tiles miss, whatever cache
+backend each process has; entries no longer asked for age out after
+CACHE_TIMEOUT."""
+import hashlib
+import math
+
+from django.core.cache import cache
+from django.db.models import (
+    Avg,
+    BigIntegerField,
+    Count,
+    ExpressionWrapper,
+    F,
+    Q,
+    Value,
+)
+
+from tracker_device import geohash
+from tracker_device.models import DataPoint, TrackerDevice
+
+MAX_ZOOM = 18
+GRID = 16
+CACHE_TIMEOUT = 60 * 60
+
+
+def bounds(z, x, y):
+    """(south, west, north, east) of a tile."""
+    size = 2 ** z
+    west = x / size * 360 - 180
+    east = (x + 1) / size * 360 - 180
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / size))))
+    south = math.degrees(
+        math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / size))))
+    return south, west, north, east
+
+
+def clusters(device_ids, z, x, y, start=None, end=None):
+    """The clusters of the devices' points in a tile, from the cache when
+    none of the devices has changed since it was made."""
+    versions = list(TrackerDevice.objects.filter(
+        pk__in=device_ids).order_by('pk').values_list('pk', 'updated'))
+    key = 'tile:' + hashlib.md5(repr((
+        z, x, y, versions, start, end,
+    )).encode('utf-8')).hexdigest()
+    found = cache.get(key)
+    if found is None:
+        found = _cluster(device_ids, z, x, y, start, end)
+        cache.set(key, found, CACHE_TIMEOUT)
+    return found
+
+
+def _cluster(device_ids, z, x, y, start, end):
+    """Group a tile's points by geohash cell in the database."""
+    south, west, north, east = bounds(z, x, y)
+    inside = Q()
+    for low, high in geohash.cover(south, west, north, east):
+        inside |= Q(geohash__gte=low, geohash__lt=high)
+    points = DataPoint.objects.filter(device__in=device_ids).filter(
+        inside, lat__gte=south, lat__lt=north, lng__gte=west, lng__lt=east)
+    if start is not None:
+        points = points.filter(time__gte=start)
+    if end is not None:
+        points = points.filter(time__lte=end)
+    cell = ExpressionWrapper(
+        F('geohash') / Value(2 ** _shift(z)), output_field=BigIntegerField())
+    rows = points.annotate(cell=cell).values('cell').annotate(
+        count=Count('id'), lat=Avg('lat'), lng=Avg('lng')).order_by('cell')
+    return [
+        {'lat': row['lat'], 'lng': row['lng'], 'count': row['count']}
+        for row in rows
+    ]
+
+
+def _shift(z):
+    """Low geohash bits dropped to leave cells about 1/GRID of a tile at
+    zoom z across."""
+    bits = min(z + int(math.log2(GRID)), geohash.BITS)
+    return 2 * (geohash.BITS - bits)
@@ -0,0 +1,20 @@
+"""Times as integer microseconds since the epoch.
+
+The spool, archive, mirror and route tracks all store a point's time as
+a count of microseconds since 1970-01-01 UTC; these convert to and from
+the aware datetimes the models use."""
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_micros(value):
+    """An aware datetime as microseconds since the epoch."""
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value):
+    """Microseconds since the epoch as an aware datetime."""
+    return EPOCH + timedelta(microseconds=int(value))
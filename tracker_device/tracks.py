@@ -0,0 +1,236 @@
+"""Compressed tracks of each route's data points.
+
+A route's track is built from its data points the first time it is
+read and stored on the route, so showing or exporting a finished route
+decodes one small blob instead of fetching every point. The blob is a
+header followed by zlib compressed columns::
+
+    header    magic b'RT', version (uint8), pad byte, the route's start
+              and end in microseconds since the epoch (int64, end OPEN
+              for a route still in progress), point count (uint32)
+    columns   time in microseconds, lat and lng in ten millionths of a
+              degree, elevation in centimeters, each int64 and delta
+              encoded against the point before
+
+save_points marks the tracks of routes overlapping new points out of
+date, and a route whose start or end no longer matches its track's
+header is rebuilt too. Each invalidation bumps the route's
+track_version, and a rebuild only stores its track if the version it
+started from is still current, so a track is never saved without points
+that arrived while it was being built. Stored tracks are always built
+from the database and archive; the data point mirror, which may be
+missing points, is only read for routes in progress, and not stored.
+
+Only routes of up to MAX_TRACK_POINTS points get a stored track, which
+bounds the memory decoding one takes. `stream`, which the GeoJSON track
+and exports read, makes TrackPoints a chunk at a time, and streams
+longer routes from the database and archive as they are sent."""
+import struct
+import zlib
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+from django.db.models import F, Q
+from django.utils import timezone
+
+from tracker_device import archive, mirror
+from tracker_device.models import Route
+from tracker_device.timeutil import from_micros, to_micros
+
+MAGIC = b'RT'
+VERSION = 1
+HEADER = struct.Struct('<2sBxqqI')
+OPEN = -2 ** 63
+DEGREE_SCALE = 10 ** 7
+ELEVATION_SCALE = 100
+MAX_TRACK_POINTS = 100000
+CHUNK_SIZE = 1000
+
+TrackPoint = namedtuple('TrackPoint', 'time lat lng elevation')
+# A track's points as arrays: time in microseconds since the epoch, lat
+# and lng in degrees, elevation in meters.
+Columns = namedtuple('Columns', 'time lat lng elevation')
+
+
+class TrackError(ValueError):
+    """Raised when a blob isn't a valid track."""
+
+
+def columns(route):
+    """The route's points as Columns, oldest first.
+
+    Decoded from the route's track, which is rebuilt first if it is
+    missing or out of date. With points mirrored, a route still in
+    progress is read from the mirror instead and nothing is stored:
+    every new point would make its track out of date again. Those
+    columns are views of the mirror's mapped file, not copies."""
+    found = _current(route)
+    if found is not None:
+        return found
+    if route.end is None and mirror.enabled():
+        return mirrored(route)
+    return rebuild(route)
+
+
+def points(route):
+    """The route's points as TrackPoints, oldest first."""
+    return list(rows(columns(route)))
+
+
+def stream(route):
+    """The route's points as TrackPoints, oldest first, made as they are
+    iterated.
+
+    Decoded from the route's track when it is current; otherwise read
+    from the database and archive a chunk at a time, without building
+    the track, so memory use doesn't grow with the route's length."""
+    found = _current(route)
+    if found is not None:
+        return rows(found)
+    return (
+        TrackPoint(*point)
+        for point in archive.window(route.device_id, route.start, route.end))
+
+
+def rows(found, chunk_size=CHUNK_SIZE):
+    """Yield the TrackPoints of Columns, a chunk at a time."""
+    for start in range(0, len(found.time), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        times = (
+            from_micros(micros) for micros in found.time[chunk].tolist())
+        for point in zip(times, found.lat[chunk].tolist(),
+                         found.lng[chunk].tolist(),
+                         found.elevation[chunk].tolist()):
+            yield TrackPoint(*point)
+
+
+def mirrored(route):
+    """The route's points read from the device's mirror, not stored.
+
+    The mirror is appended to after commit and can miss points, so only
+    reads that aren't kept come from it."""
+    records = mirror.window(route.device_id, route.start, route.end)
+    return Columns(
+        records['time'], records['lat'], records['lng'],
+        records['elevation'])
+
+
+def rebuild(route):
+    """Build the route's track, storing it unless the route has more than
+    MAX_TRACK_POINTS points, and return its Columns.
+
+    Always read from the database and archive, which have every point,
+    into arrays a chunk at a time."""
+    chunks = []
+    found = archive.window(route.device_id, route.start, route.end)
+    while True:
+        chunk = list(islice(found, CHUNK_SIZE))
+        if not chunk:
+            break
+        chunks.append((
+            np.array([to_micros(point[0]) for point in chunk], dtype='<i8'),
+            np.array([point[1:4] for point in chunk], dtype=float)))
+    time = np.concatenate([chunk[0] for chunk in chunks] or [
+        np.zeros(0, dtype='<i8')])
+    coordinates = np.concatenate([chunk[1] for chunk in chunks] or [
+        np.zeros((0, 3))]).T
+    if len(time) > MAX_TRACK_POINTS:
+        return Columns(time, *coordinates)
+    track = encode_columns(route.start, route.end, time, *coordinates)
+    updated = Route.objects.filter(
+        pk=route.pk, track_version=route.track_version,
+    ).update(track=track)
+    if updated:
+        route.track = track
+    # As later reads decode it, to the track's precision.
+    return decode_columns(track)[1]
+
+
+def _current(route):
+    """The Columns of the route's stored track, None if it has none or
+    it is out of date."""
+    if route.track is None:
+        return None
+    window, found = decode_columns(bytes(route.track))
+    if window != (_micros(route.start), _micros(route.end)):
+        return None
+    return found
+
+
+def invalidate(device_id, first, last):
+    """Mark the tracks of routes with points between first and last out
+    of date.
+
+    A device_id of None covers every device, and a first of None every
+    point up to last."""
+    routes = Route.objects.filter(start__lte=last)
+    if device_id is not None:
+        routes = routes.filter(device_id=device_id)
+    if first is not None:
+        routes = routes.filter(Q(end__isnull=True) | Q(end__gte=first))
+    return routes.update(
+        track=None, track_version=F('track_version') + 1,
+        updated=timezone.now())
+
+
+def encode(start, end, points):
+    """Encode (time, lat, lng, elevation) points, oldest first, as the
+    track of a route from start to end."""
+    coordinates = np.array(
+        [point[1:] for point in points], dtype=float).reshape(-1, 3).T
+    return encode_columns(
+        start, end, [_micros(point[0]) for point in points], *coordinates)
+
+
+def encode_columns(start, end, time, lat, lng, elevation):
+    """Encode columns of points, oldest first, as the track of a route from
+    start to end. Times are microseconds since the epoch."""
+    count = len(time)
+    columns = np.zeros((4, count), dtype='<i8')
+    if count:
+        columns[0] = time
+        columns[1] = np.round(np.asarray(lat) * DEGREE_SCALE)
+        columns[2] = np.round(np.asarray(lng) * DEGREE_SCALE)
+        columns[3] = np.round(np.asarray(elevation) * ELEVATION_SCALE)
+        columns[:, 1:] = np.diff(columns, axis=1)
+    header = HEADER.pack(
+        MAGIC, VERSION, _micros(start), _micros(end), count)
+    return header + zlib.compress(columns.tobytes())
+
+
+def decode(track):
+    """Decode a track into its ((start, end), points), the points made as
+    they are iterated.
+
+    start and end are in microseconds since the epoch, end OPEN for a
+    route in progress."""
+    window, found = decode_columns(track)
+    return window, rows(found)
+
+
+def decode_columns(track):
+    """Decode a track into its ((start, end), Columns)."""
+    if len(track) < HEADER.size:
+        raise TrackError('Track is shorter than its header.')
+    magic, version, start, end, count = HEADER.unpack_from(track)
+    if magic != MAGIC or version != VERSION:
+        raise TrackError('Not a version {} track.'.format(VERSION))
+    try:
+        body = zlib.decompress(track[HEADER.size:])
+    except zlib.error as error:
+        raise TrackError(str(error))
+    if len(body) != 4 * count * 8:
+        raise TrackError('Track holds the wrong number of points.')
+    found = np.cumsum(np.frombuffer(body, dtype='<i8').reshape(4, count),
+                      axis=1)
+    return (start, end), Columns(
+        found[0], found[1] / DEGREE_SCALE, found[2] / DEGREE_SCALE,
+        found[3] / ELEVATION_SCALE)
+
+
+def _micros(value):
+    """An aware datetime as microseconds since the epoch, None as OPEN."""
+    if value is None:
+        return OPEN
+    return to_micros(value)
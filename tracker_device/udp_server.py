@@ -0,0 +1,200 @@
+"""UDP ingest for devices that send each fix as one datagram.
+
+A datagram is either the form encoded body a device would POST to
+/device/data/create (uuid, time, lat, lng and elevation) or a packed
+payload as described in tracker_device.packed. Nothing is sent back.
+
+Fixes are held for a short reorder window so that datagrams overtaking
+each other are still written in time order per device, then handed to a
+PointBatcher to be written in batches. Counters of what happened to
+every datagram are kept in `UDPIngestProtocol.counters`; datagrams from
+devices over their rate limit are dropped and counted as limited. Run it
+with ``python manage.py runudpingest``."""
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import DatabaseError
+from django.http import QueryDict
+
+from tracker import metrics
+from tracker_device import packed
+from tracker_device.device_cache import device_cache, UNKNOWN
+from tracker_device.ingest import clean_points
+from tracker_device.ingest_server import resolve_device
+from tracker_device.ratelimit import retry_after
+
+COUNTERS = (
+    'received',
+    'malformed',
+    'unknown_device',
+    'limited',
+    'dropped',
+    'late',
+    'saved',
+    'duplicates',
+)
+
+logger = logging.getLogger(__name__)
+
+
+class UDPIngestProtocol(asyncio.DatagramProtocol):
+    """Receives fixes, reorders them briefly and queues them for writing.
+
+    Fixes are released once they have waited `window` seconds. At most
+    `max_pending` fixes are held; datagrams arriving when that many are
+    waiting are dropped."""
+
+    def __init__(self, batcher, window=2.0, max_pending=100000,
+                 lookups=None, clock=time.monotonic):
+        self.batcher = batcher
+        self.window = window
+        self.max_pending = max_pending
+        self.lookups = lookups or ThreadPoolExecutor(max_workers=2)
+        self.clock = clock
+        self.counters = Counter(dict((name, 0) for name in COUNTERS))
+        self.pending = []
+        self.released = {}
+        self.tasks = set()
+        self.task = None
+
+    def start(self):
+        """Start releasing fixes on the current event loop."""
+        self.task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        """Stop, writing everything still held.
+
+        The batcher has to keep running until this returns."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.settle()
+        await self.release(everything=True)
+        await self.settle()
+
+    def datagram_received(self, data, addr):
+        """Parse a datagram and hold its fixes."""
+        self.counters['received'] += 1
+        parsed = parse_datagram(data)
+        if parsed is None:
+            self.counters['malformed'] += 1
+            return
+        uuid, points = parsed
+        if retry_after(uuid):
+            self.counters['limited'] += 1
+            return
+        device = device_cache.peek(uuid)
+        if device is UNKNOWN:
+            self.track(self.resolve_and_hold(uuid, points))
+        else:
+            if device is None:
+                metrics.ingest_rejected.inc('unknown_uuid')
+            self.hold(device, points)
+
+    async def resolve_and_hold(self, uuid, points):
+        """Look an uncached UUID up off the event loop, then hold.
+
+        The fixes are dropped if the lookup fails."""
+        try:
+            device = await asyncio.get_event_loop().run_in_executor(
+                self.lookups, resolve_device, uuid)
+        except DatabaseError:
+            logger.exception('Looking up device %s failed', uuid)
+            self.counters['dropped'] += len(points)
+            return
+        self.hold(device, points)
+
+    def hold(self, device, points):
+        """Add fixes to the reorder buffer."""
+        if device is None:
+            self.counters['unknown_device'] += 1
+            return
+        if len(self.pending) + len(points) > self.max_pending:
+            self.counters['dropped'] += len(points)
+            return
+        arrived = self.clock()
+        for point in points:
+            self.pending.append((arrived, device.id, point))
+
+    async def run(self):
+        """Release held fixes a few times per window."""
+        while True:
+            await asyncio.sleep(self.window / 4)
+            await self.release()
+
+    async def release(self, everything=False):
+        """Queue fixes that have waited out the window, in time order."""
+        cutoff = self.clock() - self.window
+        ready = [
+            entry for entry in self.pending
+            if everything or entry[0] <= cutoff
+        ]
+        if not ready:
+            return
+        self.pending = [
+            entry for entry in self.pending
+            if not everything and entry[0] > cutoff
+        ]
+        by_device = defaultdict(list)
+        for arrived, device_id, point in ready:
+            by_device[device_id].append(point)
+        for device_id, points in by_device.items():
+            points.sort(key=lambda point: point[0])
+            last = self.released.get(device_id)
+            if last is not None:
+                self.counters['late'] += sum(
+                    1 for point in points if point[0] < last)
+            self.released[device_id] = max(last or points[-1][0],
+                                           points[-1][0])
+            self.track(self.write(device_id, points))
+
+    async def write(self, device_id, points):
+        """Hand fixes to the batcher and count the outcome."""
+        try:
+            created = await self.batcher.submit(device_id, points)
+        except Exception:
+            self.counters['dropped'] += len(points)
+            return
+        if created is None:
+            self.counters['unknown_device'] += len(points)
+            return
+        self.counters['saved'] += created
+        self.counters['duplicates'] += len(points) - created
+
+    async def settle(self):
+        """Wait for lookups and writes in flight to finish."""
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+    def track(self, coroutine):
+        """Run a coroutine as a task, remembered until it finishes."""
+        task = asyncio.get_event_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+def parse_datagram(data):
+    """Return (uuid, points) for a datagram, None if it's malformed.
+
+    Fixes are validated with the same rules as the HTTP endpoints."""
+    if data.startswith(packed.MAGIC):
+        try:
+            uuid, time, lat, lng, elevation = packed.decode(data)
+        except packed.PackedError:
+            return None
+        return uuid, packed.to_points(time, lat, lng, elevation)
+    try:
+        fields = QueryDict(data.decode('utf-8'))
+    except UnicodeDecodeError:
+        return None
+    points, errors = clean_points([fields.dict()])
+    if errors or not fields.get('uuid'):
+        return None
+    return fields['uuid'], points
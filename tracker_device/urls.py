@@ -7,8 +7,18 @@ from tracker_device.views import (
     EditRouteView,
     DeleteRouteView,
     CreateDataPointView,
+    CreateDataPointBatchView,
+    CreateDataPointPackedView,
     DetailDeviceView,
     DetailRouteView,
+    AreaPointsView,
+    DevicePointsView,
+    RouteTrackView,
+    DeviceTrackView,
+    RouteLineView,
+    TileView,
+    RouteExportView,
+    DeviceExportView,
 )
 
 urlpatterns = [
@@ -47,6 +57,16 @@ urlpatterns = [
         CreateDataPointView.as_view(),
         name='create_data_point'
     ),
+    url(
+        r'^data/(?P<uuid>[0-9a-fA-F-]{32,36})/batch$',
+        CreateDataPointBatchView.as_view(),
+        name='create_data_point_batch'
+    ),
+    url(
+        r'^data/packed$',
+        CreateDataPointPackedView.as_view(),
+        name='create_data_point_packed'
+    ),
     url(
         r'^(?P<pk>[0-9]+)/detail$',
         DetailDeviceView.as_view(),
@@ -57,4 +77,44 @@ urlpatterns = [
         DetailRouteView.as_view(),
         name='detail_route'
     ),
+    url(
+        r'^data/area$',
+        AreaPointsView.as_view(),
+        name='area_points'
+    ),
+    url(
+        r'^(?P<pk>[0-9]+)/points$',
+        DevicePointsView.as_view(),
+        name='device_points'
+    ),
+    url(
+        r'^route/(?P<pk>[0-9]+)/track\.json$',
+        RouteTrackView.as_view(),
+        name='route_track'
+    ),
+    url(
+        r'^(?P<pk>[0-9]+)/track\.json$',
+        DeviceTrackView.as_view(),
+        name='device_track'
+    ),
+    url(
+        r'^route/(?P<pk>[0-9]+)/line$',
+        RouteLineView.as_view(),
+        name='route_line'
+    ),
+    url(
+        r'^tiles/(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)\.json$',
+        TileView.as_view(),
+        name='tile'
+    ),
+    url(
+        r'^route/(?P<pk>[0-9]+)/export\.(?P<format>csv|gpx|kml)$',
+        RouteExportView.as_view(),
+        name='route_export'
+    ),
+    url(
+        r'^(?P<pk>[0-9]+)/export\.(?P<format>csv|gpx|kml)$',
+        DeviceExportView.as_view(),
+        name='device_export'
+    ),
 ]
@@ -1,12 +1,53 @@
+import math
 import os
+from datetime import timedelta
 from django import forms
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
 from django.urls import reverse, reverse_lazy
+from django.db import IntegrityError
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
 from tracker_device.models import TrackerDevice, Route, DataPoint
-from django.http import HttpResponseForbidden, HttpResponseRedirect
+from tracker_device.device_cache import device_cache
+from tracker_device import (
+    archive,
+    export,
+    geohash,
+    geojson,
+    packed,
+    page_cache,
+    rollups,
+    simplify,
+    sync,
+    tiles,
+    tracks,
+)
+from tracker_device.conditional import (
+    conditional,
+    device_validators,
+    route_validators,
+)
+from tracker_device.ratelimit import retry_after
+from tracker_device.ingest import (
+    PayloadError,
+    parse_payload,
+    clean_points,
+    accept_points,
+)
+from django.shortcuts import get_object_or_404
+from django.http import (
+    Http404,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.views.generic import (
+    View,
     CreateView,
     UpdateView,
     DeleteView,
@@ -14,6 +55,13 @@ from django.views.generic import (
 )
 
 
+ACTIVITY_DAYS = 30
+AREA_LIMIT = 1000
+AREA_LIMIT_MAX = 10000
+SYNC_LIMIT_MAX = 10000
+DEVICE_TRACK_HOURS = 24
+
+
 class CreateDeviceView(LoginRequiredMixin, CreateView):
     """View for creating a new device."""
     model = TrackerDevice
@@ -77,6 +125,7 @@ class DeleteDeviceView(DeleteView):
             return HttpResponseForbidden()
 
 
+@method_decorator(conditional(device_validators), name='dispatch')
 class DetailDeviceView(DetailView):
     """Show device details- routes and data points that belong to that
     device and display map"""
@@ -85,15 +134,30 @@ class DetailDeviceView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(DetailDeviceView, self).get_context_data(**kwargs)
-        pk = kwargs['object'].pk
-        device = TrackerDevice.objects.filter(pk=pk).first()
+        device = self.object
         context['device'] = device
-        routes = device.routes.all()
-        context['routes'] = routes
         context['googleapikey'] = os.environ.get('GOOGLE_MAPS_API_KEY')
-        context['data'] = device.data.order_by('-time')[:10]
+        context['tile_max_zoom'] = tiles.MAX_ZOOM
+        context.update(page_cache.device_page(device, self.page_data))
+        activity = context['activity']
+        context['activity_points'] = sum(day.point_count for day in activity)
+        context['activity_km'] = sum(day.distance for day in activity) / 1000
         return context
 
+    def page_data(self):
+        """The routes, latest points and activity the page shows."""
+        device = self.object
+        since = timezone.now() - timedelta(days=ACTIVITY_DAYS)
+        return {
+            'routes': list(device.routes.defer('track')),
+            'data': [
+                tracks.TrackPoint(*point)
+                for point in archive.most_recent(device.pk, 10)
+            ],
+            'activity': list(device.daily_rollups.filter(
+                start__gte=rollups.day_start(since)).order_by('-start')),
+        }
+
     def dispatch(self, request, *args, **kwargs):
         """Check if the device to view is owned by user."""
         pk = kwargs.get('pk')
@@ -189,11 +253,13 @@ class DeleteRouteView(DeleteView):
         return auth_errors or super_dispatch(request, *args, **kwargs)
 
 
+@method_decorator(conditional(route_validators), name='dispatch')
 class DetailRouteView(DetailView):
     """Show route details- data points that belong to that
     route and display them on a map."""
     model = Route
     template_name = 'tracker_device/detail_route.html'
+    queryset = Route.objects.defer('track')
 
     def get_context_data(self, **kwargs):
         context = super(DetailRouteView, self).get_context_data(**kwargs)
@@ -202,14 +268,20 @@ class DetailRouteView(DetailView):
         device = route.device
         context['device'] = device
         context['googleapikey'] = os.environ.get('GOOGLE_MAPS_API_KEY')
-        context['data_ten'] = DataPoint.objects.filter(
-            time__range=(route.start, route.end)).filter(
-            device=device).order_by('-time')[:10]
-        context['data'] = DataPoint.objects.filter(
-            time__range=(route.start, route.end)).filter(
-            device=device)
+        context.update(page_cache.route_page(route, self.page_data))
         return context
 
+    def page_data(self):
+        """The map's center and latest points the page shows."""
+        found = tracks.columns(self.object)
+        latest = tracks.Columns(*(column[:-11:-1] for column in found))
+        return {
+            'center': (
+                (float(found.lat[0]), float(found.lng[0]))
+                if len(found.lat) else None),
+            'data_ten': list(tracks.rows(latest)),
+        }
+
     def dispatch(self, request, *args, **kwargs):
         auth_errors = verify_route_ownership(request.user, kwargs.get('pk'))
         super_dispatch = super(DetailRouteView, self).dispatch
@@ -229,8 +301,8 @@ class CreateDataPointForm(forms.ModelForm):
     def clean(self):
         """Ensure UUID being submitted is attached to a device."""
         cleaned_data = super(CreateDataPointForm, self).clean()
-        uuid = cleaned_data.get('uuid')
-        if TrackerDevice.objects.filter(id_uuid=uuid).count() == 0:
+        self.device = device_cache.resolve(cleaned_data.get('uuid'))
+        if self.device is None:
             error = forms.ValidationError('Bad UUID')
             self.add_error('uuid', error)
 
@@ -243,12 +315,471 @@ class CreateDataPointView(CreateView):
     template_name = 'tracker_device/create_data_point.html'
     success_url = reverse_lazy('homepage')
 
+    def post(self, request, *args, **kwargs):
+        """Turn the device away before validating if it's over its limit."""
+        wait = retry_after(request.POST.get('uuid'))
+        if wait:
+            return too_many_requests(wait)
+        return super(CreateDataPointView, self).post(request, *args, **kwargs)
+
     def form_valid(self, form):
-        """Attach the right device to the form.
+        """Save or spool the point for the form's device.
 
-        `device` will never be None because this view's form verifies
+        `form.device` will never be None because this view's form verifies
         that the UUID exists."""
-        uuid = form.data['uuid']
-        device = TrackerDevice.objects.filter(id_uuid=uuid).first()
-        form.instance.device = device
-        return super(CreateDataPointView, self).form_valid(form)
+        data = form.cleaned_data
+        point = (data['time'], data['lat'], data['lng'], data['elevation'])
+        try:
+            accept_points(form.device.id, [point])
+        except IntegrityError:
+            if not forget_deleted_device(form.device.id, data['uuid']):
+                raise
+            form.add_error('uuid', forms.ValidationError('Bad UUID'))
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.success_url)
+
+
+def forget_deleted_device(device_id, uuid):
+    """Whether a device is gone, evicting its UUID from the device cache
+    if so.
+
+    The cache can resolve a device deleted by another process for up to
+    DEVICE_CACHE_TTL, until saving its points fails on the foreign key."""
+    if TrackerDevice.objects.filter(pk=device_id).exists():
+        return False
+    device_cache.evict(uuid)
+    return True
+
+
+def too_many_requests(wait):
+    """Return a 429 telling a device how long to wait."""
+    response = JsonResponse(
+        {'errors': {'uuid': ['Too many requests']}}, status=429)
+    response['Retry-After'] = str(int(math.ceil(wait)))
+    return response
+
+
+def accepted_response(device_id, points, uuid):
+    """Save or spool points and say which happened.
+
+    Saved points get a 201 along with how many were already stored,
+    spooled points a 202 since they are only written once the spool is
+    drained. A device deleted since its UUID was cached gets a 400."""
+    try:
+        created = accept_points(device_id, points)
+    except IntegrityError:
+        if not forget_deleted_device(device_id, uuid):
+            raise
+        return JsonResponse({'errors': {'uuid': ['Bad UUID']}}, status=400)
+    if created is None:
+        return JsonResponse({'accepted': len(points)}, status=202)
+    duplicates = len(points) - created
+    return JsonResponse(
+        {'created': created, 'duplicates': duplicates}, status=201)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CreateDataPointBatchView(View):
+    """View for adding many data points for one device at once.
+
+    Takes a JSON array of objects or a CSV file with a header row, each
+    point having time, lat, lng and elevation. Either every point is
+    saved or none are."""
+
+    def post(self, request, *args, **kwargs):
+        """Validate the whole payload, then bulk insert it."""
+        wait = retry_after(kwargs.get('uuid'))
+        if wait:
+            return too_many_requests(wait)
+        device = device_cache.resolve(kwargs.get('uuid'))
+        if device is None:
+            return JsonResponse({'errors': {'uuid': ['Bad UUID']}}, status=400)
+        try:
+            rows = parse_payload(request.body, request.content_type)
+        except PayloadError as error:
+            errors = {'payload': [str(error)]}
+            return JsonResponse({'errors': errors}, status=400)
+        points, errors = clean_points(rows)
+        if errors:
+            return JsonResponse({'errors': errors}, status=400)
+        return accepted_response(device.id, points, kwargs.get('uuid'))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CreateDataPointPackedView(View):
+    """View for adding data points sent in the packed binary format.
+
+    See tracker_device.packed for the layout. The device UUID is part of
+    the payload header."""
+
+    def post(self, request, *args, **kwargs):
+        """Decode the payload and bulk insert its points."""
+        try:
+            columns = packed.decode(request.body)
+        except packed.PackedError as error:
+            errors = {'payload': [str(error)]}
+            return JsonResponse({'errors': errors}, status=400)
+        uuid, time, lat, lng, elevation = columns
+        wait = retry_after(uuid)
+        if wait:
+            return too_many_requests(wait)
+        device = device_cache.resolve(uuid)
+        if device is None:
+            return JsonResponse({'errors': {'uuid': ['Bad UUID']}}, status=400)
+        limit = settings.DATA_POINT_BATCH_LIMIT
+        if len(time) > limit:
+            message = 'At most {} points per request.'.format(limit)
+            return JsonResponse({'errors': {'payload': [message]}}, status=400)
+        points = packed.to_points(time, lat, lng, elevation)
+        return accepted_response(device.id, points, uuid)
+
+
+class AreaQueryForm(forms.Form):
+    """Bounding box, time range and devices for an area query."""
+    south = forms.FloatField(min_value=-90, max_value=90)
+    west = forms.FloatField(min_value=-180, max_value=180)
+    north = forms.FloatField(min_value=-90, max_value=90)
+    east = forms.FloatField(min_value=-180, max_value=180)
+    start = forms.DateTimeField(required=False)
+    end = forms.DateTimeField(required=False)
+    device = forms.ModelMultipleChoiceField(
+        queryset=TrackerDevice.objects.none(), required=False)
+    mode = forms.ChoiceField(
+        choices=[('points', 'points'), ('devices', 'devices')],
+        required=False)
+    limit = forms.IntegerField(
+        min_value=1, max_value=AREA_LIMIT_MAX, required=False)
+
+    def __init__(self, *args, **kwargs):
+        """Limit the device field to the user's devices."""
+        user = kwargs.pop('user')
+        super(AreaQueryForm, self).__init__(*args, **kwargs)
+        queryset = TrackerDevice.objects.filter(user=user)
+        self.fields['device'].queryset = queryset
+
+    def clean(self):
+        """Check the box and time range are the right way round."""
+        cleaned_data = super(AreaQueryForm, self).clean()
+        south, north = cleaned_data.get('south'), cleaned_data.get('north')
+        if south is not None and north is not None and south > north:
+            self.add_error('north', 'North must not be below south.')
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            self.add_error('end', 'End must not be before start.')
+        return cleaned_data
+
+
+class AreaPointsView(LoginRequiredMixin, View):
+    """The user's data points inside a bounding box, as JSON.
+
+    Takes south, west, north and east, with west greater than east for a
+    box crossing the antimeridian, and optionally start, end and one or
+    more device ids. With mode=devices, returns each device's count and
+    first and last time in the box instead of the points. Archived points
+    aren't included."""
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        """Find the box's points with geohash range scans."""
+        form = AreaQueryForm(request.GET, user=request.user)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        data = form.cleaned_data
+        points = self.points(data)
+        if data['mode'] == 'devices':
+            devices = points.values('device').annotate(
+                count=Count('id'), first=Min('time'), last=Max('time'),
+            ).order_by('device')
+            return JsonResponse({'devices': list(devices)})
+        limit = data['limit'] or AREA_LIMIT
+        rows = list(points.order_by('device', 'time').values_list(
+            'device', 'time', 'lat', 'lng', 'elevation', 'geohash',
+        )[:limit + 1])
+        return JsonResponse({
+            'points': [
+                {
+                    'device': device,
+                    'time': time,
+                    'lat': lat,
+                    'lng': lng,
+                    'elevation': elevation,
+                    'geohash': geohash.to_string(value),
+                }
+                for device, time, lat, lng, elevation, value in rows[:limit]
+            ],
+            'truncated': len(rows) > limit,
+        })
+
+    def points(self, data):
+        """The points a valid form asks for.
+
+        The geohash ranges narrow the search to a few index range scans;
+        they reach past the box, so lat and lng are checked as well."""
+        device_ids = [device.pk for device in data['device']]
+        if not device_ids:
+            device_ids = list(
+                self.request.user.devices.values_list('pk', flat=True))
+        inside = Q()
+        for low, high in geohash.cover(
+                data['south'], data['west'], data['north'], data['east']):
+            inside |= Q(geohash__gte=low, geohash__lt=high)
+        if data['west'] <= data['east']:
+            lng = Q(lng__gte=data['west'], lng__lte=data['east'])
+        else:
+            lng = Q(lng__gte=data['west']) | Q(lng__lte=data['east'])
+        points = DataPoint.objects.filter(device__in=device_ids).filter(
+            inside, lng, lat__gte=data['south'], lat__lte=data['north'])
+        if data['start']:
+            points = points.filter(time__gte=data['start'])
+        if data['end']:
+            points = points.filter(time__lte=data['end'])
+        return points
+
+
+class SyncQueryForm(forms.Form):
+    """Order, cursor and page size for the device points API."""
+    order = forms.ChoiceField(
+        choices=[(order, order) for order in sorted(sync.ORDERS)],
+        required=False)
+    cursor = forms.CharField(required=False)
+    limit = forms.IntegerField(
+        min_value=1, max_value=SYNC_LIMIT_MAX, required=False)
+
+    def clean(self):
+        """Default the order and check the cursor belongs to it."""
+        cleaned_data = super(SyncQueryForm, self).clean()
+        cleaned_data['order'] = cleaned_data.get('order') or 'time'
+        cursor = cleaned_data.get('cursor')
+        if cursor:
+            try:
+                sync.decode_cursor(cursor, cleaned_data['order'])
+            except sync.CursorError as error:
+                self.add_error('cursor', str(error))
+        return cleaned_data
+
+
+class DevicePointsView(LoginRequiredMixin, View):
+    """A page of one of the user's devices' data points, as JSON.
+
+    Takes order (time or received), the cursor returned with the previous
+    page, and limit. Responds with the points, the cursor to pass next
+    time and whether more points are waiting; see tracker_device.sync."""
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        """Return the page after the cursor."""
+        device = get_object_or_404(request.user.devices, pk=kwargs['pk'])
+        form = SyncQueryForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        data = form.cleaned_data
+        rows, cursor, more = sync.page(
+            device.pk, data['order'], data['cursor'] or None,
+            data['limit'] or sync.PAGE_SIZE)
+        names = ('id', 'time', 'lat', 'lng', 'elevation', 'received')
+        return JsonResponse({
+            'points': [dict(zip(names, row)) for row in rows],
+            'cursor': cursor,
+            'more': more,
+        })
+
+
+@method_decorator(conditional(route_validators), name='dispatch')
+@method_decorator(gzip_page, name='dispatch')
+class RouteTrackView(View):
+    """A route's points as streamed GeoJSON, for the route page's map."""
+
+    def get(self, request, *args, **kwargs):
+        """Stream the points of the route's track."""
+        route = get_object_or_404(Route, pk=kwargs['pk'])
+        return StreamingHttpResponse(
+            geojson.stream(tracks.stream(route)),
+            content_type=geojson.CONTENT_TYPE)
+
+    def dispatch(self, request, *args, **kwargs):
+        auth_errors = verify_route_ownership(request.user, kwargs.get('pk'))
+        super_dispatch = super(RouteTrackView, self).dispatch
+        return auth_errors or super_dispatch(request, *args, **kwargs)
+
+
+class TrackQueryForm(forms.Form):
+    """Optional time range of a device track."""
+    start = forms.DateTimeField(required=False)
+    end = forms.DateTimeField(required=False)
+
+
+@method_decorator(conditional(device_validators), name='dispatch')
+@method_decorator(gzip_page, name='dispatch')
+class DeviceTrackView(View):
+    """A device's points as streamed GeoJSON, for the device page's map.
+
+    Takes optional start and end; without a start, the track covers the
+    DEVICE_TRACK_HOURS up to the end or the device's last fix. Points are
+    read from the database a chunk at a time as the response is sent."""
+
+    def get(self, request, *args, **kwargs):
+        """Stream the points in the range."""
+        device = request.user.devices.get(pk=kwargs['pk'])
+        form = TrackQueryForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        start, end = form.cleaned_data['start'], form.cleaned_data['end']
+        points = []
+        if start is None and (end or device.last_time):
+            start = (end or device.last_time) - timedelta(
+                hours=DEVICE_TRACK_HOURS)
+        if start is not None:
+            points = archive.window(device.pk, start, end)
+        return StreamingHttpResponse(
+            geojson.stream(points), content_type=geojson.CONTENT_TYPE)
+
+    def dispatch(self, request, *args, **kwargs):
+        """Check if the device is owned by user."""
+        pk = kwargs.get('pk')
+        try:
+            device = request.user.devices.filter(pk=pk).first()
+        except AttributeError:
+            return HttpResponseRedirect(reverse('auth_login'))
+        if device:
+            super_dispatch = super(DeviceTrackView, self).dispatch
+            return super_dispatch(request, *args, **kwargs)
+        else:
+            return HttpResponseForbidden()
+
+
+class RouteLineForm(forms.Form):
+    """Zoom and on screen error of a simplified route line."""
+    zoom = forms.IntegerField(min_value=0, max_value=simplify.MAX_ZOOM)
+    pixels = forms.FloatField(min_value=0.1, max_value=10, required=False)
+
+
+@method_decorator(conditional(route_validators), name='dispatch')
+class RouteLineView(View):
+    """A route simplified for a map zoom, as a Google encoded polyline.
+
+    Takes zoom and optionally pixels, the error allowed on screen. Returns
+    the polyline with how many of the route's points it kept."""
+
+    def get(self, request, *args, **kwargs):
+        """Return the route's line for the zoom, cached per zoom."""
+        route = get_object_or_404(Route, pk=kwargs['pk'])
+        form = RouteLineForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        zoom = form.cleaned_data['zoom']
+        pixels = form.cleaned_data['pixels'] or simplify.PIXELS
+        line = simplify.route_line(route, zoom, pixels)
+        return JsonResponse(dict(line, zoom=zoom, pixels=pixels))
+
+    def dispatch(self, request, *args, **kwargs):
+        auth_errors = verify_route_ownership(request.user, kwargs.get('pk'))
+        super_dispatch = super(RouteLineView, self).dispatch
+        return auth_errors or super_dispatch(request, *args, **kwargs)
+
+
+class TileQueryForm(forms.Form):
+    """Devices and time range of a clustered tile."""
+    start = forms.DateTimeField(required=False)
+    end = forms.DateTimeField(required=False)
+    device = forms.ModelMultipleChoiceField(
+        queryset=TrackerDevice.objects.none(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        """Limit the device field to the user's devices."""
+        user = kwargs.pop('user')
+        super(TileQueryForm, self).__init__(*args, **kwargs)
+        queryset = TrackerDevice.objects.filter(user=user)
+        self.fields['device'].queryset = queryset
+
+
+class TileView(LoginRequiredMixin, View):
+    """The user's points in a z/x/y map tile, clustered, as JSON.
+
+    Takes optional start, end and one or more device ids, all the user's
+    devices without any. Each cluster has the mean position and count of
+    the points in a cell about a sixteenth of the tile across; see
+    tracker_device.tiles. Archived points aren't included."""
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        """Return the tile's clusters, cached until new points land in
+        it."""
+        z, x, y = (int(kwargs[name]) for name in ('z', 'x', 'y'))
+        if z > tiles.MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            raise Http404('No such tile.')
+        form = TileQueryForm(request.GET, user=request.user)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        data = form.cleaned_data
+        device_ids = [device.pk for device in data['device']]
+        if not device_ids:
+            device_ids = list(
+                request.user.devices.values_list('pk', flat=True))
+        clusters = tiles.clusters(
+            device_ids, z, x, y, data['start'], data['end'])
+        return JsonResponse({'z': z, 'x': x, 'y': y, 'clusters': clusters})
+
+
+@method_decorator(conditional(route_validators), name='dispatch')
+@method_decorator(gzip_page, name='dispatch')
+class RouteExportView(View):
+    """A route's points as a CSV, GPX or KML download, streamed.
+
+    Decoded from the route's track when it is current, otherwise read
+    lazily from the database and archive; see tracks.stream."""
+
+    def get(self, request, *args, **kwargs):
+        """Stream the points in the route's window."""
+        route = get_object_or_404(Route, pk=kwargs['pk'])
+        return export_response(
+            tracks.stream(route), kwargs['format'],
+            'route-{}'.format(route.pk), route.name)
+
+    def dispatch(self, request, *args, **kwargs):
+        auth_errors = verify_route_ownership(request.user, kwargs.get('pk'))
+        super_dispatch = super(RouteExportView, self).dispatch
+        return auth_errors or super_dispatch(request, *args, **kwargs)
+
+
+@method_decorator(conditional(device_validators), name='dispatch')
+@method_decorator(gzip_page, name='dispatch')
+class DeviceExportView(View):
+    """A device's points as a CSV, GPX or KML download, streamed.
+
+    Takes optional start and end; without them the whole history is
+    exported, archived points included."""
+
+    def get(self, request, *args, **kwargs):
+        """Stream the points in the range."""
+        device = request.user.devices.get(pk=kwargs['pk'])
+        form = TrackQueryForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        points = archive.window(
+            device.pk, form.cleaned_data['start'], form.cleaned_data['end'])
+        return export_response(
+            points, kwargs['format'], 'device-{}'.format(device.pk),
+            device.title)
+
+    def dispatch(self, request, *args, **kwargs):
+        """Check if the device is owned by user."""
+        pk = kwargs.get('pk')
+        try:
+            device = request.user.devices.filter(pk=pk).first()
+        except AttributeError:
+            return HttpResponseRedirect(reverse('auth_login'))
+        if device:
+            super_dispatch = super(DeviceExportView, self).dispatch
+            return super_dispatch(request, *args, **kwargs)
+        else:
+            return HttpResponseForbidden()
+
+
+def export_response(points, format, filename, name):
+    """A streamed download of points in an export format."""
+    content_type, stream = export.FORMATS[format]
+    response = StreamingHttpResponse(
+        stream(points, name), content_type=content_type)
+    response['Content-Disposition'] = export.disposition(
+        '{}.{}'.format(filename, format))
+    return response
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 20:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker_profile', '0002_remove_names_add_latlng'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackerprofile',
+            name='data_retention_months',
+            field=models.PositiveIntegerField(blank=True, help_text='Months of data points to keep. Leave blank for the site default.', null=True),
+        ),
+    ]
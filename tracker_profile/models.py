@@ -23,6 +23,12 @@ class TrackerProfile(models.Model):
     street_address = models.CharField(max_length=2083, blank=True)
     website = models.CharField(max_length=2083, blank=True)
     social_media = models.CharField(max_length=2083, blank=True)
+    data_retention_months = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text='Months of data points to keep. Leave blank for the '
+                  'site default.'
+    )
 
     def __str__(self):
         return "TrackerProfile for {}".format(self.user)
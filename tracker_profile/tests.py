@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.urls import reverse
 from tracker_device.models import TrackerDevice
@@ -63,6 +65,23 @@ class TrackerProfileViewTestCase(TestCase):
         url = reverse('detail_device', args=[self.device.pk])
         self.assertContains(self.response, url)
 
+    def test_device_point_count(self):
+        """Test the profile shows each device's stored point count."""
+        TrackerDevice.objects.filter(pk=self.device.pk).update(
+            point_count=1234)
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, '1234 data point(s)')
+
+    def test_queries_independent_of_devices(self):
+        """Test more devices don't mean more queries."""
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(reverse('profile'))
+        for i in range(5):
+            TrackerDevice(user=self.user).save()
+        with CaptureQueriesContext(connection) as six:
+            self.client.get(reverse('profile'))
+        self.assertEqual(len(six), len(one))
+
     def test_profile_login_required(self):
         """Test profile redirects to login."""
         self.client.logout()
@@ -13,6 +13,12 @@ class ProfileView(LoginRequiredMixin, DetailView):
         """Return the user's profile."""
         return self.request.user.profile
 
+    def get_context_data(self, **kwargs):
+        """Add the user's devices, whose point counts are stored on them."""
+        context = super(ProfileView, self).get_context_data(**kwargs)
+        context['devices'] = self.request.user.devices.order_by('pk')
+        return context
+
 
 class EditProfileView(LoginRequiredMixin, UpdateView):
     """View for profile."""
@@ -25,6 +31,7 @@ class EditProfileView(LoginRequiredMixin, UpdateView):
         'street_address',
         'website',
         'social_media',
+        'data_retention_months',
     ]
     template_name = "tracker_profile/edit_profile.html"
 